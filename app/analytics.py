@@ -0,0 +1,65 @@
+import numpy as np
+
+from app.tefas import Snapshot
+
+
+def return_matrix(fon_list: list[str], months: list[Snapshot], none_value: float = np.nan) -> np.ndarray:
+    """funds × months matrix of GETIRIORANI, one row per fund in ``fon_list``.
+
+    ``months`` are BindComparisonFundReturns snapshots in column order; each
+    cell is a lookup in the month's fund-code index. Funds missing from a
+    month are NaN; a ``None`` GETIRIORANI becomes ``none_value``.
+    """
+    matrix = np.full((len(fon_list), len(months)), np.nan)
+    for c, month in enumerate(months):
+        for r, fon in enumerate(fon_list):
+            item = month.funds.get(fon)
+            if item is not None:
+                delta = item['GETIRIORANI']
+                matrix[r, c] = none_value if delta is None else delta
+    return matrix
+
+
+def usd_adjust(returns: np.ndarray, first_day_usd: np.ndarray, last_day_usd: np.ndarray) -> np.ndarray:
+    """Convert TRY period returns (%) into USD returns (%), broadcast over funds.
+
+    A fund bought at 1 TRY on the first day ends at 1 + delta/100 TRY on the
+    last day; both are priced in USD with that month's USDTTRY closes.
+    """
+    a = 1 / first_day_usd
+    b = (1 + returns / 100) / last_day_usd
+    c = b / a
+    return (c - 1) * 100
+
+
+def dca(period_profits: np.ndarray, investment_per_period: float = 100):
+    """Invest ``investment_per_period`` at the start of every period, for every fund at once.
+
+    ``period_profits`` is funds × periods, oldest period first. NaN and zero
+    periods are skipped (nothing invested, value unchanged). Returns
+    ``(total_investment, investment_value, profit_rate, period_rate)`` arrays;
+    funds without any period get 0 for all four.
+    """
+    valid = ~np.isnan(period_profits) & (period_profits != 0)
+    profits = np.where(valid, period_profits, 0.0)
+    deposits = np.where(valid, investment_per_period, 0)
+
+    # one vector step per period keeps the same operation order (and result) as the scalar loop
+    investment_value = np.zeros(len(period_profits))
+    for k in range(period_profits.shape[1]):
+        investment_value += deposits[:, k]
+        investment_value += investment_value * (profits[:, k] / 100)
+
+    periods = valid.sum(axis=1)
+    total_investment = periods * investment_per_period
+    final_profit = investment_value - total_investment
+    with np.errstate(divide='ignore', invalid='ignore'):
+        profit_rate = np.where(total_investment != 0, (final_profit / total_investment) * 100, 0.0)
+        period_rate = np.where(periods != 0, profit_rate / periods, 0.0)
+    return total_investment, investment_value, profit_rate, period_rate
+
+
+def dca_table(fon_list: list[str], period_profits: np.ndarray, investment_per_period: float = 100) -> dict:
+    """``{fonkod: [total_investment, investment_value, profit_rate, period_rate]}``"""
+    columns = [column.tolist() for column in dca(period_profits, investment_per_period)]
+    return {fon: [row[r] for row in columns] for r, fon in enumerate(fon_list)}
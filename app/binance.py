@@ -0,0 +1,109 @@
+import asyncio
+import calendar
+import time
+from datetime import datetime
+
+from pymongo import ReplaceOne
+
+from app.database import mongodb
+from app.metrics import CACHE_REQUESTS
+from app.upstream import upstream
+
+DAY_MS = 24 * 60 * 60 * 1000
+
+
+def parse_kline(row: list) -> dict:
+    return {
+        "open_time": row[0],
+        "open": row[1],
+        "high": row[2],
+        "low": row[3],
+        "close": row[4],
+        "volume": row[5]
+    }
+
+
+class DailyKlines:
+    """Local store of closed daily candles for one Binance symbol.
+
+    Candles are kept in memory and in Mongo (``_id`` is the candle open time in
+    ms). Missing days are filled with bulk ``klines`` requests of up to 1000
+    candles each; a closed candle never changes, so it is fetched only once.
+    Today's candle is still open and is always read from Binance.
+    """
+
+    def __init__(self, symbol: str):
+        self.symbol = symbol
+        self.klines: dict[int, dict] = {}
+        self.collection = mongodb.db[f"{symbol.lower()}_daily"]
+        self.lock = asyncio.Lock()
+
+    @staticmethod
+    def open_time(dt: datetime) -> int:
+        # Binance daily candles open at 00:00 UTC
+        return calendar.timegm(dt.date().timetuple()) * 1000
+
+    async def get(self, dt: datetime) -> dict | None:
+        open_time = self.open_time(dt)
+        if open_time + DAY_MS > time.time() * 1000:
+            data = await upstream.binance("klines", {
+                "symbol": self.symbol,
+                "interval": "1d",
+                "startTime": open_time,
+                "endTime": open_time + DAY_MS - 1
+            })
+            return parse_kline(data[0]) if data else None
+
+        if open_time not in self.klines:
+            CACHE_REQUESTS.labels(f"{self.symbol.lower()}_klines", "miss").inc()
+            await self.prefetch(dt, dt)
+        else:
+            CACHE_REQUESTS.labels(f"{self.symbol.lower()}_klines", "hit").inc()
+        kline = self.klines.get(open_time)
+        return dict(kline) if kline else None
+
+    async def prefetch(self, start: datetime, end: datetime):
+        # only closed candles are stored
+        last_closed = int(time.time() * 1000) // DAY_MS * DAY_MS - DAY_MS
+        wanted = range(self.open_time(start), min(self.open_time(end), last_closed) + 1, DAY_MS)
+
+        async with self.lock:
+            missing = [t for t in wanted if t not in self.klines]
+            if not missing:
+                return
+
+            try:
+                async for document in self.collection.find({"_id": {"$gte": missing[0], "$lte": missing[-1]}}):
+                    self.klines[document["_id"]] = {"open_time": document["_id"], **{k: v for k, v in document.items() if k != "_id"}}
+            except Exception:
+                pass
+            missing = [t for t in missing if t not in self.klines]
+
+            while missing:
+                data = await upstream.binance("klines", {
+                    "symbol": self.symbol,
+                    "interval": "1d",
+                    "startTime": missing[0],
+                    "endTime": missing[-1] + DAY_MS - 1,
+                    "limit": 1000
+                })
+                if not data:
+                    break
+
+                operations = []
+                for row in data:
+                    if row[0] > last_closed:
+                        continue
+                    kline = parse_kline(row)
+                    self.klines[row[0]] = kline
+                    operations.append(ReplaceOne({"_id": row[0]}, {k: v for k, v in kline.items() if k != "open_time"}, upsert=True))
+                if operations:
+                    try:
+                        await self.collection.bulk_write(operations, ordered=False)
+                    except Exception:
+                        pass
+
+                missing = [t for t in missing if t > data[-1][0]]
+
+
+usdttry_klines = DailyKlines("USDTTRY")
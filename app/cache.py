@@ -0,0 +1,133 @@
+import json
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import orjson
+
+from app.config import TEFAS_CACHE_SIZE, TEFAS_CACHE_TTL, TEFAS_CACHE_STALE, TEFAS_SETTLE_DAYS
+from app.database import mongodb
+from app.metrics import CACHE_REQUESTS
+
+
+class TefasCache:
+    """Two-level cache for parsed TEFAS responses.
+
+    Entries are keyed by endpoint and the full request payload. A range that
+    ended more than ``settle_days`` full days before today never changes on
+    TEFAS, so it is stored without an expiry; a younger range (TEFAS may not
+    have published its last days yet) or a payload without dates expires
+    after ``ttl`` seconds. The in-process LRU holds the serialized JSON so every hit
+    returns a fresh object that callers are free to mutate, and passthrough
+    endpoints can send it without encoding it again.
+
+    Expired entries are kept for another ``stale`` seconds (in Mongo the TTL
+    index removes them at ``expires_at``, freshness is ``fresh_until``) so
+    ``get_stale`` can answer while TEFAS is unavailable.
+    """
+
+    def __init__(self, size: int, ttl: int, stale: int, settle_days: int):
+        self.size = size
+        self.ttl = ttl
+        self.settle_days = settle_days
+        self.stale = timedelta(seconds=stale)
+        self.lru: OrderedDict[str, tuple[bytes, datetime | None]] = OrderedDict()
+        self.collection = mongodb.db["tefas_cache"]
+
+    @staticmethod
+    def key(endpoint: str, payload: dict) -> str:
+        return endpoint + ":" + json.dumps(payload, sort_keys=True, ensure_ascii=False)
+
+    def expires_at(self, payload: dict) -> datetime | None:
+        try:
+            bittarih = datetime.strptime(payload["bittarih"], "%d.%m.%Y")
+        except (KeyError, ValueError):
+            return datetime.utcnow() + timedelta(seconds=self.ttl)
+        if bittarih.date() < datetime.now().date() - timedelta(days=self.settle_days):
+            return None
+        return datetime.utcnow() + timedelta(seconds=self.ttl)
+
+    def _remember(self, key: str, content: bytes, expires_at: datetime | None):
+        self.lru[key] = (content, expires_at)
+        self.lru.move_to_end(key)
+        while len(self.lru) > self.size:
+            self.lru.popitem(last=False)
+
+    async def get(self, endpoint: str, payload: dict) -> dict | None:
+        content = await self.get_raw(endpoint, payload)
+        return orjson.loads(content) if content is not None else None
+
+    async def get_raw(self, endpoint: str, payload: dict) -> bytes | None:
+        key = self.key(endpoint, payload)
+        now = datetime.utcnow()
+
+        entry = self.lru.get(key)
+        if entry is not None:
+            content, expires_at = entry
+            if expires_at is None or expires_at > now:
+                self.lru.move_to_end(key)
+                CACHE_REQUESTS.labels("tefas", "hit_memory").inc()
+                return content
+            # expired entries stay for get_stale until they are replaced or evicted
+
+        try:
+            document = await self.collection.find_one({"_id": key})
+        except Exception:
+            document = None
+        fresh_until = document["fresh_until"] if document is not None else None
+        if document is None or (fresh_until is not None and fresh_until <= now):
+            CACHE_REQUESTS.labels("tefas", "miss").inc()
+            return None
+
+        content = orjson.dumps(document["data"])
+        self._remember(key, content, fresh_until)
+        CACHE_REQUESTS.labels("tefas", "hit_mongo").inc()
+        return content
+
+    async def get_stale(self, endpoint: str, payload: dict) -> bytes | None:
+        """The cached body even if it has expired, at most ``stale`` seconds ago."""
+        key = self.key(endpoint, payload)
+        now = datetime.utcnow()
+
+        entry = self.lru.get(key)
+        if entry is not None and (entry[1] is None or entry[1] + self.stale > now):
+            CACHE_REQUESTS.labels("tefas", "stale").inc()
+            return entry[0]
+
+        try:
+            document = await self.collection.find_one({"_id": key})
+        except Exception:
+            document = None
+        if document is None:
+            return None
+        fresh_until = document["fresh_until"]
+        if fresh_until is not None and fresh_until + self.stale <= now:
+            return None  # the TTL monitor has not removed it yet
+        CACHE_REQUESTS.labels("tefas", "stale").inc()
+        return orjson.dumps(document["data"])
+
+    async def set(self, endpoint: str, payload: dict, content: bytes):
+        """Cache the raw upstream response body ``content``."""
+        data = orjson.loads(content)  # never cache a body that is not JSON
+        key = self.key(endpoint, payload)
+        fresh_until = self.expires_at(payload)
+        self._remember(key, content, fresh_until)
+        try:
+            await self.collection.replace_one(
+                {"_id": key},
+                {
+                    "endpoint": endpoint,
+                    "bastarih": payload.get("bastarih"),
+                    "bittarih": payload.get("bittarih"),
+                    "data": data,
+                    "fresh_until": fresh_until,
+                    "expires_at": fresh_until + self.stale if fresh_until is not None else None,
+                    "create_date": datetime.utcnow(),
+                },
+                upsert=True,
+            )
+        except Exception:
+            # Mongo is only a second-level cache; the LRU entry is still valid
+            pass
+
+
+tefas_cache = TefasCache(size=TEFAS_CACHE_SIZE, ttl=TEFAS_CACHE_TTL, stale=TEFAS_CACHE_STALE, settle_days=TEFAS_SETTLE_DAYS)
@@ -0,0 +1,133 @@
+import asyncio
+import gzip
+from collections import OrderedDict
+from datetime import datetime
+
+import brotli
+from fastapi import Request, Response
+from starlette.datastructures import Headers, MutableHeaders
+
+from app.config import COMPRESSION_MINIMUM_SIZE, COMPRESSION_GZIP_LEVEL, COMPRESSION_BROTLI_QUALITY, COMPRESSION_CACHE_SIZE
+from app.metrics import CACHE_REQUESTS
+
+# preferred first
+ENCODINGS = ("br", "gzip")
+# bodies larger than this are compressed in a thread so the event loop keeps serving
+THREAD_MINIMUM_SIZE = 256 * 1024
+
+
+def negotiate(accept_encoding: str) -> str | None:
+    """The preferred encoding the client accepts (``Accept-Encoding``, q=0 means no)."""
+    accepted = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip()] = q
+    for encoding in ENCODINGS:
+        if accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+    return None
+
+
+def compress(body: bytes, encoding: str, gzip_level: int = COMPRESSION_GZIP_LEVEL, brotli_quality: int = COMPRESSION_BROTLI_QUALITY) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=brotli_quality)
+    return gzip.compress(body, compresslevel=gzip_level)
+
+
+async def compress_async(body: bytes, encoding: str) -> bytes:
+    if len(body) > THREAD_MINIMUM_SIZE:
+        return await asyncio.to_thread(compress, body, encoding)
+    return compress(body, encoding)
+
+
+class CompressionMiddleware:
+    """gzip/brotli for responses of at least ``minimum_size`` bytes.
+
+    Only complete bodies are compressed; streamed responses (NDJSON) and
+    responses that already carry a ``Content-Encoding`` are sent unchanged.
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MINIMUM_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding", "")) if scope["type"] == "http" else None
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+
+        async def send_compressed(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                # held back until the body shows whether it gets compressed
+                start = message
+                return
+            if start is not None:
+                headers = MutableHeaders(raw=start["headers"])
+                body = message.get("body", b"")
+                if "content-encoding" not in headers and not message.get("more_body", False) and len(body) >= self.minimum_size:
+                    body = await compress_async(body, encoding)
+                    headers["Content-Encoding"] = encoding
+                    headers["Content-Length"] = str(len(body))
+                    headers.add_vary_header("Accept-Encoding")
+                    message = {**message, "body": body}
+                await send(start)
+                start = None
+            await send(message)
+
+        await self.app(scope, receive, send_compressed)
+
+
+class CompressedResponses:
+    """LRU of rendered JSON bodies of hot TEFAS responses with their compressed forms.
+
+    A body is compressed once per encoding on first use and then served from
+    memory until ``expires_at`` (``None`` = never, as for closed date ranges).
+    """
+
+    def __init__(self, size: int, minimum_size: int):
+        self.size = size
+        self.minimum_size = minimum_size
+        self.entries: OrderedDict[str, tuple[dict[str, bytes], datetime | None]] = OrderedDict()
+
+    async def get(self, key: str, request: Request) -> Response | None:
+        entry = self.entries.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= datetime.utcnow():
+            del self.entries[key]
+            entry = None
+        if entry is None:
+            CACHE_REQUESTS.labels("responses", "miss").inc()
+            return None
+        bodies, _ = entry
+        self.entries.move_to_end(key)
+        CACHE_REQUESTS.labels("responses", "hit").inc()
+        return await self.response(bodies, request)
+
+    async def put(self, key: str, body: bytes, expires_at: datetime | None, request: Request) -> Response:
+        bodies = {"identity": body}
+        self.entries[key] = (bodies, expires_at)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+        return await self.response(bodies, request)
+
+    async def response(self, bodies: dict[str, bytes], request: Request) -> Response:
+        encoding = negotiate(request.headers.get("accept-encoding", ""))
+        if encoding is None or len(bodies["identity"]) < self.minimum_size:
+            return Response(bodies["identity"], media_type="application/json", headers={"Vary": "Accept-Encoding"})
+        if encoding not in bodies:
+            bodies[encoding] = await compress_async(bodies["identity"], encoding)
+        return Response(bodies[encoding], media_type="application/json", headers={"Content-Encoding": encoding, "Vary": "Accept-Encoding"})
+
+
+compressed_responses = CompressedResponses(size=COMPRESSION_CACHE_SIZE, minimum_size=COMPRESSION_MINIMUM_SIZE)
@@ -2,7 +2,9 @@ import json
 import os
 
 
-if 'SERVER_ENV' in os.environ and os.environ['SERVER_ENV'] == 'production':
+PRODUCTION = 'SERVER_ENV' in os.environ and os.environ['SERVER_ENV'] == 'production'
+
+if PRODUCTION:
     print("Running on the server")
     with open("config.json", 'r') as f:
         config = json.load(f)
@@ -25,4 +27,90 @@ else:
     MONGODB_PASSWORD = config["database"]["password"]
     MONGODB_HOST = config["database"]["host"]
     MONGODB_PORT = config["database"]["port"]
-    MONGODB_NAME = config["database"]["name"]
\ No newline at end of file
+    MONGODB_NAME = config["database"]["name"]
+
+# create the declared indexes at startup; in production a missing index stops the server
+MONGODB_CREATE_INDEXES = config["database"].get("create_indexes", True)
+# transaction serial numbers reserved per counter update, per worker process;
+# 1 keeps serials in creation order across several worker processes
+SERIAL_BLOCK_SIZE = config["database"].get("serial_block_size", 100)
+
+# upstream (TEFAS / Binance)
+UPSTREAM = config.get("upstream", {})
+TEFAS_API_URL = UPSTREAM.get("tefas_url", "https://www.tefas.gov.tr/api/DB")
+BINANCE_API_URL = UPSTREAM.get("binance_url", "https://api.binance.com/api/v3")
+UPSTREAM_MAX_CONNECTIONS = UPSTREAM.get("max_connections", 100)
+UPSTREAM_MAX_KEEPALIVE_CONNECTIONS = UPSTREAM.get("max_keepalive_connections", 20)
+UPSTREAM_CONNECT_TIMEOUT = UPSTREAM.get("connect_timeout", 5.0)
+UPSTREAM_READ_TIMEOUT = UPSTREAM.get("read_timeout", 60.0)
+# per upstream read timeouts (seconds), the shared one unless set
+TEFAS_READ_TIMEOUT = UPSTREAM.get("tefas_read_timeout", UPSTREAM_READ_TIMEOUT)
+BINANCE_READ_TIMEOUT = UPSTREAM.get("binance_read_timeout", UPSTREAM_READ_TIMEOUT)
+# max in-flight requests per upstream host
+TEFAS_CONCURRENCY = UPSTREAM.get("tefas_concurrency", 8)
+BINANCE_CONCURRENCY = UPSTREAM.get("binance_concurrency", 16)
+# retries of reads after a timeout, connection error, 429 or 5xx
+UPSTREAM_MAX_RETRIES = UPSTREAM.get("retries", 2)
+# seconds; retry n waits random(0, min(backoff_max, backoff * 2 ** n))
+UPSTREAM_BACKOFF = UPSTREAM.get("backoff", 0.5)
+UPSTREAM_BACKOFF_MAX = UPSTREAM.get("backoff_max", 8.0)
+# consecutive failures that open an upstream's circuit, seconds until a trial call
+UPSTREAM_BREAKER_THRESHOLD = UPSTREAM.get("breaker_threshold", 5)
+UPSTREAM_BREAKER_RESET = UPSTREAM.get("breaker_reset", 30.0)
+# months fonlarin_getirisi_dolar may skip when TEFAS/Binance fail for them; the
+# skipped months are listed in the X-Skipped-Months header, more fail the request
+UPSTREAM_MAX_MISSING_MONTHS = UPSTREAM.get("max_missing_months", 0)
+
+# TEFAS response cache
+CACHE = config.get("cache", {})
+TEFAS_CACHE_SIZE = CACHE.get("tefas_lru_size", 256)
+# seconds; only for ranges that are not closed yet, closed ranges never expire
+TEFAS_CACHE_TTL = CACHE.get("tefas_ttl", 300)
+# full days after a range's last day before it is closed: TEFAS publishes a
+# day's prices that evening or the next morning (at least 1)
+TEFAS_SETTLE_DAYS = max(1, CACHE.get("tefas_settle_days", 1))
+# seconds expired entries are kept to answer while TEFAS is unavailable
+TEFAS_CACHE_STALE = CACHE.get("tefas_stale", 24 * 60 * 60)
+
+# response compression (gzip / brotli)
+COMPRESSION = config.get("compression", {})
+# bytes; smaller bodies are sent as is
+COMPRESSION_MINIMUM_SIZE = COMPRESSION.get("minimum_size", 1024)
+COMPRESSION_GZIP_LEVEL = COMPRESSION.get("gzip_level", 6)
+COMPRESSION_BROTLI_QUALITY = COMPRESSION.get("brotli_quality", 5)
+# rendered TEFAS responses kept with their compressed bodies
+COMPRESSION_CACHE_SIZE = COMPRESSION.get("cache_size", 64)
+
+# TEFAS fund history mirror
+HISTORY = config.get("history", {})
+# seconds between background syncs
+HISTORY_SYNC_INTERVAL = HISTORY.get("sync_interval", 6 * 60 * 60)
+# days per BindHistoryInfo request
+HISTORY_CHUNK_DAYS = HISTORY.get("chunk_days", 60)
+# seconds a process may sync a fund before another one can take it over
+HISTORY_LEASE = HISTORY.get("lease", 300)
+
+# account balances of the v1 ledger
+LEDGER = config.get("ledger", {})
+# seconds a transaction may stay unapplied before reconcile finishes it
+LEDGER_GRACE = LEDGER.get("grace", 60)
+# seconds between reconcile runs
+LEDGER_RECONCILE_INTERVAL = LEDGER.get("reconcile_interval", 60)
+
+# background analytics jobs
+JOBS = config.get("jobs", {})
+JOB_WORKERS = JOBS.get("workers", 2)
+# seconds between heartbeats of the queued and running jobs of a process; a
+# job whose heartbeat is 3 intervals old was left by a stopped process
+JOB_HEARTBEAT = JOBS.get("heartbeat", 30)
+
+# logging
+LOGGING = config.get("logging", {})
+LOG_LEVEL = LOGGING.get("level", "INFO")
+# per-module levels, e.g. {"app.history": "DEBUG", "uvicorn.access": "WARNING"}
+LOG_LEVELS = LOGGING.get("levels", {})
+# keep 1 in N DEBUG records of each log call
+LOG_DEBUG_SAMPLE = LOGGING.get("debug_sample", 100)
+
+# FONTURACIKLAMA filters per TEFAS endpoint, e.g. {"NetLotArtan": {"exclude": ["Serbest"], "include": []}}
+FUND_FILTERS = config.get("fund_filters", {})
\ No newline at end of file
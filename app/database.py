@@ -1,15 +1,106 @@
+import logging
+
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import PyMongoError
 
-from app.config import MONGODB_USER, MONGODB_PASSWORD, MONGODB_HOST, MONGODB_PORT, MONGODB_NAME, APP_NAME
+from app.config import MONGODB_USER, MONGODB_PASSWORD, MONGODB_HOST, MONGODB_PORT, MONGODB_NAME, APP_NAME, MONGODB_CREATE_INDEXES, PRODUCTION
+from app.metrics import MongoMetrics
 
 mongodb_uri = f'mongodb://{MONGODB_USER}:{MONGODB_PASSWORD}@{MONGODB_HOST}:{MONGODB_PORT}/?authMechanism=DEFAULT'
 database_name = APP_NAME + "_" + MONGODB_NAME
 
+logger = logging.getLogger(__name__)
+
+# indexes the API relies on, per collection
+INDEXES = {
+    "transactions": [
+        IndexModel([("serialNumber", ASCENDING)], name="serialNumber_unique", unique=True),
+        # per-account history, either side of the transaction, in statement order
+        IndexModel([("account_id_High", ASCENDING), ("create_date", ASCENDING), ("serialNumber", ASCENDING)], name="account_id_High_create_date_serialNumber"),
+        IndexModel([("account_id_Low", ASCENDING), ("create_date", ASCENDING), ("serialNumber", ASCENDING)], name="account_id_Low_create_date_serialNumber"),
+        # only unapplied transactions have a ledger group
+        IndexModel([("ledger", ASCENDING)], name="ledger_sparse", sparse=True),
+    ],
+    "accounts": [
+        IndexModel([("currency", ASCENDING)], name="currency"),
+        IndexModel([("type", ASCENDING)], name="type"),
+    ],
+    "tefas_cache": [
+        # closed ranges are stored with expires_at None and never expire
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    "jobs": [
+        # one queued or running job per kind and params
+        IndexModel([("key", ASCENDING)], name="key_active_unique", unique=True, partialFilterExpression={"active": True}),
+        IndexModel([("status", ASCENDING), ("heartbeat", ASCENDING)], name="status_heartbeat"),
+    ],
+    "fund_history": [
+        # rows are upserted by fund and day
+        IndexModel([("fonkod", ASCENDING), ("date", ASCENDING)], name="fonkod_date_unique", unique=True),
+    ],
+}
+
 
 class MongoDB:
     def __init__(self, uri: str, db_name: str):
-        self.client = AsyncIOMotorClient(uri)
+        self.client = AsyncIOMotorClient(uri, event_listeners=[MongoMetrics()])
         self.db = self.client[db_name]
         self.counters_collection = self.db["counters"]
+        self.transactions: bool | None = None  # server supports multi-document transactions
+
+    async def ensure_indexes(self, indexes: dict = INDEXES, create: bool = MONGODB_CREATE_INDEXES, required: bool = PRODUCTION):
+        """Create the declared ``indexes`` (a no-op for the ones that exist) and
+        report declared indexes that are missing and existing ones that are not
+        declared or have never been used. With ``required`` a missing index
+        raises ``RuntimeError`` so the server does not start without it.
+        """
+        missing = []
+        for name, models in indexes.items():
+            collection = self.db[name]
+            if create:
+                try:
+                    await collection.create_indexes(models)
+                except PyMongoError as e:
+                    logger.warning("Could not create indexes on %s: %s", name, e)
+
+            existing = await collection.index_information()
+            existing_keys = {tuple(info["key"]): index_name for index_name, info in existing.items()}
+            declared = set()
+            for model in models:
+                key = tuple(model.document["key"].items())
+                if key in existing_keys:
+                    declared.add(existing_keys[key])
+                else:
+                    missing.append(f"{name}.{model.document['name']}")
+
+            undeclared = [index_name for index_name in existing if index_name != "_id_" and index_name not in declared]
+            if undeclared:
+                logger.info("Undeclared indexes on %s: %s", name, ", ".join(undeclared))
+            unused = await self.unused_indexes(name)
+            if unused:
+                logger.info("Unused indexes on %s since the server started: %s", name, ", ".join(unused))
+
+        if missing:
+            if required:
+                raise RuntimeError(f"Missing required indexes: {', '.join(missing)}")
+            logger.warning("Missing indexes: %s", ", ".join(missing))
+
+    async def supports_transactions(self) -> bool:
+        """Multi-document transactions need a replica set or a sharded cluster."""
+        if self.transactions is None:
+            try:
+                hello = await self.client.admin.command("hello")
+            except Exception:
+                return False
+            self.transactions = "setName" in hello or hello.get("msg") == "isdbgrid"
+        return self.transactions
+
+    async def unused_indexes(self, name: str) -> list[str]:
+        try:
+            stats = await self.db[name].aggregate([{"$indexStats": {}}]).to_list(length=None)
+        except Exception:
+            return []  # $indexStats needs the clusterMonitor role
+        return [stat["name"] for stat in stats if stat["name"] != "_id_" and stat["accesses"]["ops"] == 0]
 
-mongodb = MongoDB(uri=mongodb_uri, db_name=database_name)
\ No newline at end of file
+mongodb = MongoDB(uri=mongodb_uri, db_name=database_name)
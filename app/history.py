@@ -0,0 +1,173 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from app.config import HISTORY_SYNC_INTERVAL, HISTORY_CHUNK_DAYS, HISTORY_LEASE, TEFAS_SETTLE_DAYS
+from app.database import mongodb
+from app.upstream import upstream
+
+# TEFAS reports prices for Istanbul calendar days (UTC+3, no DST)
+TEFAS_UTC_OFFSET = timedelta(hours=3)
+HISTORY_FIELDS = ["FIYAT", "TEDPAYSAYISI", "KISISAYISI", "PORTFOYBUYUKLUK"]
+# seconds between attempts to take a fund another process is syncing
+LEASE_POLL = 1
+
+logger = logging.getLogger(__name__)
+
+
+def day(dt: datetime) -> datetime:
+    return datetime(dt.year, dt.month, dt.day)
+
+
+def tefas_day(tarih) -> datetime:
+    # TARIH is epoch milliseconds
+    return day(datetime.utcfromtimestamp(int(tarih) / 1000) + TEFAS_UTC_OFFSET)
+
+
+class FundHistory:
+    """Local mirror of TEFAS ``BindHistoryInfo`` rows, one document per fund per day.
+
+    Rows live in the ``fund_history`` collection, unique by fund and day, and
+    ``fund_history_sync`` records, per fund, the closed day range that has
+    already been mirrored (``synced_from`` .. ``synced_until``), so a sync only
+    asks TEFAS for the days outside it. Rows are upserted, so a chunk that is
+    fetched again (after a crash before its range was saved) is not stored
+    twice. A fund is synced by one process at a time: ``lease_until`` in its
+    ``fund_history_sync`` document is taken before syncing and renewed with
+    every chunk. Funds that were synced once are kept up to date by a
+    background task running every ``interval`` seconds.
+    """
+
+    def __init__(self, interval: int, chunk_days: int, lease: int):
+        self.interval = interval
+        self.chunk_days = chunk_days
+        self.lease = timedelta(seconds=lease)
+        self.collection = mongodb.db["fund_history"]
+        self.state = mongodb.db["fund_history_sync"]
+        self.task: asyncio.Task | None = None
+
+    async def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def run(self):
+        while True:
+            try:
+                async for state in self.state.find({"synced_from": {"$exists": True}}):
+                    await self.sync(state["_id"], state["synced_from"])
+            except Exception:
+                logger.exception("Fund history sync failed")
+            await asyncio.sleep(self.interval)
+
+    def chunks(self, first: datetime, last: datetime) -> list[tuple[datetime, datetime]]:
+        result = []
+        while first <= last:
+            chunk_last = min(first + timedelta(days=self.chunk_days - 1), last)
+            result.append((first, chunk_last))
+            first = chunk_last + timedelta(days=1)
+        return result
+
+    async def ingest(self, fonkod: str, first: datetime, last: datetime) -> datetime | None:
+        """Upsert the fund's rows from ``first`` to ``last``; returns the last day TEFAS returned."""
+        payload = {
+            "fontip": "YAT",
+            "sfontur": "",
+            "fonkod": fonkod,
+            "fongrup": "",
+            "bastarih": first.strftime("%d.%m.%Y"),
+            "bittarih": last.strftime("%d.%m.%Y"),
+            "fonturkod": "",
+            "fonunvantip": ""
+        }
+        data = await upstream.tefas("BindHistoryInfo", payload, cache=False)
+        rows = [
+            {"date": tefas_day(item["TARIH"]), "fonkod": fonkod, **{field: item[field] for field in HISTORY_FIELDS}}
+            for item in data["data"]
+        ]
+        if rows:
+            await self.collection.bulk_write(
+                [UpdateOne({"fonkod": fonkod, "date": row["date"]}, {"$set": row}, upsert=True) for row in rows],
+                ordered=False
+            )
+        return max((row["date"] for row in rows), default=None)
+
+    def lease_expiry(self) -> datetime:
+        # BSON dates keep milliseconds, the lease is matched by its exact value
+        expiry = datetime.utcnow() + self.lease
+        return expiry.replace(microsecond=expiry.microsecond // 1000 * 1000)
+
+    async def acquire(self, fonkod: str) -> datetime:
+        """Take the fund's lease, waiting while another process holds it; returns its expiry."""
+        while True:
+            now = datetime.utcnow()
+            lease_until = self.lease_expiry()
+            try:
+                # a held lease does not match, so the upsert collides with the existing _id
+                await self.state.update_one(
+                    {"_id": fonkod, "$or": [{"lease_until": None}, {"lease_until": {"$lt": now}}]},
+                    {"$set": {"lease_until": lease_until}},
+                    upsert=True
+                )
+                return lease_until
+            except DuplicateKeyError:
+                await asyncio.sleep(LEASE_POLL)
+
+    async def save(self, fonkod: str, lease_until: datetime, **synced) -> datetime:
+        """Store the synced range and renew the lease; returns its new expiry."""
+        renewed = self.lease_expiry()
+        result = await self.state.update_one(
+            {"_id": fonkod, "lease_until": lease_until},
+            {"$set": {**synced, "lease_until": renewed}}
+        )
+        if result.matched_count == 0:
+            raise RuntimeError(f"Lost the fund history lease of {fonkod}")
+        return renewed
+
+    async def sync(self, fonkod: str, start: datetime):
+        """Mirror every closed day from ``start`` to yesterday that is not stored yet."""
+        start = day(start)
+        yesterday = day(datetime.now()) - timedelta(days=1)
+        # days TEFAS may still publish rows for are fetched again by the next sync
+        settled = yesterday - timedelta(days=TEFAS_SETTLE_DAYS)
+
+        lease_until = await self.acquire(fonkod)
+        try:
+            state = await self.state.find_one({"_id": fonkod})
+            synced_from = state.get("synced_from", start)
+            synced_until = state.get("synced_until", start - timedelta(days=1))
+
+            # older days, newest chunk first so the stored range stays contiguous
+            for first, last in reversed(self.chunks(start, synced_from - timedelta(days=1))):
+                await self.ingest(fonkod, first, last)
+                synced_from = first
+                lease_until = await self.save(fonkod, lease_until, synced_from=synced_from, synced_until=synced_until)
+
+            # newer days
+            for first, last in self.chunks(synced_until + timedelta(days=1), yesterday):
+                returned = await self.ingest(fonkod, first, last)
+                synced_until = max(synced_until, min(last, settled), returned or synced_until)
+                lease_until = await self.save(fonkod, lease_until, synced_from=synced_from, synced_until=synced_until)
+        finally:
+            await self.state.update_one({"_id": fonkod, "lease_until": lease_until}, {"$set": {"lease_until": None}})
+
+    async def find(self, fonkod: str, first: datetime, last: datetime) -> list[dict]:
+        cursor = self.collection.find(
+            {"fonkod": fonkod, "date": {"$gte": day(first), "$lte": day(last)}},
+            {"_id": 0, "date": 1, **{field: 1 for field in HISTORY_FIELDS}}
+        ).sort("date", 1)
+        return await cursor.to_list(length=None)
+
+
+fund_history = FundHistory(interval=HISTORY_SYNC_INTERVAL, chunk_days=HISTORY_CHUNK_DAYS, lease=HISTORY_LEASE)
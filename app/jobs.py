@@ -0,0 +1,261 @@
+import asyncio
+import hashlib
+import inspect
+import json
+import logging
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+from typing import Any
+
+from fastapi import APIRouter, Body, HTTPException, Path, Query, Response, status
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel, ConfigDict, ValidationError, create_model
+from pymongo.errors import DuplicateKeyError
+
+from app.config import JOB_WORKERS, JOB_HEARTBEAT
+from app.database import mongodb
+from app.log import request_id
+
+current_job: ContextVar[str | None] = ContextVar("current_job", default=None)
+
+logger = logging.getLogger(__name__)
+
+
+class JobResponseModel(BaseModel):
+    id: str
+    kind: str
+    params: dict
+    status: str  # queued, running, done, failed
+    progress: dict
+    result: Any = None
+    error: str | None = None
+    skipped: list[str] = []  # months left out of the result
+    create_date: datetime
+    last_update_date: datetime
+
+    @classmethod
+    def from_mongo(cls, mongo_data: dict) -> "JobResponseModel":
+        id_str = str(mongo_data.pop("_id"))
+        for field in ("key", "active", "heartbeat"):
+            mongo_data.pop(field, None)
+        return cls(id=id_str, **mongo_data)
+
+
+def params_model(kind: str, func) -> type[BaseModel]:
+    """Model of the endpoint's query parameters, with their types, defaults and constraints."""
+    fields = {}
+    for name, parameter in inspect.signature(func).parameters.items():
+        # the Response FastAPI injects for headers, None outside a request
+        if inspect.isclass(parameter.annotation) and issubclass(parameter.annotation, Response):
+            continue
+        # FastAPI Query(...)/Path(...) defaults are pydantic fields
+        default = ... if parameter.default is inspect.Parameter.empty else parameter.default
+        annotation = Any if parameter.annotation is inspect.Parameter.empty else parameter.annotation
+        if getattr(default, "default", default) is None:
+            # as for the query string, a parameter left out may also be sent as null
+            annotation = annotation | None
+        fields[name] = (annotation, default)
+    return create_model(f"{kind}_params", __config__=ConfigDict(extra="forbid"), **fields)
+
+
+class Jobs:
+    """Background execution of long-running analytics endpoints.
+
+    A job is an endpoint function registered under a ``kind`` and called with
+    JSON params on one of ``workers`` worker tasks. Status, progress and result
+    are stored in the ``jobs`` collection. Submitting the same kind and params
+    while an identical job is queued or running returns that job instead of
+    starting a new one, across processes: queued and running jobs are
+    ``active`` and the unique ``key_active_unique`` index allows one active job
+    per key.
+
+    Jobs live in the queue of the process that accepted them, which refreshes
+    their ``heartbeat`` every ``heartbeat`` seconds. Active jobs whose
+    heartbeat stopped (their process was stopped or crashed) are marked failed
+    by the next process that starts or beats, so the same job can be submitted
+    again.
+    """
+
+    def __init__(self, workers: int, heartbeat: int):
+        self.workers = workers
+        self.heartbeat = heartbeat
+        self.collection = mongodb.db["jobs"]
+        self.kinds: dict[str, Any] = {}
+        self.models: dict[str, type[BaseModel]] = {}
+        self.queue: asyncio.Queue | None = None
+        self.tasks: list[asyncio.Task] = []
+        self.events: dict[str, asyncio.Event] = {}  # job id -> finished
+
+    def register(self, kind: str, func):
+        self.kinds[kind] = func
+        self.models[kind] = params_model(kind, func)
+
+    async def start(self):
+        if not self.tasks:
+            await self.fail_orphans()
+            self.queue = asyncio.Queue()
+            self.tasks = [asyncio.create_task(self.worker()) for _ in range(self.workers)]
+            self.tasks.append(asyncio.create_task(self.beat()))
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    async def fail_orphans(self):
+        """Mark active jobs without a recent heartbeat failed."""
+        cutoff = datetime.utcnow() - timedelta(seconds=3 * self.heartbeat)
+        result = await self.collection.update_many(
+            {"status": {"$in": ["queued", "running"]}, "heartbeat": {"$lt": cutoff}},
+            {"$set": {"status": "failed", "error": "Interrupted, the server running the job stopped", "active": False, "last_update_date": datetime.utcnow()}}
+        )
+        if result.modified_count:
+            logger.warning("Orphaned jobs failed", extra={"count": result.modified_count})
+
+    async def beat(self):
+        while True:
+            await asyncio.sleep(self.heartbeat)
+            try:
+                # the jobs queued or running here
+                if self.events:
+                    await self.collection.update_many({"_id": {"$in": list(self.events)}}, {"$set": {"heartbeat": datetime.utcnow()}})
+                await self.fail_orphans()
+            except Exception:
+                logger.exception("Job heartbeat failed")
+
+    def params(self, kind: str, params: dict) -> dict:
+        """Validate params against the endpoint signature and fill in its defaults;
+        raises ``ValidationError``."""
+        return self.models[kind](**params).dict()
+
+    async def submit(self, kind: str, params: dict) -> dict:
+        key = hashlib.sha1(f"{kind}:{json.dumps(params, sort_keys=True)}".encode()).hexdigest()
+        for _ in range(3):
+            job = await self.collection.find_one({"key": key, "active": True})
+            if job is not None:
+                return job
+
+            now = datetime.utcnow()
+            job = {
+                "_id": uuid.uuid4().hex,
+                "kind": kind,
+                "params": params,
+                "key": key,
+                "status": "queued",
+                "active": True,
+                "heartbeat": now,
+                "progress": {},
+                "result": None,
+                "error": None,
+                "skipped": [],
+                "create_date": now,
+                "last_update_date": now,
+            }
+            try:
+                await self.collection.insert_one(job)
+            except DuplicateKeyError:
+                continue  # submitted at the same time elsewhere, return that job
+            self.events[job["_id"]] = asyncio.Event()
+            # the caller may consume the returned document, the worker gets its own copy
+            self.queue.put_nowait(dict(job))
+            return job
+        raise RuntimeError("Job submission kept conflicting with an identical job")
+
+    async def update(self, job_id: str, **fields):
+        await self.collection.update_one({"_id": job_id}, {"$set": {**fields, "last_update_date": datetime.utcnow()}})
+
+    async def progress(self, stage: str, done: int, total: int):
+        """Record progress of the job running in the current context (no-op outside a job)."""
+        job_id = current_job.get()
+        if job_id is not None:
+            await self.update(job_id, **{f"progress.{stage}": {"done": done, "total": total}})
+
+    async def skipped(self, months: list[str]):
+        """Record the months the job running in the current context left out (no-op outside a job)."""
+        job_id = current_job.get()
+        if job_id is not None:
+            await self.update(job_id, skipped=months)
+
+    async def worker(self):
+        while True:
+            job = await self.queue.get()
+            try:
+                await self.run(job)
+            except Exception:
+                logger.exception("Job could not be recorded", extra={"job_id": job["_id"]})
+            finally:
+                self.queue.task_done()
+
+    async def run(self, job: dict):
+        token = current_job.set(job["_id"])
+        # log records of the job carry its id
+        request_token = request_id.set(job["_id"])
+        try:
+            await self.update(job["_id"], status="running")
+            result = await self.kinds[job["kind"]](**job["params"])
+            await self.update(job["_id"], status="done", active=False, result=jsonable_encoder(result))
+        except HTTPException as e:
+            await self.update(job["_id"], status="failed", active=False, error=str(e.detail))
+        except Exception as e:
+            await self.update(job["_id"], status="failed", active=False, error=str(e))
+        finally:
+            request_id.reset(request_token)
+            current_job.reset(token)
+            self.events.pop(job["_id"]).set()
+
+    async def get(self, job_id: str, wait: float = 0) -> dict | None:
+        """Return the job, waiting up to ``wait`` seconds for it to finish."""
+        deadline = asyncio.get_running_loop().time() + wait
+        while True:
+            job = await self.collection.find_one({"_id": job_id})
+            remaining = deadline - asyncio.get_running_loop().time()
+            if job is None or job["status"] in ("done", "failed") or remaining <= 0:
+                return job
+            event = self.events.get(job_id)
+            if event is not None:
+                try:
+                    await asyncio.wait_for(event.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                # submitted by another process, poll Mongo
+                await asyncio.sleep(min(1, remaining))
+
+
+jobs = Jobs(workers=JOB_WORKERS, heartbeat=JOB_HEARTBEAT)
+
+router = APIRouter(prefix="/jobs", tags=["Jobs"])
+
+
+@router.post("/{kind}", response_model=JobResponseModel, status_code=status.HTTP_202_ACCEPTED)
+async def submit_job(
+    kind: str = Path(..., description="Endpoint name, e.g. fonlarin_getirisi_dolar"),
+    params: dict = Body({}, description="Endpoint query parameters"),
+):
+    if kind not in jobs.kinds:
+        raise HTTPException(status_code=404, detail=f"Unknown job kind. Use one of: {', '.join(jobs.kinds)}")
+    try:
+        params = jobs.params(kind, params)
+    except ValidationError as e:
+        raise HTTPException(status_code=400, detail=jsonable_encoder(e.errors(include_url=False)))
+    try:
+        job = await jobs.submit(kind, params)
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+    return JobResponseModel.from_mongo(job)
+
+
+@router.get("/{job_id}", response_model=JobResponseModel)
+async def get_job(
+    job_id: str = Path(..., description="Job id"),
+    wait: float = Query(0, ge=0, le=60, description="Seconds to wait for the job to finish (long polling)"),
+):
+    try:
+        job = await jobs.get(job_id, wait)
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return JobResponseModel.from_mongo(job)
@@ -0,0 +1,131 @@
+import atexit
+import logging
+import queue
+import sys
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+import orjson
+
+from app.config import LOG_LEVEL, LOG_LEVELS, LOG_DEBUG_SAMPLE
+
+request_id: ContextVar[str | None] = ContextVar("request_id", default=None)
+
+# attributes every LogRecord has; anything else was passed with extra={...}
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "request_id"}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, request_id and the ``extra`` fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        document = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "request_id", None) is not None:
+            document["request_id"] = record.request_id
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES:
+                document[key] = value
+        if record.exc_info:
+            document["exc_info"] = self.formatException(record.exc_info)
+        return orjson.dumps(document, default=str).decode()
+
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id.get()
+        return True
+
+
+class DebugSampler(logging.Filter):
+    """Keeps one in ``rate`` DEBUG records per call site; other levels always pass."""
+
+    def __init__(self, rate: int):
+        super().__init__()
+        self.rate = rate
+        self.counts: dict[tuple[str, int], int] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno != logging.DEBUG or self.rate <= 1:
+            return True
+        site = (record.pathname, record.lineno)
+        count = self.counts.get(site, 0)
+        self.counts[site] = count + 1
+        return count % self.rate == 0
+
+
+class LogQueueHandler(QueueHandler):
+    """Hands records to the writer thread; the caller only renders the message."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+listener: QueueListener | None = None
+
+
+def setup_logging(level: str = LOG_LEVEL, levels: dict = LOG_LEVELS, debug_sample: int = LOG_DEBUG_SAMPLE):
+    """Send all logging through a queue to a JSON stdout writer thread (idempotent)."""
+    global listener
+    if listener is not None:
+        return
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter())
+
+    handler = LogQueueHandler(queue.SimpleQueue())
+    handler.addFilter(RequestIdFilter())
+    handler.addFilter(DebugSampler(debug_sample))
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(level)
+    for name, module_level in levels.items():
+        logging.getLogger(name).setLevel(module_level)
+    # uvicorn's own loggers go through the same queue
+    for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+        logging.getLogger(name).handlers = []
+        logging.getLogger(name).propagate = True
+
+    listener = QueueListener(handler.queue, output, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+
+class RequestIdMiddleware:
+    """Takes ``X-Request-ID`` from the request (or makes one) for the log records of the request."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        value = None
+        for name, header in scope["headers"]:
+            if name == b"x-request-id":
+                value = header.decode("latin-1")[:64]
+                break
+        if not value:
+            value = uuid.uuid4().hex
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", []), (b"x-request-id", value.encode("latin-1"))]
+            await send(message)
+
+        token = request_id.set(value)
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            request_id.reset(token)
@@ -1,18 +1,46 @@
+import asyncio
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
-from fastapi import APIRouter, FastAPI, Depends, HTTPException, Path, Query, status
+from fastapi import APIRouter, FastAPI, HTTPException, Query, Response, status
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
 
-from .models import AccountCreate, AccountResponseModel, GetAccountsResponseModel, ResponseModel, TransactionCreate, TransactionResponseModel, TransactionsResponseModel
 from .database import mongodb
-from .auth import get_api_key
-from bson import ObjectId
-import requests
+from .upstream import upstream
+from .binance import usdttry_klines
+from .tefas import fetch_snapshot
+from .compression import CompressionMiddleware
+from .metrics import MetricsMiddleware, router as metrics_router
+from .log import RequestIdMiddleware, setup_logging
+from .jobs import jobs, router as jobs_router
+from .analytics import return_matrix, usd_adjust, dca_table
+from .config import UPSTREAM_MAX_MISSING_MONTHS
+import httpx
 from collections import Counter
-import time
 import calendar
-from collections import Counter
+import logging
+import numpy as np
+
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await mongodb.ensure_indexes()
+    await upstream.start()
+    await jobs.start()
+    yield
+    await jobs.stop()
+    await upstream.close()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(RequestIdMiddleware)
+app.include_router(metrics_router)
 
 router = APIRouter(prefix="/v2")
 
@@ -30,66 +58,69 @@ class ComparisonFundReturnsRequest(BaseModel):
     islemdurum: str = "1"
 
 
-# Binance API endpoint for ticker price
-BINANCE_API_URL = "https://api.binance.com/api/v3/ticker/price"
+def month_range(today: datetime, i: int):
+    # 第 i+1 个完整的上月 (i=0 为上个月) 的第一天和最后一天
+    month_offset = today.month - (i + 1)
+    year = today.year + (month_offset // 12)
+    month = month_offset % 12
+    if month <= 0:
+        month += 12
+        year -= 1
+    first_day = datetime(year, month, 1)
+    last_day = datetime(year, month, calendar.monthrange(year, month)[1])
+    return first_day, last_day
+
 
+# Binance API endpoint for ticker price
 @router.get("/usdttry/current", tags=["Binance"])
-def get_usd_try_price():
+async def get_usd_try_price():
     try:
-        response = requests.get(BINANCE_API_URL, params={"symbol": "USDTTRY"})
-        response.raise_for_status()  # Raise an HTTPError for bad responses
-        data = response.json()
+        data = await upstream.binance("ticker/price", {"symbol": "USDTTRY"})
         return data
         # return {"symbol": data["symbol"], "price": data["price"]}
-    except requests.RequestException as exc:
+    except httpx.HTTPError as exc:
         raise HTTPException(status_code=500, detail=str(exc))
 
 # Binance API endpoint for historical candlestick data
-HISTORICAL_API_URL = "https://api.binance.com/api/v3/klines"
-
 @router.get("/usdttry/historical", tags=["Binance"])
-def get_historical_price(date: str):
+async def get_historical_price(date: str):
     # Validate and parse the date
     try:
         dt = datetime.strptime(date, "%d.%m.%Y")
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid date format. Use DD.MM.YYYY")
     
-    # Set up the start and end times for the requested date
-    start_time = int(dt.timestamp() * 1000)  # Convert to milliseconds
-    end_time = int((dt + timedelta(days=1)).timestamp() * 1000)  # End of the day
-
     try:
-        response = requests.get(HISTORICAL_API_URL, params={
-            "symbol": "USDTTRY",
-            "interval": "1d",
-            "startTime": start_time,
-            "endTime": end_time
-        })
-        response.raise_for_status()
-        data = response.json()
-        if not data:
+        # 已收盘的日K线从本地 (内存/Mongo) 读取, 缺失的按 1000 根批量从 Binance 补齐
+        price_data = await usdttry_klines.get(dt)
+        if not price_data:
             raise HTTPException(status_code=404, detail="No data found for the specified date.")
-        # Extract relevant parts from the candlestick data
-        price_data = {
-            "open_time": data[0][0],
-            "open": data[0][1],
-            "high": data[0][2],
-            "low": data[0][3],
-            "close": data[0][4],
-            "volume": data[0][5]
-        }
         return price_data
-    except requests.RequestException as exc:
+    except httpx.HTTPError as exc:
         raise HTTPException(status_code=500, detail=str(exc))
     
+async def report_skipped_months(response: Response | None, skipped: list[str]):
+    # 跳过的月份 (不超过 max_missing_months) 通过响应头告知调用方, 作为任务运行时记录在任务中
+    if response is not None and skipped:
+        response.headers["X-Skipped-Months"] = ",".join(skipped)
+    if skipped:
+        await jobs.skipped(skipped)
+
+
 @router.get("/tefas/fonlarin_getirisi_dolar", tags=["Tefas"])
 async def fonlarin_getirisi_dolar(
     ay_sayisi: int = Query(None, description="Kac ay olsun? (1-59)"),
     paydisi: int = Query(None, description="paydisi % yukari ?"),
+    response: Response = None,
 ):
-    print("Running find_returns")
+    logger.info("fonlarin_getirisi_dolar", extra={"ay_sayisi": ay_sayisi, "paydisi": paydisi})
+    data, skipped = await dolar_getirisi(ay_sayisi, paydisi)
+    await report_skipped_months(response, skipped)
+    return data
+
 
+async def dolar_getirisi(ay_sayisi: int, paydisi: int) -> tuple[dict, list[str]]:
+    """fonlarin_getirisi_dolar 的结果和跳过的月份 ("bastarih-bittarih", 从新到旧)."""
     today = datetime.today()
 
     # fon list
@@ -100,12 +131,7 @@ async def fonlarin_getirisi_dolar(
         bittarih=datetime.now().strftime('%d.%m.%Y')
     )
 
-    url = 'https://www.tefas.gov.tr/api/DB/BindComparisonFundReturns'
-
-    
-    response = requests.post(url, data=payload.dict())
-    response.raise_for_status()
-    data = response.json()
+    data = await upstream.tefas("BindComparisonFundReturns", payload.dict())
 
     # 使用列表解析来过滤掉含有“Serbest”的项
     data['data'] = [item for item in data['data'] if 'Serbest' not in item['FONTURACIKLAMA']]
@@ -133,155 +159,79 @@ async def fonlarin_getirisi_dolar(
 
     ##################################################
 
-    dic_A = {}
-    for i in range(ay_sayisi):
-
-        print(f"Getting data for month {i+1}")
-        month_offset = today.month - (i + 1)
-        year = today.year + (month_offset // 12)
-        month = month_offset % 12
-        if month <= 0:
-            month += 12
-            year -= 1
+    done = 0
+    skipped = {}
 
+    async def fetch_month(i):
+        nonlocal done
         # 计算该月的第一天和最后一天
-        first_day = datetime(year, month, 1)
-        last_day = datetime(year, month, calendar.monthrange(year, month)[1])        
+        first_day, last_day = month_range(today, i)
 
         # 格式化日期
         first_day_str = first_day.strftime('%d.%m.%Y')
-        print(f"first_day_str: {first_day_str}")
         last_day_str = last_day.strftime('%d.%m.%Y')
-        print(f"last_day_str: {last_day_str}")
+        logger.debug("Getting data for month %d: %s - %s", i + 1, first_day_str, last_day_str)
 
         payload = ComparisonFundReturnsRequest(
             bastarih= first_day_str,
             bittarih= last_day_str
         )
 
-        url = 'https://www.tefas.gov.tr/api/DB/BindComparisonFundReturns'
-
         try:
-            response = requests.post(url, data=payload.dict())
-            response.raise_for_status()
-            data = response.json()
-
-            # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # 
-            # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # 
-            a = get_historical_price(first_day_str)
-            data['first_day_usd'] = float(a['close'])
-            b = get_historical_price(last_day_str)
-            data['last_day_usd'] = float(b['close'])
-
-            dic_A[i+1] = data
-
-            # print("dic_A: ", dic_A)
-
-
-        except requests.exceptions.HTTPError as http_err:
-            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"HTTP error occurred: {http_err}")
-        except requests.exceptions.ConnectionError as conn_err:
-            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Connection error occurred: {conn_err}")
-        except requests.exceptions.Timeout as timeout_err:
-            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Timeout error occurred: {timeout_err}")
-        except requests.exceptions.RequestException as req_err:
-            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"An error occurred: {req_err}")
+            # TEFAS 和 Binance 请求并发执行, 并发上限由 upstream 按主机控制
+            snapshot, a, b = await asyncio.gather(
+                fetch_snapshot("BindComparisonFundReturns", payload.dict()),
+                get_historical_price(first_day_str),
+                get_historical_price(last_day_str),
+            )
+            snapshot.data['first_day_usd'] = float(a['close'])
+            snapshot.data['last_day_usd'] = float(b['close'])
+            return snapshot
+
+        except (httpx.HTTPError, HTTPException) as e:
+            # 单月失败 (重试后仍失败或熔断) 不影响整体, 该月跳过
+            logger.warning("Month skipped", extra={"month": i + 1, "bastarih": first_day_str, "bittarih": last_day_str, "error": repr(e)})
+            skipped[i] = f"{first_day_str}-{last_day_str}"
+            return None
+
+        finally:
+            done += 1
+            await jobs.progress("months", done, ay_sayisi)
+
+    # 一次性批量预取整个区间的 USDTTRY 日K线, 之后每月的查询都命中本地 (失败时由每月单独获取)
+    try:
+        await usdttry_klines.prefetch(month_range(today, ay_sayisi - 1)[0], today)
+    except httpx.HTTPError as e:
+        logger.warning("USDTTRY prefetch failed", extra={"error": repr(e)})
+
+    # 所有月份并发获取, gather 按提交顺序返回结果
+    months = await asyncio.gather(*(fetch_month(i) for i in range(ay_sayisi)))
+    dic_A = {i+1: snapshot for i, snapshot in enumerate(months) if snapshot is not None}
+    skipped = [skipped[i] for i in sorted(skipped)]
+    # 缺失月份超过 max_missing_months 时整个请求失败, 否则结果只按成功获取的月份计算
+    if not dic_A or len(skipped) > UPSTREAM_MAX_MISSING_MONTHS:
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail=f"{len(skipped)} of {ay_sayisi} months could not be fetched from TEFAS/Binance: {', '.join(skipped)}"
+        )
 
-        
+    # 月份按从旧到新排列, 构建 基金 × 月份 收益率矩阵 (GETIRIORANI 为 None 视为 0)
+    months = [dic_A[key] for key in sorted(dic_A, reverse=True)]
+    returns = return_matrix(fon_list, months, none_value=0.0)
 
-    # fon_list = ["YAS","MAC","IIH"]
+    # 按每月首末日的 USDTTRY 收盘价换算成美元收益率
+    first_day_usd = np.array([month.data['first_day_usd'] for month in months])
+    last_day_usd = np.array([month.data['last_day_usd'] for month in months])
+    period_profits = usd_adjust(returns, first_day_usd, last_day_usd)
 
-    data_B = {}
-    for fon in fon_list:
-        print("fon: ", fon)
-
-        list_b = []
-
-        for key, value in dic_A.items():
-            usd_price_begin = value['first_day_usd']
-            usd_price_last = value['last_day_usd']
-            # print(f"usd_price_begin: {usd_price_begin}, usd_price_last: {usd_price_last}")
-            for item in value['data']:
-                if item['FONKODU'] == fon:
-                    # list_b.append(item['GETIRIORANI'])
-                    # # # # # # # # # # # # # # # # # # # # # # # # # # 
-                    # # # # # # # # # # # # # # # # # # # # # # # # # # 
-                    delta = item['GETIRIORANI']
-
-                    if delta is None:
-                        delta = 0
-
-                    price_begin = 1
-                    price_last = 1 + delta/100
-
-                    a = price_begin / usd_price_begin
-                    b = price_last / usd_price_last
-                    c = b / a
-                    d = (c - 1) * 100
-                    # print(f"a = {a}, b = {b}, c = {c}, d = {d}")
-                    list_b.append(d)
-
-                     
-
-        data_B[fon] = list_b
-
-    # print(f"data_B: {data_B}")
-
-    data_C = {}
-    for fonkod, list_c in data_B.items():
-        list_d = []
-        list_c.reverse()
-        list_c = list(filter(None, list_c))
-
-        period_profits = list_c
-        # 每周投资金额
-        investment_per_peroid = 100
-
-        # 初始投资账户价值
-        investment_value = 0
-
-        # 总投资金额
-        total_investment = 0
-
-        # 遍历每周的利润率并更新投资账户价值
-        for profit in period_profits:
-            # 将当前投资金额加入账户
-            investment_value += investment_per_peroid
-            # 更新总投资金额
-            total_investment += investment_per_peroid
-            # 根据当前周的利润率更新账户价值
-            investment_value += investment_value * (profit / 100)
-            print(f"当前账户价值: {total_investment} - {investment_value:.2f} 元")
-
-        # 计算最终利润
-        final_profit = investment_value - total_investment
-
-        print(f"总共投入: {total_investment:.2f} 元")
-        print(f"最终利润: {final_profit:.2f} 元")
-
-        # 避免除以零的错误
-        if total_investment != 0:
-            profit_rate = (final_profit / total_investment) * 100
-            print(f"利润率: {profit_rate:.2f}%")
-            print(f"period%: {profit_rate/len(period_profits):.2f}%")
-        else:
-            print("总投入为 0，无法计算利润率")
-
-        list_d.append(total_investment)
-        list_d.append(investment_value)
-        list_d.append(profit_rate)
-        try:
-            list_d.append(profit_rate/len(period_profits))
-        except ZeroDivisionError:
-            list_d.append(0)
-
-        data_C[fonkod] = list_d
+    # 每期定投 100, 一次计算所有基金的 [总投入, 账户价值, 利润率, 每期利润率]
+    data_C = dca_table(fon_list, period_profits)
 
     sorted_data = dict(sorted(data_C.items(), key=lambda item: item[1][3], reverse=True))
     # return sorted_data
 
-    # 使用字典推导式删除不等于 ay_sayisi * 100 的键值对
-    num = ay_sayisi * 100
+    # 使用字典推导式删除不等于 (成功获取的月数) * 100 的键值对
+    num = len(months) * 100
     filtered_data = {key: value for key, value in sorted_data.items() if value[0] == num}
     # return filtered_data
 
@@ -291,7 +241,7 @@ async def fonlarin_getirisi_dolar(
     # # 使用 keys() 方法将所有键保存到一个新的列表
     # keys_list = list(filtered_data_2.keys())
 
-    return filtered_data_2
+    return filtered_data_2, skipped
 
 
 
@@ -301,12 +251,22 @@ async def fonlarin_getirisi_dolar_her_3ay(
     ay_sayisi: int = Query(None, description="Kac ay olsun? (1-59)"),
     duratioon: int = Query(None, description="Kac ay aralikli olsun?"),
     paydisi: int = Query(None, description="paydisi % yukari ?"),
+    response: Response = None,
 ):
 
     loop_num = int(ay_sayisi / duratioon)
     list_ = []
+    # 任一区间跳过的月份; 合计超过 max_missing_months 时整个请求失败, 避免混合不同长度的区间
+    skipped = []
     for i in range(loop_num):
-        data = await fonlarin_getirisi_dolar(duratioon * (i + 1), paydisi)
+        data, period_skipped = await dolar_getirisi(duratioon * (i + 1), paydisi)
+        skipped += [month for month in period_skipped if month not in skipped]
+        if len(skipped) > UPSTREAM_MAX_MISSING_MONTHS:
+            raise HTTPException(
+                status_code=status.HTTP_502_BAD_GATEWAY,
+                detail=f"{len(skipped)} months could not be fetched from TEFAS/Binance: {', '.join(skipped)}"
+            )
+        await jobs.progress("periods", i + 1, loop_num)
 
         # 使用 keys() 方法将所有键保存到一个新的列表
         keys_list = list(data.keys())
@@ -330,7 +290,12 @@ async def fonlarin_getirisi_dolar_her_3ay(
     # 按值从大到小排序字典
     sorted_data = dict(sorted(data.items(), key=lambda item: item[1], reverse=True))
 
+    await report_skipped_months(response, skipped)
     return sorted_data
 
 
+jobs.register("fonlarin_getirisi_dolar", fonlarin_getirisi_dolar)
+jobs.register("fonlarin_getirisi_dolar_her_3ay", fonlarin_getirisi_dolar_her_3ay)
+router.include_router(jobs_router)
+
 app.include_router(router)
@@ -0,0 +1,92 @@
+import time
+
+from fastapi import APIRouter, Response
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+from pymongo import monitoring
+from starlette.routing import Match
+
+# TEFAS calls take seconds, Mongo and most routes milliseconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+REQUEST_DURATION = Histogram("http_request_duration_seconds", "Route latency", ["method", "route", "status"], buckets=BUCKETS)
+REQUESTS_IN_PROGRESS = Gauge("http_requests_in_progress", "Requests being handled", ["method", "route"])
+
+UPSTREAM_REQUESTS = Counter("upstream_requests_total", "Upstream calls", ["upstream", "endpoint", "status"])
+UPSTREAM_DURATION = Histogram("upstream_request_duration_seconds", "Upstream call latency, including the wait for a connection slot", ["upstream", "endpoint"], buckets=BUCKETS)
+UPSTREAM_ERRORS = Counter("upstream_errors_total", "Upstream calls that failed", ["upstream", "endpoint", "error"])
+UPSTREAM_BYTES = Counter("upstream_response_bytes_total", "Upstream response body bytes", ["upstream", "endpoint"])
+UPSTREAM_RETRIES = Counter("upstream_retries_total", "Upstream calls retried", ["upstream", "endpoint"])
+UPSTREAM_REJECTED = Counter("upstream_rejected_total", "Upstream calls failed fast by an open circuit", ["upstream", "endpoint"])
+UPSTREAM_CIRCUIT_STATE = Gauge("upstream_circuit_state", "Circuit breaker state: 0 closed, 1 half-open, 2 open", ["upstream"])
+UPSTREAM_CIRCUIT_OPENS = Counter("upstream_circuit_opens_total", "Times the circuit breaker opened", ["upstream"])
+
+CACHE_REQUESTS = Counter("cache_requests_total", "Cache lookups", ["cache", "result"])
+
+MONGO_DURATION = Histogram("mongo_command_duration_seconds", "Mongo command latency", ["collection", "command"], buckets=BUCKETS)
+MONGO_ERRORS = Counter("mongo_command_errors_total", "Mongo commands that failed", ["collection", "command"])
+
+
+def route_path(scope) -> str:
+    """Route template (e.g. ``/v1/accounts/{account_id}``) so paths with ids share one series."""
+    for route in scope["app"].routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = route_path(scope)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        in_progress = REQUESTS_IN_PROGRESS.labels(method, route)
+        in_progress.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            REQUEST_DURATION.labels(method, route, str(status)).observe(time.perf_counter() - started)
+            in_progress.dec()
+
+
+class MongoMetrics(monitoring.CommandListener):
+    """Times every command per collection (pymongo calls these from its own threads)."""
+
+    def __init__(self):
+        self.collections: dict[int, str] = {}  # request id -> collection
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        self.collections[event.request_id] = collection if isinstance(collection, str) else ""
+
+    def succeeded(self, event):
+        collection = self.collections.pop(event.request_id, "")
+        MONGO_DURATION.labels(collection, event.command_name).observe(event.duration_micros / 1e6)
+
+    def failed(self, event):
+        collection = self.collections.pop(event.request_id, "")
+        MONGO_DURATION.labels(collection, event.command_name).observe(event.duration_micros / 1e6)
+        MONGO_ERRORS.labels(collection, event.command_name).inc()
+
+
+router = APIRouter()
+
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -1,9 +1,12 @@
+import asyncio
 import re
 from bson import ObjectId
+from pymongo import ReturnDocument
 from pydantic import BaseModel, Field, field_validator
 from datetime import datetime
 from typing import List
 from .database import mongodb
+from app.config import SERIAL_BLOCK_SIZE
 
 
 class AccountCreate(BaseModel):
@@ -31,6 +34,34 @@ class AccountResponseModel(BaseModel):
 
 class GetAccountsResponseModel(BaseModel):
     accounts: List[AccountResponseModel]
+    next_after: str | None = None  # cursor for the next page when paginating
+
+
+class StatementEntryModel(BaseModel):
+    serialNumber: int
+    create_date: datetime
+    description: str | None = None
+    amount: float  # signed change of this account's balance
+    balance: float  # balance after the transaction
+
+class StatementPeriodModel(BaseModel):
+    start: datetime
+    credit: float
+    debit: float
+    net: float
+    count: int
+    balance: float  # balance at the end of the period
+
+class StatementResponseModel(BaseModel):
+    account_id: str
+    start: datetime | None
+    end: datetime
+    period: str
+    opening_balance: float
+    closing_balance: float
+    entries: List[StatementEntryModel]
+    periods: List[StatementPeriodModel]
+    next_after: str | None = None  # cursor for the next page of entries when paginating
 
 
 class ResponseModel(BaseModel):
@@ -38,6 +69,54 @@ class ResponseModel(BaseModel):
     message: str
 
 # Transaction
+class SerialAllocator:
+    """Hands out serial numbers from blocks reserved in the ``counters`` collection.
+
+    Each reservation moves the counter forward by ``block_size`` with a single
+    ``$inc`` and the numbers in the block are then given out locally, so
+    workers never share a number. Single and bulk creates take from the same
+    block, so within a process serials follow creation order. Numbers left in
+    a block when the process stops, or when a bulk reservation does not fit
+    in it, are skipped.
+
+    Every worker process has its own block, so across processes serials are
+    unique but not in creation order; with a ``block_size`` of 1 they are.
+    The ``after`` cursor of ``/transactions`` therefore pages through the
+    stored transactions once each, but polling it for new ones can miss a
+    transaction that got a smaller serial from another worker's block.
+    """
+
+    def __init__(self, counter_id: str, block_size: int):
+        self.counter_id = counter_id
+        self.block_size = block_size
+        self.next_value = 0
+        self.last_value = -1  # last number of the current block
+        self.lock = asyncio.Lock()
+
+    async def next(self) -> int:
+        return await self.reserve(1)
+
+    async def reserve(self, count: int) -> int:
+        """Reserve ``count`` consecutive serials and return the first."""
+        async with self.lock:
+            if self.last_value - self.next_value + 1 < count:
+                size = max(count, self.block_size)
+                counter = await mongodb.counters_collection.find_one_and_update(
+                    {"_id": self.counter_id},
+                    {"$inc": {"sequence_value": size}},
+                    upsert=True,
+                    return_document=ReturnDocument.AFTER
+                )
+                self.last_value = counter["sequence_value"]
+                self.next_value = self.last_value - size + 1
+            first = self.next_value
+            self.next_value += count
+            return first
+
+
+transaction_serials = SerialAllocator("transaction_serial", SERIAL_BLOCK_SIZE)
+
+
 class TransactionCreate(BaseModel):
     serialNumber: int | None = None
     account_id_High: str 
@@ -51,14 +130,8 @@ class TransactionCreate(BaseModel):
 
     @classmethod
     async def _generate_serial_number(cls) -> int:
-        counter = await mongodb.counters_collection.find_one_and_update(
-            {"_id": "transaction_serial"},
-            {"$inc": {"sequence_value": 1}},
-            upsert=True,
-            return_document=True
-        )
-        return counter["sequence_value"]    
-    
+        return await transaction_serials.next()
+
 class TransactionResponseModel(BaseModel):
     serialNumber: int
     account_id_High: str 
@@ -72,3 +145,15 @@ class TransactionResponseModel(BaseModel):
 
 class TransactionsResponseModel(BaseModel):
     transactions: List[TransactionResponseModel]
+    next_after: int | None = None  # cursor for the next page when paginating
+
+
+class BulkTransactionResultModel(BaseModel):
+    index: int  # position of the record in the request
+    serialNumber: int | None = None
+    error: str | None = None
+
+class BulkTransactionsResponseModel(BaseModel):
+    inserted: int
+    failed: int
+    results: List[BulkTransactionResultModel]
@@ -0,0 +1,76 @@
+from functools import lru_cache
+
+from app.config import FUND_FILTERS
+from app.upstream import upstream
+
+# FONTURACIKLAMA words excluded by the fund list endpoints unless configured otherwise
+DEFAULT_EXCLUDE = ("Serbest", "Para", "Katılım", "Borçlanma", "Kira")
+
+
+class FundFilter:
+    """Keeps funds whose FONTURACIKLAMA contains none of ``exclude`` and, if
+    ``include`` is given, at least one of ``include``.
+
+    TEFAS only has a few dozen fund types, so the decision is made once per
+    category and remembered; checking a fund is a single dict lookup.
+    """
+
+    def __init__(self, exclude: tuple[str, ...] = (), include: tuple[str, ...] = ()):
+        self.exclude = exclude
+        self.include = include
+        self.allowed: dict[str, bool] = {}
+
+    def allows(self, category: str) -> bool:
+        allowed = self.allowed.get(category)
+        if allowed is None:
+            allowed = not any(word in category for word in self.exclude) and (not self.include or any(word in category for word in self.include))
+            self.allowed[category] = allowed
+        return allowed
+
+
+@lru_cache(maxsize=128)
+def compile_filter(exclude: tuple[str, ...], include: tuple[str, ...]) -> FundFilter:
+    return FundFilter(exclude, include)
+
+
+def split_words(value: str) -> tuple[str, ...]:
+    return tuple(word.strip() for word in value.split(",") if word.strip())
+
+
+def fund_filter(endpoint: str, haric: str | None = None, dahil: str | None = None, exclude: tuple[str, ...] = DEFAULT_EXCLUDE) -> FundFilter:
+    """Filter for ``endpoint``: the ``haric``/``dahil`` query parameters win over the
+    endpoint's entry in the ``fund_filters`` config, which wins over ``exclude``.
+    """
+    settings = FUND_FILTERS.get(endpoint, {})
+    exclude = split_words(haric) if haric is not None else tuple(settings.get("exclude", exclude))
+    include = split_words(dahil) if dahil is not None else tuple(settings.get("include", ()))
+    return compile_filter(exclude, include)
+
+
+class Snapshot:
+    """A TEFAS fund list result (``BindComparison*``) indexed at parse time.
+
+    ``data`` is the upstream JSON as returned and ``funds`` maps FONKODU to
+    its row, so per-fund lookups and cross-month joins are dict lookups
+    instead of list scans.
+    With a ``fund_filter`` the rows it rejects are dropped in the same pass
+    and ``recordsTotal``/``recordsFiltered`` are updated.
+    """
+
+    def __init__(self, data: dict, fund_filter: FundFilter | None = None):
+        self.data = data
+        self.funds: dict[str, dict] = {}
+        items = []
+        for item in data['data']:
+            if fund_filter is not None and not fund_filter.allows(item['FONTURACIKLAMA']):
+                continue
+            items.append(item)
+            self.funds[item['FONKODU']] = item
+        if fund_filter is not None:
+            data['data'] = items
+            data['recordsTotal'] = len(items)
+            data['recordsFiltered'] = len(items)
+
+
+async def fetch_snapshot(endpoint: str, payload: dict, fund_filter: FundFilter | None = None) -> Snapshot:
+    return Snapshot(await upstream.tefas(endpoint, payload), fund_filter)
@@ -0,0 +1,279 @@
+import asyncio
+import logging
+import random
+import time
+
+import httpx
+import orjson
+
+from app.cache import tefas_cache
+from app.metrics import UPSTREAM_REQUESTS, UPSTREAM_DURATION, UPSTREAM_ERRORS, UPSTREAM_BYTES, UPSTREAM_RETRIES, UPSTREAM_REJECTED, UPSTREAM_CIRCUIT_STATE, UPSTREAM_CIRCUIT_OPENS
+from app.config import (
+    TEFAS_API_URL, BINANCE_API_URL, UPSTREAM_MAX_CONNECTIONS, UPSTREAM_MAX_KEEPALIVE_CONNECTIONS, UPSTREAM_CONNECT_TIMEOUT, UPSTREAM_READ_TIMEOUT,
+    TEFAS_READ_TIMEOUT, BINANCE_READ_TIMEOUT, TEFAS_CONCURRENCY, BINANCE_CONCURRENCY,
+    UPSTREAM_MAX_RETRIES, UPSTREAM_BACKOFF, UPSTREAM_BACKOFF_MAX, UPSTREAM_BREAKER_THRESHOLD, UPSTREAM_BREAKER_RESET,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(httpx.HTTPError):
+    """The upstream's circuit is open; the call was not sent."""
+
+
+class InvalidBodyError(httpx.HTTPError):
+    """The upstream answered 2xx with a body that is not the expected JSON
+    (e.g. an HTML maintenance page); retried like a 5xx."""
+
+    def __init__(self, message: str, response: httpx.Response):
+        super().__init__(message)
+        self.response = response
+
+
+def tefas_body(response: httpx.Response):
+    # every Bind* endpoint returns a DataTables object with a "data" list
+    try:
+        data = orjson.loads(response.content)
+    except orjson.JSONDecodeError:
+        data = None
+    if not isinstance(data, dict) or not isinstance(data.get("data"), list):
+        raise InvalidBodyError(f"TEFAS returned no JSON data ({response.headers.get('content-type', 'no content type')})", response)
+
+
+def binance_body(response: httpx.Response):
+    try:
+        orjson.loads(response.content)
+    except orjson.JSONDecodeError:
+        raise InvalidBodyError(f"Binance returned no JSON ({response.headers.get('content-type', 'no content type')})", response)
+
+
+class CircuitBreaker:
+    """Stops calling an upstream after ``threshold`` consecutive failures.
+
+    While open every call fails at once with ``CircuitOpenError``. After
+    ``reset_timeout`` seconds one trial call is let through (half-open): its
+    success closes the circuit, its failure opens it again.
+    """
+
+    CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+
+    def __init__(self, upstream: str, threshold: int, reset_timeout: float):
+        self.upstream = upstream
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial = False  # a half-open trial call is in flight
+        self.set_state(self.CLOSED)
+
+    def set_state(self, state: int):
+        self.state = state
+        UPSTREAM_CIRCUIT_STATE.labels(self.upstream).set(state)
+
+    def enter(self) -> bool:
+        """Raises ``CircuitOpenError`` unless a call may be sent now; True for the trial call."""
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.set_state(self.HALF_OPEN)
+        if self.state == self.CLOSED:
+            return False
+        if self.state == self.OPEN or self.trial:
+            raise CircuitOpenError(f"{self.upstream} is unavailable, circuit open")
+        self.trial = True
+        return True
+
+    def leave(self, trial: bool):
+        # also after a cancelled trial call, so the next call becomes the trial
+        if trial:
+            self.trial = False
+
+    def success(self):
+        self.failures = 0
+        if self.state != self.CLOSED:
+            self.set_state(self.CLOSED)
+
+    def failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.threshold):
+            self.opened_at = time.monotonic()
+            self.set_state(self.OPEN)
+            UPSTREAM_CIRCUIT_OPENS.labels(self.upstream).inc()
+            logger.warning("Circuit opened", extra={"upstream": self.upstream, "failures": self.failures})
+
+
+class Policy:
+    """How one upstream is called: timeouts, concurrency, retries and circuit breaker.
+
+    Idempotent reads that time out, cannot connect or get a 429/5xx are retried
+    up to ``retries`` times after a full-jitter exponential backoff (a 429's
+    ``Retry-After`` is honoured up to ``backoff_max``).
+    """
+
+    def __init__(self, upstream: str, connect_timeout: float, read_timeout: float, concurrency: int, retries: int, backoff: float, backoff_max: float, breaker_threshold: int, breaker_reset: float):
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.breaker = CircuitBreaker(upstream, breaker_threshold, breaker_reset)
+
+    def delay(self, retry: int, error: httpx.HTTPError) -> float:
+        if isinstance(error, httpx.HTTPStatusError) and error.response.status_code == 429:
+            try:
+                return min(float(error.response.headers["Retry-After"]), self.backoff_max)
+            except (KeyError, ValueError):
+                pass
+        return random.uniform(0, min(self.backoff_max, self.backoff * 2 ** retry))
+
+
+def retryable(error: httpx.HTTPError) -> bool:
+    """Errors a later attempt may not get; they also count against the circuit."""
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code == 429 or error.response.status_code >= 500
+    return isinstance(error, (httpx.TransportError, InvalidBodyError))
+
+
+class Upstream:
+    """Application-scoped async HTTP client for TEFAS and Binance.
+
+    The connection pool is opened in the FastAPI lifespan hook (``start``) and
+    closed on shutdown (``close``), so every route shares the same keep-alive
+    connections instead of blocking the event loop with ``requests``. Each
+    host has its own ``Policy``: a semaphore so fan-outs (e.g. one request per
+    month) are issued concurrently without flooding TEFAS or Binance, its
+    timeouts, retries and circuit breaker.
+    """
+
+    def __init__(self, tefas_url: str, binance_url: str, max_connections: int, max_keepalive_connections: int, connect_timeout: float, read_timeout: float, policies: dict[str, Policy]):
+        self.tefas_url = tefas_url
+        self.binance_url = binance_url
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive_connections)
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.client: httpx.AsyncClient | None = None
+        self.policies = policies
+        self.inflight: dict[str, asyncio.Future] = {}
+
+    async def start(self):
+        if self.client is None:
+            self.client = httpx.AsyncClient(limits=self.limits, timeout=self.timeout)
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    async def tefas(self, endpoint: str, payload: dict, cache: bool = True) -> dict:
+        # e.g. endpoint = "BindComparisonFundReturns"
+        # every caller parses its own copy because handlers modify the result in place
+        return orjson.loads(await self.tefas_raw(endpoint, payload, cache))
+
+    async def tefas_raw(self, endpoint: str, payload: dict, cache: bool = True) -> bytes:
+        """The TEFAS response body as JSON bytes, for endpoints that pass it through unchanged."""
+        if cache:
+            cached = await tefas_cache.get_raw(endpoint, payload)
+            if cached is not None:
+                return cached
+
+        # single-flight: concurrent callers with the same payload share one request
+        key = tefas_cache.key(endpoint, payload)
+        task = self.inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._tefas(endpoint, payload, cache))
+            self.inflight[key] = task
+            task.add_done_callback(lambda _: self.inflight.pop(key, None))
+        # shield so one caller going away does not cancel the request for the others
+        return await asyncio.shield(task)
+
+    async def _tefas(self, endpoint: str, payload: dict, cache: bool) -> bytes:
+        try:
+            # the Bind* endpoints are queries sent as POST, safe to retry
+            response = await self.request("tefas", endpoint, "POST", f"{self.tefas_url}/{endpoint}", idempotent=True, validate=tefas_body, data=payload)
+        except httpx.HTTPError as e:
+            # TEFAS down or its circuit open: an expired copy is better than an error
+            stale = await tefas_cache.get_stale(endpoint, payload) if cache else None
+            if stale is None:
+                raise
+            logger.warning("Serving a stale TEFAS response", extra={"endpoint": endpoint, "error": repr(e)})
+            return stale
+        if cache:
+            await tefas_cache.set(endpoint, payload, response.content)
+        return response.content
+
+    async def binance(self, endpoint: str, params: dict):
+        # e.g. endpoint = "ticker/price" or "klines"
+        response = await self.request("binance", endpoint, "GET", f"{self.binance_url}/{endpoint}", validate=binance_body, params=params)
+        return response.json()
+
+    async def request(self, upstream: str, endpoint: str, method: str, url: str, idempotent: bool | None = None, validate=None, **kwargs) -> httpx.Response:
+        """Send a request under the upstream's policy; raises for error statuses.
+
+        ``idempotent`` (default: GET only) requests are retried. ``validate``
+        checks a successful response and raises ``InvalidBodyError``, which is
+        retried and counted against the circuit like a 5xx. The backoff sleeps
+        happen outside the semaphore so they do not hold a connection slot.
+        """
+        policy = self.policies[upstream]
+        attempts = 1 + (policy.retries if (method == "GET" if idempotent is None else idempotent) else 0)
+        for attempt in range(attempts):
+            try:
+                trial = policy.breaker.enter()
+            except CircuitOpenError:
+                UPSTREAM_REJECTED.labels(upstream, endpoint).inc()
+                raise
+            try:
+                async with policy.semaphore:
+                    response = await self.send(upstream, endpoint, method, url, timeout=policy.timeout, **kwargs)
+                if validate is not None:
+                    try:
+                        validate(response)
+                    except InvalidBodyError:
+                        UPSTREAM_ERRORS.labels(upstream, endpoint, "InvalidBodyError").inc()
+                        raise
+            except httpx.HTTPError as e:
+                if not retryable(e):
+                    policy.breaker.success()  # the upstream answered
+                    raise
+                policy.breaker.failure()
+                if attempt == attempts - 1:
+                    raise
+                error = e
+            else:
+                policy.breaker.success()
+                return response
+            finally:
+                policy.breaker.leave(trial)
+
+            delay = policy.delay(attempt, error)
+            logger.info("Retrying upstream request", extra={"upstream": upstream, "endpoint": endpoint, "attempt": attempt + 1, "delay": round(delay, 3), "error": repr(error)})
+            UPSTREAM_RETRIES.labels(upstream, endpoint).inc()
+            await asyncio.sleep(delay)
+
+    async def send(self, upstream: str, endpoint: str, method: str, url: str, **kwargs) -> httpx.Response:
+        """Send one request and record it in the upstream metrics; raises for error statuses."""
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+            UPSTREAM_REQUESTS.labels(upstream, endpoint, str(response.status_code)).inc()
+            UPSTREAM_BYTES.labels(upstream, endpoint).inc(len(response.content))
+            response.raise_for_status()
+            return response
+        except httpx.HTTPError as e:
+            if not isinstance(e, httpx.HTTPStatusError):
+                UPSTREAM_REQUESTS.labels(upstream, endpoint, "error").inc()
+            UPSTREAM_ERRORS.labels(upstream, endpoint, type(e).__name__).inc()
+            raise
+        finally:
+            UPSTREAM_DURATION.labels(upstream, endpoint).observe(time.perf_counter() - started)
+
+
+upstream = Upstream(
+    tefas_url=TEFAS_API_URL,
+    binance_url=BINANCE_API_URL,
+    max_connections=UPSTREAM_MAX_CONNECTIONS,
+    max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE_CONNECTIONS,
+    connect_timeout=UPSTREAM_CONNECT_TIMEOUT,
+    read_timeout=UPSTREAM_READ_TIMEOUT,
+    policies={
+        "tefas": Policy("tefas", UPSTREAM_CONNECT_TIMEOUT, TEFAS_READ_TIMEOUT, TEFAS_CONCURRENCY, UPSTREAM_MAX_RETRIES, UPSTREAM_BACKOFF, UPSTREAM_BACKOFF_MAX, UPSTREAM_BREAKER_THRESHOLD, UPSTREAM_BREAKER_RESET),
+        "binance": Policy("binance", UPSTREAM_CONNECT_TIMEOUT, BINANCE_READ_TIMEOUT, BINANCE_CONCURRENCY, UPSTREAM_MAX_RETRIES, UPSTREAM_BACKOFF, UPSTREAM_BACKOFF_MAX, UPSTREAM_BREAKER_THRESHOLD, UPSTREAM_BREAKER_RESET),
+    },
+)
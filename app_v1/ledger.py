@@ -0,0 +1,172 @@
+import asyncio
+import logging
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+
+from app.config import LEDGER_GRACE, LEDGER_RECONCILE_INTERVAL
+from .database import mongodb
+
+# transactions per group when applying the ones stored before the ledger
+BACKFILL_BATCH = 1000
+
+logger = logging.getLogger(__name__)
+
+
+def balance_deltas(transactions: list[dict]) -> defaultdict:
+    """Net balance change per account id: amount_High leaves account_id_High and
+    amount_Low arrives in account_id_Low."""
+    deltas = defaultdict(float)
+    for transaction in transactions:
+        deltas[transaction["account_id_High"]] -= transaction["amount_High"]
+        deltas[transaction["account_id_Low"]] += transaction["amount_Low"]
+    return deltas
+
+
+class Ledger:
+    """Keeps account balances in step with the stored transactions.
+
+    Transactions are written with ``applied: False`` and a ``ledger`` id shared
+    by the ones applied together (a create, a bulk batch, a delete). Applying
+    a group ``$inc``s every account by its net change and pushes the group id
+    to the account's ``ledger_pending``. Then the group's transactions are
+    marked applied (a delete removes them) and the id is pulled from the
+    accounts again.
+
+    An account is never moved twice for one group, even by an ``apply`` that
+    stalled while ``reconcile`` finished the group: the update only matches
+    while the group id is not in ``ledger_pending`` and ``ledger_version`` is
+    still the one read before checking that the group is unfinished, and every
+    balance update bumps ``ledger_version``.
+
+    On a replica set a group is written in one multi-document transaction. A
+    standalone mongod has none, so a crash can leave a group half applied;
+    groups still unapplied after ``grace`` seconds are finished by
+    ``reconcile``, at startup and then every ``interval`` seconds.
+    Transactions stored before balances followed them are applied once, at
+    the first startup, by ``backfill``.
+    """
+
+    def __init__(self, grace: int, interval: int):
+        self.grace = grace
+        self.interval = interval
+        self.accounts = mongodb.db["accounts"]
+        self.transactions = mongodb.db["transactions"]
+        self.task: asyncio.Task | None = None
+
+    async def start(self):
+        if self.task is None:
+            await self.backfill()
+            await self.reconcile()
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.reconcile()
+            except Exception:
+                logger.exception("Ledger reconcile failed")
+
+    @asynccontextmanager
+    async def session(self):
+        """Session with an open multi-document transaction, or None when the server
+        (standalone mongod) does not support transactions."""
+        if not await mongodb.supports_transactions():
+            yield None
+            return
+        async with await mongodb.client.start_session() as session:
+            async with session.start_transaction():
+                yield session
+
+    async def apply(self, group: ObjectId, transactions: list[dict], sign: int = 1, session=None):
+        """Move the balances by the stored ``transactions`` of ``group`` (reverse them with
+        ``sign`` -1 and delete them), then mark the group done."""
+        deltas = {ObjectId(account_id): delta for account_id, delta in balance_deltas(transactions).items() if ObjectId.is_valid(account_id)}
+        while True:
+            accounts = await self.accounts.find(
+                {"_id": {"$in": list(deltas)}, "ledger_pending": {"$ne": group}},
+                {"ledger_version": 1},
+                session=session
+            ).to_list(length=None)
+            if not accounts:
+                break
+            # read after the versions: a group finished since then has bumped them
+            if await self.transactions.find_one({"ledger": group}, {"_id": 1}, session=session) is None:
+                return
+            now = datetime.utcnow()
+            # accounts another group moved in between do not match, they are read again
+            await self.accounts.bulk_write([
+                UpdateOne(
+                    {"_id": account["_id"], "ledger_pending": {"$ne": group}, "ledger_version": account.get("ledger_version")},
+                    {"$inc": {"balance": sign * deltas[account["_id"]], "ledger_version": 1}, "$push": {"ledger_pending": group}, "$set": {"last_update_date": now}}
+                )
+                for account in accounts
+            ], ordered=False, session=session)
+        if sign > 0:
+            await self.transactions.update_many({"ledger": group}, {"$set": {"applied": True}, "$unset": {"ledger": ""}}, session=session)
+        else:
+            await self.transactions.delete_many({"ledger": group}, session=session)
+        await self.accounts.update_many({"ledger_pending": group}, {"$pull": {"ledger_pending": group}}, session=session)
+
+    async def settle(self, group: ObjectId, transactions: list[dict], sign: int = 1, session=None):
+        """``apply`` the group just written. Without a session its transactions are
+        already stored, so a failure is left to ``reconcile`` instead of raised."""
+        try:
+            await self.apply(group, transactions, sign, session)
+        except PyMongoError:
+            if session is not None:
+                raise
+            logger.exception("Ledger group left to reconcile", extra={"ledger": str(group)})
+
+    async def reconcile(self):
+        """Finish the groups that have been unapplied for longer than ``grace``."""
+        cutoff = ObjectId.from_datetime(datetime.utcnow() - timedelta(seconds=self.grace))
+        groups = defaultdict(list)
+        async for transaction in self.transactions.find({"ledger": {"$lt": cutoff}, "applied": False}):
+            groups[transaction["ledger"]].append(transaction)
+        for group, transactions in groups.items():
+            sign = -1 if transactions[0].get("reverting") else 1
+            async with self.session() as session:
+                await self.apply(group, transactions, sign, session)
+            logger.warning("Ledger group reconciled", extra={"ledger": str(group), "transactions": len(transactions), "sign": sign})
+
+        # groups finished by an apply that stopped before pulling their id
+        for group in await self.accounts.distinct("ledger_pending", {"ledger_pending": {"$lt": cutoff}}):
+            if group < cutoff and await self.transactions.find_one({"ledger": group}, {"_id": 1}) is None:
+                await self.accounts.update_many({"ledger_pending": group}, {"$pull": {"ledger_pending": group}})
+
+    async def backfill(self):
+        """Apply the transactions stored before balances were kept in step with them
+        (they have no ``applied`` field), ``BACKFILL_BATCH`` per group. Runs until the
+        ``ledger_backfill`` marker in ``counters`` is set."""
+        if await mongodb.counters_collection.find_one({"_id": "ledger_backfill"}) is not None:
+            return
+        while True:
+            ids = [transaction["_id"] async for transaction in self.transactions.find({"applied": {"$exists": False}}, {"_id": 1}).limit(BACKFILL_BATCH)]
+            if not ids:
+                break
+            group = ObjectId()
+            # another process backfilling at the same time takes the others
+            await self.transactions.update_many({"_id": {"$in": ids}, "applied": {"$exists": False}}, {"$set": {"applied": False, "ledger": group}})
+            transactions = await self.transactions.find({"ledger": group}).to_list(length=None)
+            async with self.session() as session:
+                await self.apply(group, transactions, session=session)
+            logger.warning("Ledger backfilled", extra={"ledger": str(group), "transactions": len(transactions)})
+        await mongodb.counters_collection.update_one({"_id": "ledger_backfill"}, {"$set": {"date": datetime.utcnow()}}, upsert=True)
+
+
+ledger = Ledger(grace=LEDGER_GRACE, interval=LEDGER_RECONCILE_INTERVAL)
@@ -1,42 +1,156 @@
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
-from fastapi import APIRouter, FastAPI, Depends, HTTPException, Path, Query, status
+from fastapi import APIRouter, FastAPI, Depends, HTTPException, Path, Query, Request, status
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
 
-from .models import AccountCreate, AccountResponseModel, GetAccountsResponseModel, ResponseModel, TransactionCreate, TransactionResponseModel, TransactionsResponseModel
+from .models import AccountCreate, AccountResponseModel, GetAccountsResponseModel, ResponseModel, TransactionCreate, TransactionResponseModel, TransactionsResponseModel, BulkTransactionResultModel, BulkTransactionsResponseModel, StatementResponseModel, transaction_serials
 from .database import mongodb
 from .auth import get_api_key
+from .ledger import balance_deltas, ledger
+from app.upstream import upstream
+from app.binance import usdttry_klines
+from app.history import fund_history
+from app.tefas import fetch_snapshot, fund_filter
+from app.cache import tefas_cache
+from app.compression import CompressionMiddleware, compressed_responses
+from app.metrics import MetricsMiddleware, router as metrics_router
+from app.log import RequestIdMiddleware, setup_logging
+from app.jobs import jobs, router as jobs_router
+from app.analytics import return_matrix, dca_table
 from bson import ObjectId
-import requests
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
+import httpx
+import orjson
 from collections import Counter
 import time
 import calendar
+import logging
+import zoneinfo
 
-app = FastAPI()
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await mongodb.ensure_indexes()
+    await upstream.start()
+    await fund_history.start()
+    await ledger.start()
+    await jobs.start()
+    yield
+    await jobs.stop()
+    await ledger.stop()
+    await fund_history.stop()
+    await upstream.close()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(RequestIdMiddleware)
+app.include_router(metrics_router)
 router = APIRouter(prefix="/v1")
 
 # Accounts
 @router.post("/accounts/", dependencies=[Depends(get_api_key)], tags=["Accounts"], response_model=AccountResponseModel, status_code=status.HTTP_201_CREATED)
 async def create_account(account: AccountCreate):
     try:
-        result = await mongodb.db["accounts"].insert_one(account.dict())
-        created_account = await mongodb.db["accounts"].find_one({"_id": result.inserted_id})
-        if not created_account:
-            raise HTTPException(status_code=404, detail="Account creation failed")
+        created_account = account.dict()
+        # insert_one sets created_account["_id"], no need to read it back
+        result = await mongodb.db["accounts"].insert_one(created_account)
+        if not result.inserted_id:
+            raise HTTPException(status_code=500, detail="Account creation failed")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
     return AccountResponseModel.from_mongo(created_account)
 
 
+def json_default(value):
+    return str(value)  # ObjectId, orjson handles datetime itself
+
+
+async def ndjson_lines(cursor, batch: int = 100):
+    # one JSON document per line, written in chunks of `batch` lines
+    lines = []
+    async for document in cursor:
+        lines.append(orjson.dumps(document, default=json_default))
+        if len(lines) == batch:
+            yield b"\n".join(lines) + b"\n"
+            lines = []
+    if lines:
+        yield b"\n".join(lines) + b"\n"
+
+
+ACCOUNT_FIELDS = ("name", "currency", "balance", "type", "create_date", "last_update_date")
+# ledger bookkeeping, see app_v1.ledger
+ACCOUNT_HIDDEN = {"ledger_pending": 0, "ledger_version": 0}
+TRANSACTION_HIDDEN = {"_id": 0, "applied": 0, "ledger": 0, "reverting": 0}
+
+
+def account_row(document: dict) -> dict:
+    document["id"] = str(document.pop("_id"))
+    return document
+
+
+async def account_rows(cursor):
+    async for document in cursor:
+        yield account_row(document)
+
+
 @router.get("/accounts/", dependencies=[Depends(get_api_key)], tags=["Accounts"], response_model=GetAccountsResponseModel)
-async def get_accounts():
+async def get_accounts(
+    fields: str = Query(None, description="Comma separated fields to return, e.g. name,balance (id is always included)"),
+    currency: str = Query(None, description="Only accounts with this currency"),
+    type: int = Query(None, description="Only accounts of this type"),
+    limit: int = Query(None, ge=1, le=1000, description="Page size; returns one page ordered by id"),
+    after: str = Query(None, description="Only accounts with a larger id (next_after of the previous page)"),
+    stream: bool = Query(False, description="Stream accounts as NDJSON instead of one JSON body"),
+):
+    query = {}
+    if currency is not None:
+        query["currency"] = currency
+    if type is not None:
+        query["type"] = type
+    if after is not None:
+        if not ObjectId.is_valid(after):
+            raise HTTPException(status_code=400, detail="Invalid ObjectId")
+        query["_id"] = {"$gt": ObjectId(after)}
+
+    projection = None
+    if fields is not None:
+        projection = [field.strip() for field in fields.split(",") if field.strip()]
+        unknown = [field for field in projection if field not in ACCOUNT_FIELDS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}. Use any of: {', '.join(ACCOUNT_FIELDS)}")
+
+    cursor = mongodb.db["accounts"].find(query, projection if projection is not None else ACCOUNT_HIDDEN)
+    if limit is not None or after is not None:
+        cursor = cursor.sort("_id", 1)
+    if limit is not None:
+        cursor = cursor.limit(limit)
+
+    if stream:
+        return StreamingResponse(ndjson_lines(account_rows(cursor)), media_type="application/x-ndjson")
+
     accounts = []
     try:
-        async for account in mongodb.db["accounts"].find():
-            account['_id'] = str(account['_id'])  # Convert _id to str
-            accounts.append(AccountResponseModel.from_mongo(account))
+        async for account in cursor:
+            accounts.append(account)
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
-    return GetAccountsResponseModel(accounts=accounts)
+    # a full page means there may be more
+    next_after = str(accounts[-1]["_id"]) if limit is not None and len(accounts) == limit else None
+
+    if projection is not None:
+        # partial documents skip model validation
+        return ORJSONResponse({"accounts": [account_row(account) for account in accounts], "next_after": next_after})
+    return GetAccountsResponseModel(accounts=[AccountResponseModel.from_mongo(account) for account in accounts], next_after=next_after)
 
 
 @router.get("/accounts/{account_id}", dependencies=[Depends(get_api_key)], tags=["Accounts"], response_model=AccountResponseModel)
@@ -52,17 +166,183 @@ async def get_account(account_id: str):
     return AccountResponseModel.from_mongo(account)
 
 
+def statement_match(account_id: str, start: datetime | None) -> dict:
+    match = {
+        "$or": [{"account_id_High": account_id}, {"account_id_Low": account_id}],
+        # the transactions the account's balance includes (see app_v1.ledger): applied ones,
+        # and deleted ones until they are reversed
+        "$and": [{"$or": [{"applied": True}, {"reverting": True}]}],
+    }
+    if start is not None:
+        match["create_date"] = {"$gte": start}
+    return match
+
+
+def statement_pipeline(account_id: str, balance: float, start: datetime | None, end: datetime, period: str, timezone: str, after: tuple[datetime, int] | None = None) -> list:
+    """Opening and closing balance and per-period totals of one account from ``start`` to ``end``.
+
+    Everything from ``start`` on is matched through the account_id_High/Low +
+    create_date indexes; the activity after ``end`` is only summed, to get the
+    opening balance back from the account's current ``balance``. ``carried``
+    is the balance the entries start from: the opening balance, or with an
+    ``after`` entry cursor the balance after that entry. The entries are read
+    by ``statement_entries``, a $facet result is one document and capped at 16 MB.
+    """
+    in_range = {"$match": {"create_date": {"$lte": end}}}
+    running = {"documents": ["unbounded", "current"]}
+    truncate = {"date": "$create_date", "unit": period, "timezone": timezone}
+    if period == "week":
+        truncate["startOfWeek"] = "monday"
+    # amount_High leaves account_id_High, amount_Low arrives in account_id_Low
+    amount = {"$add": [
+        {"$cond": [{"$eq": ["$account_id_High", account_id]}, {"$multiply": [-1, "$amount_High"]}, 0]},
+        {"$cond": [{"$eq": ["$account_id_Low", account_id]}, "$amount_Low", 0]},
+    ]}
+    facets = {
+        "total": [{"$group": {"_id": None, "amount": {"$sum": "$amount"}}}],
+        "periods": [
+            in_range,
+            {"$group": {
+                "_id": {"$dateTrunc": truncate},
+                "credit": {"$sum": {"$cond": [{"$gt": ["$amount", 0]}, "$amount", 0]}},
+                "debit": {"$sum": {"$cond": [{"$lt": ["$amount", 0]}, {"$multiply": [-1, "$amount"]}, 0]}},
+                "net": {"$sum": "$amount"},
+                "count": {"$sum": 1},
+            }},
+            {"$setWindowFields": {"sortBy": {"_id": 1}, "output": {"running": {"$sum": "$net", "window": running}}}},
+        ],
+    }
+    if after is not None:
+        # the entries up to and including the cursor
+        facets["before"] = [
+            in_range,
+            {"$match": {"$or": [{"create_date": {"$lt": after[0]}}, {"create_date": after[0], "serialNumber": {"$lte": after[1]}}]}},
+            {"$group": {"_id": None, "amount": {"$sum": "$amount"}}},
+        ]
+    return [
+        {"$match": statement_match(account_id, start)},
+        {"$project": {"_id": 0, "serialNumber": 1, "create_date": 1, "amount": amount}},
+        {"$facet": facets},
+        {"$project": {
+            "periods": 1,
+            "before": 1,
+            "opening_balance": {"$subtract": [balance, {"$ifNull": [{"$first": "$total.amount"}, 0]}]},
+        }},
+        {"$project": {
+            "opening_balance": 1,
+            "closing_balance": {"$add": ["$opening_balance", {"$sum": "$periods.net"}]},
+            "carried": {"$add": ["$opening_balance", {"$ifNull": [{"$first": "$before.amount"}, 0]}]},
+            "periods": {"$map": {"input": "$periods", "in": {
+                "start": "$$this._id",
+                "credit": "$$this.credit",
+                "debit": "$$this.debit",
+                "net": "$$this.net",
+                "count": "$$this.count",
+                "balance": {"$add": ["$opening_balance", "$$this.running"]},
+            }}},
+        }},
+    ]
+
+
+async def statement_entries(account_id: str, start: datetime | None, end: datetime, balance: float, after: tuple[datetime, int] | None = None, limit: int | None = None):
+    """Yield the account's transactions from ``start`` to ``end`` in (create_date,
+    serialNumber) order with the balance after each, counting on from ``balance``."""
+    query = statement_match(account_id, start)
+    query["create_date"] = {**query.get("create_date", {}), "$lte": end}
+    if after is not None:
+        query = {"$and": [query, {"$or": [{"create_date": {"$gt": after[0]}}, {"create_date": after[0], "serialNumber": {"$gt": after[1]}}]}]}
+    projection = {"_id": 0, "serialNumber": 1, "create_date": 1, "description": 1, "account_id_High": 1, "amount_High": 1, "account_id_Low": 1, "amount_Low": 1}
+    cursor = mongodb.db["transactions"].find(query, projection).sort([("create_date", 1), ("serialNumber", 1)]).batch_size(1000)
+    if limit is not None:
+        cursor = cursor.limit(limit)
+    async for transaction in cursor:
+        amount = 0.0
+        if transaction["account_id_High"] == account_id:
+            amount -= transaction["amount_High"]
+        if transaction["account_id_Low"] == account_id:
+            amount += transaction["amount_Low"]
+        balance += amount
+        yield {
+            "serialNumber": transaction["serialNumber"],
+            "create_date": transaction["create_date"],
+            "description": transaction.get("description"),
+            "amount": amount,
+            "balance": balance,
+        }
+
+
+def entry_cursor(value: str) -> tuple[datetime, int]:
+    # "<create_date>,<serialNumber>" of the last entry of a page
+    create_date, _, serial_number = value.rpartition(",")
+    return datetime.fromisoformat(create_date), int(serial_number)
+
+
+async def statement_lines(statement: dict, entries):
+    # the statement without its entries first, then one line per entry
+    yield statement
+    async for entry in entries:
+        yield entry
+
+
+@router.get("/accounts/{account_id}/statement", dependencies=[Depends(get_api_key)], tags=["Accounts"], response_model=StatementResponseModel)
+async def get_account_statement(
+    account_id: str,
+    start: datetime = Query(None, description="First transaction date (create_date), e.g. 2024-01-01T00:00:00"),
+    end: datetime = Query(None, description="Last transaction date, defaults to now"),
+    period: str = Query("month", pattern="^(day|week|month)$", description="Totals per day, week or month"),
+    timezone: str = Query("UTC", description="Timezone the periods start in, e.g. Europe/Istanbul"),
+    limit: int = Query(None, ge=1, le=10000, description="Entries per page; all entries by default"),
+    after: str = Query(None, description="Only entries after this one (next_after of the previous page)"),
+    stream: bool = Query(False, description="Stream NDJSON: the statement without entries, then one line per entry"),
+):
+    if not ObjectId.is_valid(account_id):
+        raise HTTPException(status_code=400, detail="Invalid ObjectId")
+    try:
+        zoneinfo.ZoneInfo(timezone)
+    except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid timezone, use an IANA name such as Europe/Istanbul")
+    if after is not None:
+        try:
+            after = entry_cursor(after)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid after, use next_after of the previous page")
+    if end is None:
+        end = datetime.utcnow()
+    try:
+        account = await mongodb.db["accounts"].find_one({"_id": ObjectId(account_id)}, {"balance": 1})
+        if account is None:
+            raise HTTPException(status_code=404, detail="Account not found")
+        pipeline = statement_pipeline(account_id, account["balance"], start, end, period, timezone, after)
+        statement = (await mongodb.db["transactions"].aggregate(pipeline).to_list(length=1))[0]
+        entries = statement_entries(account_id, start, end, statement.pop("carried"), after, limit)
+        if stream:
+            header = {"account_id": account_id, "start": start, "end": end, "period": period, **statement}
+            return StreamingResponse(ndjson_lines(statement_lines(header, entries)), media_type="application/x-ndjson")
+        entries = [entry async for entry in entries]
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+    # a full page means there may be more
+    next_after = f"{entries[-1]['create_date'].isoformat()},{entries[-1]['serialNumber']}" if limit is not None and len(entries) == limit else None
+    return StatementResponseModel(account_id=account_id, start=start, end=end, period=period, entries=entries, next_after=next_after, **statement)
+
+
 @router.put("/accounts/{account_id}", dependencies=[Depends(get_api_key)], tags=["Accounts"], response_model=AccountResponseModel)
 async def update_account(account_id: str, account: AccountCreate):
     if not ObjectId.is_valid(account_id):
         raise HTTPException(status_code=400, detail="Invalid ObjectId")
     try:
-        result = await mongodb.db["accounts"].update_one({"_id": ObjectId(account_id)}, {"$set": account.dict()})
-        if result.matched_count == 0:
-            raise HTTPException(status_code=404, detail="Account not found")
-        updated_account = await mongodb.db["accounts"].find_one({"_id": ObjectId(account_id)})
+        # balance only moves with transactions
+        updated_account = await mongodb.db["accounts"].find_one_and_update(
+            {"_id": ObjectId(account_id)},
+            {"$set": account.dict(exclude={"balance"})},
+            return_document=ReturnDocument.AFTER
+        )
         if updated_account is None:
             raise HTTPException(status_code=404, detail="Account not found")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
     return AccountResponseModel.from_mongo(updated_account)
@@ -83,29 +363,164 @@ async def delete_account(account_id: str):
 
 # Transactions
 
+async def missing_accounts(account_ids) -> list[str]:
+    account_ids = set(account_ids)
+    object_ids = [ObjectId(account_id) for account_id in account_ids if ObjectId.is_valid(account_id)]
+    found = {str(account["_id"]) async for account in mongodb.db["accounts"].find({"_id": {"$in": object_ids}}, {"_id": 1})}
+    return sorted(account_ids - found)
+
+
 @router.post("/transactions/", dependencies=[Depends(get_api_key)], tags=["Transactions"], response_model=TransactionResponseModel)
 async def create_transaction(transaction: TransactionCreate):
     try:
-        transaction.serialNumber = await TransactionCreate._generate_serial_number()
-        result = await mongodb.db["transactions"].insert_one(transaction.dict())
-        if not result.inserted_id:
-            raise HTTPException(status_code=500, detail="Transaction creation failed")
-            
-        # Retrieve the created transaction from the database
-        created_transaction = await mongodb.db["transactions"].find_one({"_id": result.inserted_id})
-        if not created_transaction:
-            raise HTTPException(status_code=404, detail="Failed to retrieve created transaction")
+        document = transaction.dict()
+        deltas = balance_deltas([document])
+        missing = await missing_accounts(deltas)
+        if missing:
+            raise HTTPException(status_code=404, detail=f"Account not found: {', '.join(missing)}")
+
+        transaction.serialNumber = document["serialNumber"] = await TransactionCreate._generate_serial_number()
+        # 交易先以未生效 (applied: False) 写入, 再更新两个账户余额; 中途失败的由 ledger.reconcile 补完
+        document["applied"] = False
+        document["ledger"] = ObjectId()
+        async with ledger.session() as session:
+            result = await mongodb.db["transactions"].insert_one(document, session=session)
+            if not result.inserted_id:
+                raise HTTPException(status_code=500, detail="Transaction creation failed")
+            await ledger.settle(document["ledger"], [document], session=session)
+
+        # the inserted document is the response, no need to read it back
+        return TransactionResponseModel(**document)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
 
-        return TransactionResponseModel(**created_transaction)
-    
+
+BULK_BATCH_SIZE = 1000  # documents per insert_many
+
+
+async def bulk_records(request: Request):
+    """Yield the raw records of a bulk request: a JSON array, or NDJSON read line by line."""
+    if request.headers.get("content-type", "").startswith("application/x-ndjson"):
+        buffer = b""
+        async for chunk in request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    yield line
+        if buffer.strip():
+            yield buffer
+    else:
+        body = await request.body()
+        try:
+            records = orjson.loads(body)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid JSON: {e}")
+        if not isinstance(records, list):
+            raise HTTPException(status_code=400, detail="Expected a JSON array or application/x-ndjson")
+        for record in records:
+            yield record
+
+
+async def insert_batch(batch: list[tuple[BulkTransactionResultModel, dict]]):
+    """Store one batch of a bulk request and apply its balances, as one ledger group."""
+    group = ObjectId()
+    for _, document in batch:
+        document["applied"] = False
+        document["ledger"] = group
+    async with ledger.session() as session:
+        try:
+            await mongodb.db["transactions"].insert_many([document for _, document in batch], ordered=False, session=session)
+        except BulkWriteError as e:
+            if session is not None:
+                raise  # the transaction is aborted, nothing of the batch is stored
+            for error in e.details["writeErrors"]:
+                result = batch[error["index"]][0]
+                result.serialNumber = None
+                result.error = error["errmsg"]
+        # 批量写入成功的交易按账户合并后更新余额
+        await ledger.settle(group, [document for result, document in batch if result.error is None], session=session)
+
+
+@router.post("/transactions/bulk", dependencies=[Depends(get_api_key)], tags=["Transactions"], response_model=BulkTransactionsResponseModel)
+async def create_transactions_bulk(request: Request):
+    results = []
+    documents = []  # (result, document) of the valid records
+    index = 0
+    async for record in bulk_records(request):
+        result = BulkTransactionResultModel(index=index)
+        index += 1
+        results.append(result)
+        try:
+            if isinstance(record, bytes):
+                record = orjson.loads(record)
+            transaction = TransactionCreate(**record)
+        except (ValueError, TypeError) as e:
+            # ValidationError is a ValueError
+            result.error = str(e)
+            continue
+        documents.append((result, transaction.dict()))
+
+    try:
+        missing = set(await missing_accounts(balance_deltas([document for _, document in documents])))
+        if missing:
+            for result, document in documents:
+                accounts = [account_id for account_id in (document["account_id_High"], document["account_id_Low"]) if account_id in missing]
+                if accounts:
+                    result.error = f"Account not found: {', '.join(accounts)}"
+            documents = [(result, document) for result, document in documents if result.error is None]
+
+        if documents:
+            first = await transaction_serials.reserve(len(documents))
+            for offset, (result, document) in enumerate(documents):
+                document["serialNumber"] = result.serialNumber = first + offset
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
 
+    for start in range(0, len(documents), BULK_BATCH_SIZE):
+        batch = documents[start:start + BULK_BATCH_SIZE]
+        try:
+            await insert_batch(batch)
+        except Exception as e:
+            # 这一批写入失败, 记录到每条结果里, 继续写后面的批次
+            logger.exception("Bulk transaction batch failed", extra={"first_index": batch[0][0].index})
+            for result, _ in batch:
+                result.serialNumber = None
+                result.error = f"Batch failed: {e}"
+
+    failed = sum(1 for result in results if result.error is not None)
+    return BulkTransactionsResponseModel(inserted=len(results) - failed, failed=failed, results=results)
+
 
 @router.get("/transactions/", dependencies=[Depends(get_api_key)], tags=["Transactions"], response_model=TransactionsResponseModel)
-async def get_transactions():
+async def get_transactions(
+    limit: int = Query(None, ge=1, le=1000, description="Page size; returns one page ordered by serialNumber"),
+    after: int = Query(None, description="Only transactions with a larger serialNumber (next_after of the previous page). Pages a snapshot; serials are not in creation order across workers, so this is not a feed of new transactions"),
+    stream: bool = Query(False, description="Stream transactions as NDJSON instead of one JSON body"),
+):
+    query = {} if after is None else {"serialNumber": {"$gt": after}}
+
+    if stream:
+        cursor = mongodb.db["transactions"].find(query, TRANSACTION_HIDDEN).sort("serialNumber", 1).batch_size(1000)
+        if limit is not None:
+            cursor = cursor.limit(limit)
+        return StreamingResponse(ndjson_lines(cursor), media_type="application/x-ndjson")
+
+    if limit is not None:
+        try:
+            transactions = await mongodb.db["transactions"].find(query, TRANSACTION_HIDDEN).sort("serialNumber", 1).limit(limit).to_list(length=limit)
+            transactions_response = [TransactionResponseModel(**transaction) for transaction in transactions]
+            # a full page means there may be more
+            next_after = transactions[-1]["serialNumber"] if len(transactions) == limit else None
+            return TransactionsResponseModel(transactions=transactions_response, next_after=next_after)
+        except Exception as e:
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+
     try:
-        transactions = await mongodb.db["transactions"].find().to_list(length=None)
+        transactions = await mongodb.db["transactions"].find(query).to_list(length=None)
         if not transactions:
             raise HTTPException(status_code=404, detail="No transactions found")
 
@@ -131,10 +546,20 @@ async def get_transaction(serial_number: int):
 @router.delete("/transactions/{serial_number}", dependencies=[Depends(get_api_key)], tags=["Transactions"], response_model=ResponseModel)
 async def delete_transaction(serial_number: int):
     try:
-        result = await mongodb.db["transactions"].delete_one({"serialNumber": serial_number})
-        if result.deleted_count == 0:
-            raise HTTPException(status_code=404, detail="Transaction not found")
+        # 先标记为回滚中, 再回滚两个账户的余额并删除交易; 中途失败的由 ledger.reconcile 补完
+        async with ledger.session() as session:
+            transaction = await mongodb.db["transactions"].find_one_and_update(
+                {"serialNumber": serial_number, "applied": True},
+                {"$set": {"applied": False, "reverting": True, "ledger": ObjectId()}},
+                return_document=ReturnDocument.AFTER,
+                session=session
+            )
+            if transaction is None:
+                raise HTTPException(status_code=404, detail="Transaction not found")
+            await ledger.settle(transaction["ledger"], [transaction], sign=-1, session=session)
         return ResponseModel(success=True, message="Transaction deleted")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
     
@@ -154,8 +579,11 @@ class ComparisonFundReturnsRequest(BaseModel):
 
 @router.get("/tefas/BindComparisonFundReturns", tags=["Tefas"])
 async def bind_comparison_fund_returns(
+    request: Request,
     bastarih: str = Query(None, description="Start date in format DD.MM.YYYY"),
-    bittarih: str = Query(None, description="End date in format DD.MM.YYYY")
+    bittarih: str = Query(None, description="End date in format DD.MM.YYYY"),
+    haric: str = Query(None, description="Excluded fund types (words in FONTURACIKLAMA), comma separated"),
+    dahil: str = Query(None, description="Included fund types (words in FONTURACIKLAMA), comma separated")
 ):
     # Default dates: past month
     if not bastarih:
@@ -168,42 +596,16 @@ async def bind_comparison_fund_returns(
         bittarih=bittarih
     )
 
-    url = 'https://www.tefas.gov.tr/api/DB/BindComparisonFundReturns'
-
     try:
-        response = requests.post(url, data=payload.dict())
-        response.raise_for_status()
-        data = response.json()
-
-        # 使用列表解析来过滤掉含有“Serbest”的项
-        data['data'] = [item for item in data['data'] if 'Serbest' not in item['FONTURACIKLAMA']]
-        # 更新 recordsTotal 和 recordsFiltered
-        data['recordsTotal'] = len(data['data'])
-        data['recordsFiltered'] = len(data['data'])
-
-        # 使用列表解析来过滤掉含有“Serbest”的项
-        data['data'] = [item for item in data['data'] if 'Para' not in item['FONTURACIKLAMA']]
-        # 更新 recordsTotal 和 recordsFiltered
-        data['recordsTotal'] = len(data['data'])
-        data['recordsFiltered'] = len(data['data'])
-
-        # 使用列表解析来过滤掉含有“Serbest”的项
-        data['data'] = [item for item in data['data'] if 'Katılım' not in item['FONTURACIKLAMA']]
-        # 更新 recordsTotal 和 recordsFiltered
-        data['recordsTotal'] = len(data['data'])
-        data['recordsFiltered'] = len(data['data'])
-
-        # 使用列表解析来过滤掉含有“Serbest”的项
-        data['data'] = [item for item in data['data'] if 'Borçlanma' not in item['FONTURACIKLAMA']]
-        # 更新 recordsTotal 和 recordsFiltered
-        data['recordsTotal'] = len(data['data'])
-        data['recordsFiltered'] = len(data['data'])
-
-        # 使用列表解析来过滤掉含有“Serbest”的项
-        data['data'] = [item for item in data['data'] if 'Kira' not in item['FONTURACIKLAMA']]
-        # 更新 recordsTotal 和 recordsFiltered
-        data['recordsTotal'] = len(data['data'])
-        data['recordsFiltered'] = len(data['data'])
+        # 同样的参数直接返回已渲染 (并已压缩) 的结果
+        cache_key = f"BindComparisonFundReturns:{haric}:{dahil}:" + tefas_cache.key("BindComparisonFundReturns", payload.dict())
+        cached = await compressed_responses.get(cache_key, request)
+        if cached is not None:
+            return cached
+
+        # 解析时一次性过滤 FONTURACIKLAMA (默认排除 Serbest, Para, Katılım, Borçlanma, Kira)
+        snapshot = await fetch_snapshot("BindComparisonFundReturns", payload.dict(), fund_filter("BindComparisonFundReturns", haric, dahil))
+        data = snapshot.data
 
         # 处理 GETIRIORANI 为 None 的情况，将 None 替换为一个最小的值（如负无穷）
         for item in data['data']:
@@ -216,14 +618,15 @@ async def bind_comparison_fund_returns(
         # 更新原数据
         data['data'] = sorted_data
 
-        return data
-    except requests.exceptions.HTTPError as http_err:
+        # 直接交给 orjson 编码, 跳过 jsonable_encoder 逐个字段的转换
+        return await compressed_responses.put(cache_key, orjson.dumps(data), tefas_cache.expires_at(payload.dict()), request)
+    except httpx.HTTPStatusError as http_err:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"HTTP error occurred: {http_err}")
-    except requests.exceptions.ConnectionError as conn_err:
+    except httpx.ConnectError as conn_err:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Connection error occurred: {conn_err}")
-    except requests.exceptions.Timeout as timeout_err:
+    except httpx.TimeoutException as timeout_err:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Timeout error occurred: {timeout_err}")
-    except requests.exceptions.RequestException as req_err:
+    except httpx.HTTPError as req_err:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"An error occurred: {req_err}")
 
 class BindHistoryInfo(BaseModel):
@@ -254,27 +657,26 @@ async def bind_history_info(
         bittarih=bittarih
     )
 
-    url = 'https://www.tefas.gov.tr/api/DB/BindHistoryInfo'
-
     try:
-        response = requests.post(url, data=payload.dict())
-        response.raise_for_status()
-        data = response.json()
-        return data
-    except requests.exceptions.HTTPError as http_err:
+        # 原样返回 TEFAS 的 JSON, 不再解析和重新编码
+        return Response(await upstream.tefas_raw("BindHistoryInfo", payload.dict()), media_type="application/json")
+    except httpx.HTTPStatusError as http_err:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"HTTP error occurred: {http_err}")
-    except requests.exceptions.ConnectionError as conn_err:
+    except httpx.ConnectError as conn_err:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Connection error occurred: {conn_err}")
-    except requests.exceptions.Timeout as timeout_err:
+    except httpx.TimeoutException as timeout_err:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Timeout error occurred: {timeout_err}")
-    except requests.exceptions.RequestException as req_err:
+    except httpx.HTTPError as req_err:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"An error occurred: {req_err}")
 
 
 @router.get("/tefas/BindComparisonFundSizes", tags=["Tefas"])
 async def bind_comparison_fund_sizes(
+    request: Request,
     bastarih: str = Query(None, description="Start date in format DD.MM.YYYY"),
-    bittarih: str = Query(None, description="End date in format DD.MM.YYYY")
+    bittarih: str = Query(None, description="End date in format DD.MM.YYYY"),
+    haric: str = Query(None, description="Excluded fund types (words in FONTURACIKLAMA), comma separated"),
+    dahil: str = Query(None, description="Included fund types (words in FONTURACIKLAMA), comma separated")
 ):
     # Default dates: past month
     if not bastarih:
@@ -287,42 +689,16 @@ async def bind_comparison_fund_sizes(
         bittarih=bittarih
     )
 
-    url = 'https://www.tefas.gov.tr/api/DB/BindComparisonFundSizes'
-
     try:
-        response = requests.post(url, data=payload.dict())
-        response.raise_for_status()
-        data = response.json()
-
-        # 使用列表解析来过滤掉含有“Serbest”的项
-        data['data'] = [item for item in data['data'] if 'Serbest' not in item['FONTURACIKLAMA']]
-        # 更新 recordsTotal 和 recordsFiltered
-        data['recordsTotal'] = len(data['data'])
-        data['recordsFiltered'] = len(data['data'])
-
-        # 使用列表解析来过滤掉含有“Serbest”的项
-        data['data'] = [item for item in data['data'] if 'Para' not in item['FONTURACIKLAMA']]
-        # 更新 recordsTotal 和 recordsFiltered
-        data['recordsTotal'] = len(data['data'])
-        data['recordsFiltered'] = len(data['data'])
-
-        # 使用列表解析来过滤掉含有“Serbest”的项
-        data['data'] = [item for item in data['data'] if 'Katılım' not in item['FONTURACIKLAMA']]
-        # 更新 recordsTotal 和 recordsFiltered
-        data['recordsTotal'] = len(data['data'])
-        data['recordsFiltered'] = len(data['data'])
-
-        # 使用列表解析来过滤掉含有“Serbest”的项
-        data['data'] = [item for item in data['data'] if 'Borçlanma' not in item['FONTURACIKLAMA']]
-        # 更新 recordsTotal 和 recordsFiltered
-        data['recordsTotal'] = len(data['data'])
-        data['recordsFiltered'] = len(data['data'])
-
-        # 使用列表解析来过滤掉含有“Serbest”的项
-        data['data'] = [item for item in data['data'] if 'Kira' not in item['FONTURACIKLAMA']]
-        # 更新 recordsTotal 和 recordsFiltered
-        data['recordsTotal'] = len(data['data'])
-        data['recordsFiltered'] = len(data['data'])
+        # 同样的参数直接返回已渲染 (并已压缩) 的结果
+        cache_key = f"BindComparisonFundSizes:{haric}:{dahil}:" + tefas_cache.key("BindComparisonFundSizes", payload.dict())
+        cached = await compressed_responses.get(cache_key, request)
+        if cached is not None:
+            return cached
+
+        # 解析时一次性过滤 FONTURACIKLAMA (默认排除 Serbest, Para, Katılım, Borçlanma, Kira)
+        snapshot = await fetch_snapshot("BindComparisonFundSizes", payload.dict(), fund_filter("BindComparisonFundSizes", haric, dahil))
+        data = snapshot.data
 
         # 处理 GETIRIORANI 为 None 的情况，将 None 替换为一个最小的值（如负无穷）
         for item in data['data']:
@@ -335,18 +711,22 @@ async def bind_comparison_fund_sizes(
         # 更新原数据
         data['data'] = sorted_data
 
-        return data
-    except requests.exceptions.HTTPError as http_err:
+        # 直接交给 orjson 编码, 跳过 jsonable_encoder 逐个字段的转换
+        return await compressed_responses.put(cache_key, orjson.dumps(data), tefas_cache.expires_at(payload.dict()), request)
+    except httpx.HTTPStatusError as http_err:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"HTTP error occurred: {http_err}")
-    except requests.exceptions.ConnectionError as conn_err:
+    except httpx.ConnectError as conn_err:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Connection error occurred: {conn_err}")
-    except requests.exceptions.Timeout as timeout_err:
+    except httpx.TimeoutException as timeout_err:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Timeout error occurred: {timeout_err}")
-    except requests.exceptions.RequestException as req_err:
+    except httpx.HTTPError as req_err:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"An error occurred: {req_err}")
 
 @router.get("/tefas/BindComparisonManagementFees", tags=["Tefas"])
 async def bind_comparison_management_fees(
+    request: Request,
+    haric: str = Query(None, description="Excluded fund types (words in FONTURACIKLAMA), comma separated"),
+    dahil: str = Query(None, description="Included fund types (words in FONTURACIKLAMA), comma separated")
 ):
         
     payload = {
@@ -359,58 +739,35 @@ async def bind_comparison_management_fees(
         "islemdurum": "1"
     }
 
-    url = 'https://www.tefas.gov.tr/api/DB/BindComparisonManagementFees'
-
     try:
-        response = requests.post(url, data=payload)
-        response.raise_for_status()
-        data = response.json()
-
-        # 使用列表解析来过滤掉含有“Serbest”的项
-        data['data'] = [item for item in data['data'] if 'Serbest' not in item['FONTURACIKLAMA']]
-        # 更新 recordsTotal 和 recordsFiltered
-        data['recordsTotal'] = len(data['data'])
-        data['recordsFiltered'] = len(data['data'])
-
-        # 使用列表解析来过滤掉含有“Serbest”的项
-        data['data'] = [item for item in data['data'] if 'Para' not in item['FONTURACIKLAMA']]
-        # 更新 recordsTotal 和 recordsFiltered
-        data['recordsTotal'] = len(data['data'])
-        data['recordsFiltered'] = len(data['data'])
-
-        # 使用列表解析来过滤掉含有“Serbest”的项
-        data['data'] = [item for item in data['data'] if 'Katılım' not in item['FONTURACIKLAMA']]
-        # 更新 recordsTotal 和 recordsFiltered
-        data['recordsTotal'] = len(data['data'])
-        data['recordsFiltered'] = len(data['data'])
-
-        # 使用列表解析来过滤掉含有“Serbest”的项
-        data['data'] = [item for item in data['data'] if 'Borçlanma' not in item['FONTURACIKLAMA']]
-        # 更新 recordsTotal 和 recordsFiltered
-        data['recordsTotal'] = len(data['data'])
-        data['recordsFiltered'] = len(data['data'])
-
-        # 使用列表解析来过滤掉含有“Serbest”的项
-        data['data'] = [item for item in data['data'] if 'Kira' not in item['FONTURACIKLAMA']]
-        # 更新 recordsTotal 和 recordsFiltered
-        data['recordsTotal'] = len(data['data'])
-        data['recordsFiltered'] = len(data['data'])
-
-        return data
-    except requests.exceptions.HTTPError as http_err:
+        # 同样的参数直接返回已渲染 (并已压缩) 的结果
+        cache_key = f"BindComparisonManagementFees:{haric}:{dahil}:" + tefas_cache.key("BindComparisonManagementFees", payload)
+        cached = await compressed_responses.get(cache_key, request)
+        if cached is not None:
+            return cached
+
+        # 解析时一次性过滤 FONTURACIKLAMA (默认排除 Serbest, Para, Katılım, Borçlanma, Kira)
+        snapshot = await fetch_snapshot("BindComparisonManagementFees", payload, fund_filter("BindComparisonManagementFees", haric, dahil))
+        data = snapshot.data
+
+        # 直接交给 orjson 编码, 跳过 jsonable_encoder 逐个字段的转换
+        return await compressed_responses.put(cache_key, orjson.dumps(data), tefas_cache.expires_at(payload), request)
+    except httpx.HTTPStatusError as http_err:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"HTTP error occurred: {http_err}")
-    except requests.exceptions.ConnectionError as conn_err:
+    except httpx.ConnectError as conn_err:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Connection error occurred: {conn_err}")
-    except requests.exceptions.Timeout as timeout_err:
+    except httpx.TimeoutException as timeout_err:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Timeout error occurred: {timeout_err}")
-    except requests.exceptions.RequestException as req_err:
+    except httpx.HTTPError as req_err:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"An error occurred: {req_err}")
 
 
 @router.get("/tefas/DegeriArtan_V2", tags=["Tefas"])
 async def bind_comparison_fund_sizes(
     bastarih: str = Query(None, description="Start date in format DD.MM.YYYY"),
-    bittarih: str = Query(None, description="End date in format DD.MM.YYYY")
+    bittarih: str = Query(None, description="End date in format DD.MM.YYYY"),
+    haric: str = Query(None, description="Excluded fund types (words in FONTURACIKLAMA), comma separated"),
+    dahil: str = Query(None, description="Included fund types (words in FONTURACIKLAMA), comma separated")
 ):
     # Default dates: past month
     if not bastarih:
@@ -423,42 +780,10 @@ async def bind_comparison_fund_sizes(
         bittarih=bittarih
     )
 
-    url = 'https://www.tefas.gov.tr/api/DB/BindComparisonFundSizes'
-
     try:
-        response = requests.post(url, data=payload.dict())
-        response.raise_for_status()
-        data = response.json()
-
-        # 使用列表解析来过滤掉含有“Serbest”的项
-        data['data'] = [item for item in data['data'] if 'Serbest' not in item['FONTURACIKLAMA']]
-        # 更新 recordsTotal 和 recordsFiltered
-        data['recordsTotal'] = len(data['data'])
-        data['recordsFiltered'] = len(data['data'])
-
-        # 使用列表解析来过滤掉含有“Serbest”的项
-        data['data'] = [item for item in data['data'] if 'Para' not in item['FONTURACIKLAMA']]
-        # 更新 recordsTotal 和 recordsFiltered
-        data['recordsTotal'] = len(data['data'])
-        data['recordsFiltered'] = len(data['data'])
-
-        # 使用列表解析来过滤掉含有“Serbest”的项
-        data['data'] = [item for item in data['data'] if 'Katılım' not in item['FONTURACIKLAMA']]
-        # 更新 recordsTotal 和 recordsFiltered
-        data['recordsTotal'] = len(data['data'])
-        data['recordsFiltered'] = len(data['data'])
-
-        # 使用列表解析来过滤掉含有“Serbest”的项
-        data['data'] = [item for item in data['data'] if 'Borçlanma' not in item['FONTURACIKLAMA']]
-        # 更新 recordsTotal 和 recordsFiltered
-        data['recordsTotal'] = len(data['data'])
-        data['recordsFiltered'] = len(data['data'])
-
-        # 使用列表解析来过滤掉含有“Serbest”的项
-        data['data'] = [item for item in data['data'] if 'Kira' not in item['FONTURACIKLAMA']]
-        # 更新 recordsTotal 和 recordsFiltered
-        data['recordsTotal'] = len(data['data'])
-        data['recordsFiltered'] = len(data['data'])
+        # 解析时一次性过滤 FONTURACIKLAMA (默认排除 Serbest, Para, Katılım, Borçlanma, Kira)
+        snapshot = await fetch_snapshot("BindComparisonFundSizes", payload.dict(), fund_filter("DegeriArtan_V2", haric, dahil))
+        data = snapshot.data
 
         # 计算并添加新字段
         total_delta = 0
@@ -491,26 +816,27 @@ async def bind_comparison_fund_sizes(
         # Count the occurrences of each value
         fonturaciklama_counts = Counter(fonturaciklama_list)
 
-        # Get the most common value
-        most_common_fonturaciklama = fonturaciklama_counts.most_common(1)[0]
-
-        print(f"En Fazla Para Girisi olan: {most_common_fonturaciklama[0]}, Count: {most_common_fonturaciklama[1]}")
+        # Get the most common value (haric/dahil 过滤后可能没有任何基金)
+        for most_common_fonturaciklama in fonturaciklama_counts.most_common(1):
+            logger.info("En Fazla Para Girisi olan: %s, Count: %d", most_common_fonturaciklama[0], most_common_fonturaciklama[1])
 
 
 
         return data_frist_20
-    except requests.exceptions.HTTPError as http_err:
+    except httpx.HTTPStatusError as http_err:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"HTTP error occurred: {http_err}")
-    except requests.exceptions.ConnectionError as conn_err:
+    except httpx.ConnectError as conn_err:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Connection error occurred: {conn_err}")
-    except requests.exceptions.Timeout as timeout_err:
+    except httpx.TimeoutException as timeout_err:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Timeout error occurred: {timeout_err}")
-    except requests.exceptions.RequestException as req_err:
+    except httpx.HTTPError as req_err:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"An error occurred: {req_err}")
 
 
 @router.get("/tefas/DegeriArtan_V2_hafta", tags=["Tefas"])
 async def bind_comparison_fund_sizes(
+    haric: str = Query(None, description="Excluded fund types (words in FONTURACIKLAMA), comma separated"),
+    dahil: str = Query(None, description="Included fund types (words in FONTURACIKLAMA), comma separated")
 ):
     bastarih = (datetime.now() - timedelta(days=7)).strftime('%d.%m.%Y')
     bittarih = datetime.now().strftime('%d.%m.%Y')
@@ -520,42 +846,10 @@ async def bind_comparison_fund_sizes(
         bittarih=bittarih
     )
 
-    url = 'https://www.tefas.gov.tr/api/DB/BindComparisonFundSizes'
-
     try:
-        response = requests.post(url, data=payload.dict())
-        response.raise_for_status()
-        data = response.json()
-
-        # 使用列表解析来过滤掉含有“Serbest”的项
-        data['data'] = [item for item in data['data'] if 'Serbest' not in item['FONTURACIKLAMA']]
-        # 更新 recordsTotal 和 recordsFiltered
-        data['recordsTotal'] = len(data['data'])
-        data['recordsFiltered'] = len(data['data'])
-
-        # 使用列表解析来过滤掉含有“Serbest”的项
-        data['data'] = [item for item in data['data'] if 'Para' not in item['FONTURACIKLAMA']]
-        # 更新 recordsTotal 和 recordsFiltered
-        data['recordsTotal'] = len(data['data'])
-        data['recordsFiltered'] = len(data['data'])
-
-        # 使用列表解析来过滤掉含有“Serbest”的项
-        data['data'] = [item for item in data['data'] if 'Katılım' not in item['FONTURACIKLAMA']]
-        # 更新 recordsTotal 和 recordsFiltered
-        data['recordsTotal'] = len(data['data'])
-        data['recordsFiltered'] = len(data['data'])
-
-        # 使用列表解析来过滤掉含有“Serbest”的项
-        data['data'] = [item for item in data['data'] if 'Borçlanma' not in item['FONTURACIKLAMA']]
-        # 更新 recordsTotal 和 recordsFiltered
-        data['recordsTotal'] = len(data['data'])
-        data['recordsFiltered'] = len(data['data'])
-
-        # 使用列表解析来过滤掉含有“Serbest”的项
-        data['data'] = [item for item in data['data'] if 'Kira' not in item['FONTURACIKLAMA']]
-        # 更新 recordsTotal 和 recordsFiltered
-        data['recordsTotal'] = len(data['data'])
-        data['recordsFiltered'] = len(data['data'])
+        # 解析时一次性过滤 FONTURACIKLAMA (默认排除 Serbest, Para, Katılım, Borçlanma, Kira)
+        snapshot = await fetch_snapshot("BindComparisonFundSizes", payload.dict(), fund_filter("DegeriArtan_V2_hafta", haric, dahil))
+        data = snapshot.data
 
         # 计算并添加新字段
         total_delta = 0
@@ -588,21 +882,20 @@ async def bind_comparison_fund_sizes(
         # Count the occurrences of each value
         fonturaciklama_counts = Counter(fonturaciklama_list)
 
-        # Get the most common value
-        most_common_fonturaciklama = fonturaciklama_counts.most_common(1)[0]
-
-        print(f"En Fazla Para Girisi olan: {most_common_fonturaciklama[0]}, Count: {most_common_fonturaciklama[1]}")
+        # Get the most common value (haric/dahil 过滤后可能没有任何基金)
+        for most_common_fonturaciklama in fonturaciklama_counts.most_common(1):
+            logger.info("En Fazla Para Girisi olan: %s, Count: %d", most_common_fonturaciklama[0], most_common_fonturaciklama[1])
 
 
 
         return data_frist_20
-    except requests.exceptions.HTTPError as http_err:
+    except httpx.HTTPStatusError as http_err:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"HTTP error occurred: {http_err}")
-    except requests.exceptions.ConnectionError as conn_err:
+    except httpx.ConnectError as conn_err:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Connection error occurred: {conn_err}")
-    except requests.exceptions.Timeout as timeout_err:
+    except httpx.TimeoutException as timeout_err:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Timeout error occurred: {timeout_err}")
-    except requests.exceptions.RequestException as req_err:
+    except httpx.HTTPError as req_err:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"An error occurred: {req_err}")
 
     
@@ -610,7 +903,9 @@ async def bind_comparison_fund_sizes(
 @router.get("/tefas/DegeriDusen_V2", tags=["Tefas"])
 async def bind_comparison_fund_sizes(
     bastarih: str = Query(None, description="Start date in format DD.MM.YYYY"),
-    bittarih: str = Query(None, description="End date in format DD.MM.YYYY")
+    bittarih: str = Query(None, description="End date in format DD.MM.YYYY"),
+    haric: str = Query(None, description="Excluded fund types (words in FONTURACIKLAMA), comma separated"),
+    dahil: str = Query(None, description="Included fund types (words in FONTURACIKLAMA), comma separated")
 ):
     # Default dates: past month
     if not bastarih:
@@ -623,42 +918,10 @@ async def bind_comparison_fund_sizes(
         bittarih=bittarih
     )
 
-    url = 'https://www.tefas.gov.tr/api/DB/BindComparisonFundSizes'
-
     try:
-        response = requests.post(url, data=payload.dict())
-        response.raise_for_status()
-        data = response.json()
-
-        # 使用列表解析来过滤掉含有“Serbest”的项
-        data['data'] = [item for item in data['data'] if 'Serbest' not in item['FONTURACIKLAMA']]
-        # 更新 recordsTotal 和 recordsFiltered
-        data['recordsTotal'] = len(data['data'])
-        data['recordsFiltered'] = len(data['data'])
-
-        # 使用列表解析来过滤掉含有“Serbest”的项
-        data['data'] = [item for item in data['data'] if 'Para' not in item['FONTURACIKLAMA']]
-        # 更新 recordsTotal 和 recordsFiltered
-        data['recordsTotal'] = len(data['data'])
-        data['recordsFiltered'] = len(data['data'])
-
-        # 使用列表解析来过滤掉含有“Serbest”的项
-        data['data'] = [item for item in data['data'] if 'Katılım' not in item['FONTURACIKLAMA']]
-        # 更新 recordsTotal 和 recordsFiltered
-        data['recordsTotal'] = len(data['data'])
-        data['recordsFiltered'] = len(data['data'])
-
-        # 使用列表解析来过滤掉含有“Serbest”的项
-        data['data'] = [item for item in data['data'] if 'Borçlanma' not in item['FONTURACIKLAMA']]
-        # 更新 recordsTotal 和 recordsFiltered
-        data['recordsTotal'] = len(data['data'])
-        data['recordsFiltered'] = len(data['data'])
-
-        # 使用列表解析来过滤掉含有“Serbest”的项
-        data['data'] = [item for item in data['data'] if 'Kira' not in item['FONTURACIKLAMA']]
-        # 更新 recordsTotal 和 recordsFiltered
-        data['recordsTotal'] = len(data['data'])
-        data['recordsFiltered'] = len(data['data'])
+        # 解析时一次性过滤 FONTURACIKLAMA (默认排除 Serbest, Para, Katılım, Borçlanma, Kira)
+        snapshot = await fetch_snapshot("BindComparisonFundSizes", payload.dict(), fund_filter("DegeriDusen_V2", haric, dahil))
+        data = snapshot.data
 
         # 计算并添加新字段
         total_delta = 0
@@ -691,26 +954,27 @@ async def bind_comparison_fund_sizes(
         # Count the occurrences of each value
         fonturaciklama_counts = Counter(fonturaciklama_list)
 
-        # Get the most common value
-        most_common_fonturaciklama = fonturaciklama_counts.most_common(1)[0]
-
-        print(f"En Fazla Para Cikisi olan: {most_common_fonturaciklama[0]}, Count: {most_common_fonturaciklama[1]}")
+        # Get the most common value (haric/dahil 过滤后可能没有任何基金)
+        for most_common_fonturaciklama in fonturaciklama_counts.most_common(1):
+            logger.info("En Fazla Para Cikisi olan: %s, Count: %d", most_common_fonturaciklama[0], most_common_fonturaciklama[1])
 
 
 
         return data_frist_20
-    except requests.exceptions.HTTPError as http_err:
+    except httpx.HTTPStatusError as http_err:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"HTTP error occurred: {http_err}")
-    except requests.exceptions.ConnectionError as conn_err:
+    except httpx.ConnectError as conn_err:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Connection error occurred: {conn_err}")
-    except requests.exceptions.Timeout as timeout_err:
+    except httpx.TimeoutException as timeout_err:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Timeout error occurred: {timeout_err}")
-    except requests.exceptions.RequestException as req_err:
+    except httpx.HTTPError as req_err:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"An error occurred: {req_err}")
     
 
 @router.get("/tefas/DegeriDusen_V2_hafta", tags=["Tefas"])
 async def bind_comparison_fund_sizes(
+    haric: str = Query(None, description="Excluded fund types (words in FONTURACIKLAMA), comma separated"),
+    dahil: str = Query(None, description="Included fund types (words in FONTURACIKLAMA), comma separated")
 ):
     bastarih = (datetime.now() - timedelta(days=7)).strftime('%d.%m.%Y')
     bittarih = datetime.now().strftime('%d.%m.%Y')
@@ -720,42 +984,10 @@ async def bind_comparison_fund_sizes(
         bittarih=bittarih
     )
 
-    url = 'https://www.tefas.gov.tr/api/DB/BindComparisonFundSizes'
-
     try:
-        response = requests.post(url, data=payload.dict())
-        response.raise_for_status()
-        data = response.json()
-
-        # 使用列表解析来过滤掉含有“Serbest”的项
-        data['data'] = [item for item in data['data'] if 'Serbest' not in item['FONTURACIKLAMA']]
-        # 更新 recordsTotal 和 recordsFiltered
-        data['recordsTotal'] = len(data['data'])
-        data['recordsFiltered'] = len(data['data'])
-
-        # 使用列表解析来过滤掉含有“Serbest”的项
-        data['data'] = [item for item in data['data'] if 'Para' not in item['FONTURACIKLAMA']]
-        # 更新 recordsTotal 和 recordsFiltered
-        data['recordsTotal'] = len(data['data'])
-        data['recordsFiltered'] = len(data['data'])
-
-        # 使用列表解析来过滤掉含有“Serbest”的项
-        data['data'] = [item for item in data['data'] if 'Katılım' not in item['FONTURACIKLAMA']]
-        # 更新 recordsTotal 和 recordsFiltered
-        data['recordsTotal'] = len(data['data'])
-        data['recordsFiltered'] = len(data['data'])
-
-        # 使用列表解析来过滤掉含有“Serbest”的项
-        data['data'] = [item for item in data['data'] if 'Borçlanma' not in item['FONTURACIKLAMA']]
-        # 更新 recordsTotal 和 recordsFiltered
-        data['recordsTotal'] = len(data['data'])
-        data['recordsFiltered'] = len(data['data'])
-
-        # 使用列表解析来过滤掉含有“Serbest”的项
-        data['data'] = [item for item in data['data'] if 'Kira' not in item['FONTURACIKLAMA']]
-        # 更新 recordsTotal 和 recordsFiltered
-        data['recordsTotal'] = len(data['data'])
-        data['recordsFiltered'] = len(data['data'])
+        # 解析时一次性过滤 FONTURACIKLAMA (默认排除 Serbest, Para, Katılım, Borçlanma, Kira)
+        snapshot = await fetch_snapshot("BindComparisonFundSizes", payload.dict(), fund_filter("DegeriDusen_V2_hafta", haric, dahil))
+        data = snapshot.data
 
         # 计算并添加新字段
         total_delta = 0
@@ -788,21 +1020,20 @@ async def bind_comparison_fund_sizes(
         # Count the occurrences of each value
         fonturaciklama_counts = Counter(fonturaciklama_list)
 
-        # Get the most common value
-        most_common_fonturaciklama = fonturaciklama_counts.most_common(1)[0]
-
-        print(f"En Fazla Para Cikisi olan: {most_common_fonturaciklama[0]}, Count: {most_common_fonturaciklama[1]}")
+        # Get the most common value (haric/dahil 过滤后可能没有任何基金)
+        for most_common_fonturaciklama in fonturaciklama_counts.most_common(1):
+            logger.info("En Fazla Para Cikisi olan: %s, Count: %d", most_common_fonturaciklama[0], most_common_fonturaciklama[1])
 
 
 
         return data_frist_20
-    except requests.exceptions.HTTPError as http_err:
+    except httpx.HTTPStatusError as http_err:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"HTTP error occurred: {http_err}")
-    except requests.exceptions.ConnectionError as conn_err:
+    except httpx.ConnectError as conn_err:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Connection error occurred: {conn_err}")
-    except requests.exceptions.Timeout as timeout_err:
+    except httpx.TimeoutException as timeout_err:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Timeout error occurred: {timeout_err}")
-    except requests.exceptions.RequestException as req_err:
+    except httpx.HTTPError as req_err:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"An error occurred: {req_err}")
     
 
@@ -810,7 +1041,9 @@ async def bind_comparison_fund_sizes(
 @router.get("/tefas/NetLotArtan", tags=["Adet"])
 async def bind_comparison_fund_sizes(
     bastarih: str = Query(None, description="Start date in format DD.MM.YYYY"),
-    bittarih: str = Query(None, description="End date in format DD.MM.YYYY")
+    bittarih: str = Query(None, description="End date in format DD.MM.YYYY"),
+    haric: str = Query(None, description="Excluded fund types (words in FONTURACIKLAMA), comma separated"),
+    dahil: str = Query(None, description="Included fund types (words in FONTURACIKLAMA), comma separated")
 ):
     # Default dates: past month
     if not bastarih:
@@ -823,42 +1056,10 @@ async def bind_comparison_fund_sizes(
         bittarih=bittarih
     )
 
-    url = 'https://www.tefas.gov.tr/api/DB/BindComparisonFundSizes'
-
     try:
-        response = requests.post(url, data=payload.dict())
-        response.raise_for_status()
-        data = response.json()
-
-        # 使用列表解析来过滤掉含有“Serbest”的项
-        data['data'] = [item for item in data['data'] if 'Serbest' not in item['FONTURACIKLAMA']]
-        # 更新 recordsTotal 和 recordsFiltered
-        data['recordsTotal'] = len(data['data'])
-        data['recordsFiltered'] = len(data['data'])
-
-        # 使用列表解析来过滤掉含有“Serbest”的项
-        data['data'] = [item for item in data['data'] if 'Para' not in item['FONTURACIKLAMA']]
-        # 更新 recordsTotal 和 recordsFiltered
-        data['recordsTotal'] = len(data['data'])
-        data['recordsFiltered'] = len(data['data'])
-
-        # 使用列表解析来过滤掉含有“Serbest”的项
-        data['data'] = [item for item in data['data'] if 'Katılım' not in item['FONTURACIKLAMA']]
-        # 更新 recordsTotal 和 recordsFiltered
-        data['recordsTotal'] = len(data['data'])
-        data['recordsFiltered'] = len(data['data'])
-
-        # 使用列表解析来过滤掉含有“Serbest”的项
-        data['data'] = [item for item in data['data'] if 'Borçlanma' not in item['FONTURACIKLAMA']]
-        # 更新 recordsTotal 和 recordsFiltered
-        data['recordsTotal'] = len(data['data'])
-        data['recordsFiltered'] = len(data['data'])
-
-        # 使用列表解析来过滤掉含有“Serbest”的项
-        data['data'] = [item for item in data['data'] if 'Kira' not in item['FONTURACIKLAMA']]
-        # 更新 recordsTotal 和 recordsFiltered
-        data['recordsTotal'] = len(data['data'])
-        data['recordsFiltered'] = len(data['data'])
+        # 解析时一次性过滤 FONTURACIKLAMA (默认排除 Serbest, Para, Katılım, Borçlanma, Kira)
+        snapshot = await fetch_snapshot("BindComparisonFundSizes", payload.dict(), fund_filter("NetLotArtan", haric, dahil))
+        data = snapshot.data
 
         # 计算并添加新字段
         for item in data['data']:
@@ -932,34 +1133,29 @@ async def bind_comparison_fund_sizes(
         # Count the occurrences of each value
         fonturaciklama_counts = Counter(fonturaciklama_list)
 
-        # Get the most common value
-        most_common_fonturaciklama_x = fonturaciklama_counts.most_common(3)[0]
-        most_common_fonturaciklama_y = fonturaciklama_counts.most_common(3)[1]
-        most_common_fonturaciklama_z = fonturaciklama_counts.most_common(3)[2]
-        dic = {
-            most_common_fonturaciklama_x[0]: most_common_fonturaciklama_x[1],
-            most_common_fonturaciklama_y[0]: most_common_fonturaciklama_y[1],
-            most_common_fonturaciklama_z[0]: most_common_fonturaciklama_z[1]
-            }
+        # Get the most common values (haric/dahil 过滤后可能少于 3 种, 甚至为空)
+        dic = dict(fonturaciklama_counts.most_common(3))
 
 
 
 
 
         return dic,new_data
-    except requests.exceptions.HTTPError as http_err:
+    except httpx.HTTPStatusError as http_err:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"HTTP error occurred: {http_err}")
-    except requests.exceptions.ConnectionError as conn_err:
+    except httpx.ConnectError as conn_err:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Connection error occurred: {conn_err}")
-    except requests.exceptions.Timeout as timeout_err:
+    except httpx.TimeoutException as timeout_err:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Timeout error occurred: {timeout_err}")
-    except requests.exceptions.RequestException as req_err:
+    except httpx.HTTPError as req_err:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"An error occurred: {req_err}")
 
 
 # net lot artan hafta
 @router.get("/tefas/NetLotArtan_hafta", tags=["Adet"])
 async def bind_comparison_fund_sizes(
+    haric: str = Query(None, description="Excluded fund types (words in FONTURACIKLAMA), comma separated"),
+    dahil: str = Query(None, description="Included fund types (words in FONTURACIKLAMA), comma separated")
 ):
     bastarih = (datetime.now() - timedelta(days=7)).strftime('%d.%m.%Y')
     bittarih = datetime.now().strftime('%d.%m.%Y')
@@ -969,42 +1165,10 @@ async def bind_comparison_fund_sizes(
         bittarih=bittarih
     )
 
-    url = 'https://www.tefas.gov.tr/api/DB/BindComparisonFundSizes'
-
     try:
-        response = requests.post(url, data=payload.dict())
-        response.raise_for_status()
-        data = response.json()
-
-        # 使用列表解析来过滤掉含有“Serbest”的项
-        data['data'] = [item for item in data['data'] if 'Serbest' not in item['FONTURACIKLAMA']]
-        # 更新 recordsTotal 和 recordsFiltered
-        data['recordsTotal'] = len(data['data'])
-        data['recordsFiltered'] = len(data['data'])
-
-        # 使用列表解析来过滤掉含有“Serbest”的项
-        data['data'] = [item for item in data['data'] if 'Para' not in item['FONTURACIKLAMA']]
-        # 更新 recordsTotal 和 recordsFiltered
-        data['recordsTotal'] = len(data['data'])
-        data['recordsFiltered'] = len(data['data'])
-
-        # 使用列表解析来过滤掉含有“Serbest”的项
-        data['data'] = [item for item in data['data'] if 'Katılım' not in item['FONTURACIKLAMA']]
-        # 更新 recordsTotal 和 recordsFiltered
-        data['recordsTotal'] = len(data['data'])
-        data['recordsFiltered'] = len(data['data'])
-
-        # 使用列表解析来过滤掉含有“Serbest”的项
-        data['data'] = [item for item in data['data'] if 'Borçlanma' not in item['FONTURACIKLAMA']]
-        # 更新 recordsTotal 和 recordsFiltered
-        data['recordsTotal'] = len(data['data'])
-        data['recordsFiltered'] = len(data['data'])
-
-        # 使用列表解析来过滤掉含有“Serbest”的项
-        data['data'] = [item for item in data['data'] if 'Kira' not in item['FONTURACIKLAMA']]
-        # 更新 recordsTotal 和 recordsFiltered
-        data['recordsTotal'] = len(data['data'])
-        data['recordsFiltered'] = len(data['data'])
+        # 解析时一次性过滤 FONTURACIKLAMA (默认排除 Serbest, Para, Katılım, Borçlanma, Kira)
+        snapshot = await fetch_snapshot("BindComparisonFundSizes", payload.dict(), fund_filter("NetLotArtan_hafta", haric, dahil))
+        data = snapshot.data
 
         # 计算并添加新字段
         for item in data['data']:
@@ -1078,28 +1242,21 @@ async def bind_comparison_fund_sizes(
         # Count the occurrences of each value
         fonturaciklama_counts = Counter(fonturaciklama_list)
 
-        # Get the most common value
-        most_common_fonturaciklama_x = fonturaciklama_counts.most_common(3)[0]
-        most_common_fonturaciklama_y = fonturaciklama_counts.most_common(3)[1]
-        most_common_fonturaciklama_z = fonturaciklama_counts.most_common(3)[2]
-        dic = {
-            most_common_fonturaciklama_x[0]: most_common_fonturaciklama_x[1],
-            most_common_fonturaciklama_y[0]: most_common_fonturaciklama_y[1],
-            most_common_fonturaciklama_z[0]: most_common_fonturaciklama_z[1]
-            }
+        # Get the most common values (haric/dahil 过滤后可能少于 3 种, 甚至为空)
+        dic = dict(fonturaciklama_counts.most_common(3))
 
 
 
 
 
         return dic,new_data
-    except requests.exceptions.HTTPError as http_err:
+    except httpx.HTTPStatusError as http_err:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"HTTP error occurred: {http_err}")
-    except requests.exceptions.ConnectionError as conn_err:
+    except httpx.ConnectError as conn_err:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Connection error occurred: {conn_err}")
-    except requests.exceptions.Timeout as timeout_err:
+    except httpx.TimeoutException as timeout_err:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Timeout error occurred: {timeout_err}")
-    except requests.exceptions.RequestException as req_err:
+    except httpx.HTTPError as req_err:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"An error occurred: {req_err}")
     
 # net lot dusen
@@ -1112,7 +1269,7 @@ async def find_returns(
     fonkod: str = Path(..., description="Fund code"),
     hafta_sayisi: int = Query(None, description="Kac hafta olsun?"),
 ):
-    print("Running find_returns")
+    logger.info("Haftada_KODa_500_yatirsam", extra={"fonkod": fonkod, "hafta_sayisi": hafta_sayisi})
 
     today = datetime.today()
     start_of_week = today - timedelta(days=today.weekday())
@@ -1121,7 +1278,6 @@ async def find_returns(
     rate_list = []
 
     for i in range(hafta_sayisi):
-        print(f"Getting data for week {i+1}")
         # For each week, get Monday and Sunday
         monday = start_of_week - timedelta(weeks=i)
         sunday = end_of_week - timedelta(weeks=i)
@@ -1129,40 +1285,29 @@ async def find_returns(
         # Format the dates as DD.MM.YYYY
         monday_formatted = monday.strftime('%d.%m.%Y')
         sunday_formatted = sunday.strftime('%d.%m.%Y')
-        print(f"{monday_formatted} : {sunday_formatted}")
+        logger.debug("Getting data for week %d: %s - %s", i + 1, monday_formatted, sunday_formatted)
 
         payload = ComparisonFundReturnsRequest(
             bastarih=monday_formatted,
             bittarih=sunday_formatted
         )
 
-        url = 'https://www.tefas.gov.tr/api/DB/BindComparisonFundReturns'
-
-
         try:
-            response = requests.post(url, data=payload.dict())
-            response.raise_for_status()
-            data = response.json()
-
-            # 使用列表解析来过滤掉含有“Serbest”的项
-            data['data'] = [item for item in data['data'] if 'Serbest' not in item['FONTURACIKLAMA']]
-            # 更新 recordsTotal 和 recordsFiltered
-            data['recordsTotal'] = len(data['data'])
-            data['recordsFiltered'] = len(data['data'])
+            snapshot = await fetch_snapshot("BindComparisonFundReturns", payload.dict())
 
-            for item in data["data"]:
-                if item["FONKODU"] == fonkod:
-                    rate_list.append(item["GETIRIORANI"])
-                    break
+            # 按基金代码直接查找, 过滤掉含有“Serbest”的项
+            item = snapshot.funds.get(fonkod)
+            if item is not None and 'Serbest' not in item['FONTURACIKLAMA']:
+                rate_list.append(item["GETIRIORANI"])
 
 
-        except requests.exceptions.HTTPError as http_err:
+        except httpx.HTTPStatusError as http_err:
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"HTTP error occurred: {http_err}")
-        except requests.exceptions.ConnectionError as conn_err:
+        except httpx.ConnectError as conn_err:
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Connection error occurred: {conn_err}")
-        except requests.exceptions.Timeout as timeout_err:
+        except httpx.TimeoutException as timeout_err:
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Timeout error occurred: {timeout_err}")
-        except requests.exceptions.RequestException as req_err:
+        except httpx.HTTPError as req_err:
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"An error occurred: {req_err}")
 
     # 倒序列表
@@ -1177,14 +1322,14 @@ async def find_returns(
     fonkod: str = Path(..., description="Fund code"),
     ay_sayisi: int = Query(None, description="Kac ay olsun?"),
 ):
-    print("Running find_returns")
+    logger.info("Ayda_KODa_500_yatirsam", extra={"fonkod": fonkod, "ay_sayisi": ay_sayisi})
 
     today = datetime.today()
 
     rate_list = []
 
     for i in range(ay_sayisi):
-        print(f"Getting data for month {i+1}")
+        logger.debug("Getting data for month %d", i + 1)
         month_offset = today.month - (i + 1)
         year = today.year + (month_offset // 12)
         month = month_offset % 12
@@ -1205,31 +1350,21 @@ async def find_returns(
             bittarih= last_day_str
         )
 
-        url = 'https://www.tefas.gov.tr/api/DB/BindComparisonFundReturns'
-
         try:
-            response = requests.post(url, data=payload.dict())
-            response.raise_for_status()
-            data = response.json()
-
-            # 使用列表解析来过滤掉含有“Serbest”的项
-            data['data'] = [item for item in data['data'] if 'Serbest' not in item['FONTURACIKLAMA']]
-            # 更新 recordsTotal 和 recordsFiltered
-            data['recordsTotal'] = len(data['data'])
-            data['recordsFiltered'] = len(data['data'])
-
-            for item in data["data"]:
-                if item["FONKODU"] == fonkod:
-                    rate_list.append(item["GETIRIORANI"])
-                    break
-
-        except requests.exceptions.HTTPError as http_err:
+            snapshot = await fetch_snapshot("BindComparisonFundReturns", payload.dict())
+
+            # 按基金代码直接查找, 过滤掉含有“Serbest”的项
+            item = snapshot.funds.get(fonkod)
+            if item is not None and 'Serbest' not in item['FONTURACIKLAMA']:
+                rate_list.append(item["GETIRIORANI"])
+
+        except httpx.HTTPStatusError as http_err:
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"HTTP error occurred: {http_err}")
-        except requests.exceptions.ConnectionError as conn_err:
+        except httpx.ConnectError as conn_err:
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Connection error occurred: {conn_err}")
-        except requests.exceptions.Timeout as timeout_err:
+        except httpx.TimeoutException as timeout_err:
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Timeout error occurred: {timeout_err}")
-        except requests.exceptions.RequestException as req_err:
+        except httpx.HTTPError as req_err:
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"An error occurred: {req_err}")
 
         
@@ -1244,7 +1379,7 @@ async def find_returns(
 async def find_returns(
     ay_sayisi: int = Query(None, description="Kac ay olsun? (1-59)"),
 ):
-    print("Running find_returns")
+    logger.info("tum_hisse_senedi_fonlari_getirisi_v2", extra={"ay_sayisi": ay_sayisi})
 
     today = datetime.today()
 
@@ -1256,12 +1391,7 @@ async def find_returns(
         bittarih=datetime.now().strftime('%d.%m.%Y')
     )
 
-    url = 'https://www.tefas.gov.tr/api/DB/BindComparisonFundReturns'
-
-    
-    response = requests.post(url, data=payload.dict())
-    response.raise_for_status()
-    data = response.json()
+    data = await upstream.tefas("BindComparisonFundReturns", payload.dict())
 
     # 使用列表解析来过滤掉含有“Serbest”的项
     data['data'] = [item for item in data['data'] if 'Serbest' not in item['FONTURACIKLAMA']]
@@ -1292,7 +1422,7 @@ async def find_returns(
     dic_A = {}
     for i in range(ay_sayisi):
 
-        print(f"Getting data for month {i+1}")
+        logger.debug("Getting data for month %d", i + 1)
         month_offset = today.month - (i + 1)
         year = today.year + (month_offset // 12)
         month = month_offset % 12
@@ -1313,216 +1443,110 @@ async def find_returns(
             bittarih= last_day_str
         )
 
-        url = 'https://www.tefas.gov.tr/api/DB/BindComparisonFundReturns'
-
         try:
-            response = requests.post(url, data=payload.dict())
-            response.raise_for_status()
-            data = response.json()
-
-            dic_A[i+1] = data
+            dic_A[i+1] = await fetch_snapshot("BindComparisonFundReturns", payload.dict())
+            await jobs.progress("months", i + 1, ay_sayisi)
 
 
-        except requests.exceptions.HTTPError as http_err:
+        except httpx.HTTPStatusError as http_err:
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"HTTP error occurred: {http_err}")
-        except requests.exceptions.ConnectionError as conn_err:
+        except httpx.ConnectError as conn_err:
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Connection error occurred: {conn_err}")
-        except requests.exceptions.Timeout as timeout_err:
+        except httpx.TimeoutException as timeout_err:
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Timeout error occurred: {timeout_err}")
-        except requests.exceptions.RequestException as req_err:
+        except httpx.HTTPError as req_err:
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"An error occurred: {req_err}")
 
         
 
-    # fon_list = ["YAS","MAC","IIH"]
-
-    data_B = {}
-    for fon in fon_list:
-        print("fon: ", fon)
-
-        list_b = []
-
-        for key, value in dic_A.items():
-            for item in value['data']:
-                if item['FONKODU'] == fon:
-                    list_b.append(item['GETIRIORANI'])
-
-        data_B[fon] = list_b
-
-
-    data_C = {}
-    for fonkod, list_c in data_B.items():
-        list_d = []
-        list_c.reverse()
-        list_c = list(filter(None, list_c))
+    # 月份按从旧到新排列, 构建 基金 × 月份 收益率矩阵
+    months = [dic_A[key] for key in sorted(dic_A, reverse=True)]
+    period_profits = return_matrix(fon_list, months)
 
-        period_profits = list_c
-        # 每周投资金额
-        investment_per_peroid = 100
-
-        # 初始投资账户价值
-        investment_value = 0
-
-        # 总投资金额
-        total_investment = 0
-
-        # 遍历每周的利润率并更新投资账户价值
-        for profit in period_profits:
-            # 将当前投资金额加入账户
-            investment_value += investment_per_peroid
-            # 更新总投资金额
-            total_investment += investment_per_peroid
-            # 根据当前周的利润率更新账户价值
-            investment_value += investment_value * (profit / 100)
-            print(f"当前账户价值: {total_investment} - {investment_value:.2f} 元")
-
-        # 计算最终利润
-        final_profit = investment_value - total_investment
-
-        print(f"总共投入: {total_investment:.2f} 元")
-        print(f"最终利润: {final_profit:.2f} 元")
-
-        # 避免除以零的错误
-        if total_investment != 0:
-            profit_rate = (final_profit / total_investment) * 100
-            print(f"利润率: {profit_rate:.2f}%")
-            print(f"period%: {profit_rate/len(period_profits):.2f}%")
-        else:
-            print("总投入为 0，无法计算利润率")
-
-        list_d.append(total_investment)
-        list_d.append(investment_value)
-        list_d.append(profit_rate)
-        try:
-            list_d.append(profit_rate/len(period_profits))
-        except ZeroDivisionError:
-            list_d.append(0)
-
-        data_C[fonkod] = list_d
+    # 每期定投 100, 一次计算所有基金的 [总投入, 账户价值, 利润率, 每期利润率]
+    data_C = dca_table(fon_list, period_profits)
 
     sorted_data = dict(sorted(data_C.items(), key=lambda item: item[1][3], reverse=True))
     return sorted_data
 
+jobs.register("tum_hisse_senedi_fonlari_getirisi_v2", find_returns)
+
 # fon adet degisimi
 @router.get("/tefas/FonAdetDegisimi/{fonkod}", tags=["Tefas"])
 async def fon_adet_degisimi(
     fonkod: str = Path(..., description="Fund code"),
     gun : int = Query(None, description="Day"),
 ):
-    print("Running fon_adet_degisimi")
+    logger.info("fon_adet_degisimi", extra={"fonkod": fonkod, "gun": gun})
     start_date = datetime.now()
-    end_date = start_date - timedelta(days=gun)
-
-    url = 'https://www.tefas.gov.tr/api/DB/BindHistoryInfo'
-
-    FIYAT_LIST = []
-    TEDPAYSAYISI_LIST = []
-    KISISAYISI_LIST = []
-    PORTFOYBUYUKLUK_LIST = []
+    # 最近 gun 天 (含今天)
+    end_date = start_date - timedelta(days=gun - 1)
 
-    current_date = start_date
-    while current_date > end_date:
-        # 输出日期格式为 DD.MM.YYYY
-        # print(current_date.strftime("%d.%m.%Y"))
-        tarih = current_date.strftime("%d.%m.%Y")
-
-        payload = BindHistoryInfo(
-            fonkod=fonkod,
-            bastarih=tarih,
-            bittarih=tarih
-        )
+    tarih = start_date.strftime("%d.%m.%Y")
 
-        try:
-            response = requests.post(url, data=payload.dict())
-            response.raise_for_status()
-            data = response.json()
-
-            # print(f"data: {data}")
-            if data["recordsTotal"] == 0:
-                pass
+    payload = BindHistoryInfo(
+        fonkod=fonkod,
+        bastarih=tarih,
+        bittarih=tarih
+    )
 
-            else:
-                FIYAT_LIST.append(data["data"][0]["FIYAT"])
-                TEDPAYSAYISI_LIST.append(data["data"][0]["TEDPAYSAYISI"])
-                KISISAYISI_LIST.append(data["data"][0]["KISISAYISI"])
-                PORTFOYBUYUKLUK_LIST.append(data["data"][0]["PORTFOYBUYUKLUK"])
-                
+    try:
+        # 已收盘的日期从本地 fund_history 读取 (只向 TEFAS 同步缺失的日期), 今天的数据实时获取
+        await fund_history.sync(fonkod, end_date)
+        rows = await fund_history.find(fonkod, end_date, start_date - timedelta(days=1))
 
+        data = await upstream.tefas("BindHistoryInfo", payload.dict())
+        if data["recordsTotal"] != 0:
+            rows.append(data["data"][0])
 
-        except requests.exceptions.HTTPError as http_err:
-            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"HTTP error occurred: {http_err}")
-        except requests.exceptions.ConnectionError as conn_err:
-            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Connection error occurred: {conn_err}")
-        except requests.exceptions.Timeout as timeout_err:
-            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Timeout error occurred: {timeout_err}")
-        except requests.exceptions.RequestException as req_err:
-            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"An error occurred: {req_err}")
+    except httpx.HTTPStatusError as http_err:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"HTTP error occurred: {http_err}")
+    except httpx.ConnectError as conn_err:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Connection error occurred: {conn_err}")
+    except httpx.TimeoutException as timeout_err:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Timeout error occurred: {timeout_err}")
+    except httpx.HTTPError as req_err:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"An error occurred: {req_err}")
 
-        current_date -= timedelta(days=1)
+    # 按日期从旧到新
+    FIYAT_LIST = [row["FIYAT"] for row in rows]
+    TEDPAYSAYISI_LIST = [row["TEDPAYSAYISI"] for row in rows]
+    KISISAYISI_LIST = [row["KISISAYISI"] for row in rows]
+    PORTFOYBUYUKLUK_LIST = [row["PORTFOYBUYUKLUK"] for row in rows]
 
-    
-    # 倒序列表
-    TEDPAYSAYISI_LIST.reverse()
-    KISISAYISI_LIST.reverse()
-    PORTFOYBUYUKLUK_LIST.reverse()
-    FIYAT_LIST.reverse()
-    
     return FIYAT_LIST, TEDPAYSAYISI_LIST, KISISAYISI_LIST, PORTFOYBUYUKLUK_LIST
 
 # get current USDTRY price use binance api
 
 # Binance API endpoint for ticker price
-BINANCE_API_URL = "https://api.binance.com/api/v3/ticker/price"
-
 @router.get("/usdttry/current", tags=["Binance"])
-def get_usd_try_price():
+async def get_usd_try_price():
     try:
-        response = requests.get(BINANCE_API_URL, params={"symbol": "USDTTRY"})
-        response.raise_for_status()  # Raise an HTTPError for bad responses
-        data = response.json()
+        data = await upstream.binance("ticker/price", {"symbol": "USDTTRY"})
         return data
         # return {"symbol": data["symbol"], "price": data["price"]}
-    except requests.RequestException as exc:
+    except httpx.HTTPError as exc:
         raise HTTPException(status_code=500, detail=str(exc))
 
 # Binance API endpoint for historical candlestick data
-HISTORICAL_API_URL = "https://api.binance.com/api/v3/klines"
-
 @router.get("/usdttry/historical", tags=["Binance"])
-def get_historical_price(date: str):
+async def get_historical_price(date: str):
     # Validate and parse the date
     try:
         dt = datetime.strptime(date, "%d.%m.%Y")
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid date format. Use DD.MM.YYYY")
     
-    # Set up the start and end times for the requested date
-    start_time = int(dt.timestamp() * 1000)  # Convert to milliseconds
-    end_time = int((dt + timedelta(days=1)).timestamp() * 1000)  # End of the day
-
     try:
-        response = requests.get(HISTORICAL_API_URL, params={
-            "symbol": "USDTTRY",
-            "interval": "1d",
-            "startTime": start_time,
-            "endTime": end_time
-        })
-        response.raise_for_status()
-        data = response.json()
-        if not data:
+        # 已收盘的日K线从本地 (内存/Mongo) 读取, 缺失的按 1000 根批量从 Binance 补齐
+        price_data = await usdttry_klines.get(dt)
+        if not price_data:
             raise HTTPException(status_code=404, detail="No data found for the specified date.")
-        # Extract relevant parts from the candlestick data
-        price_data = {
-            "open_time": data[0][0],
-            "open": data[0][1],
-            "high": data[0][2],
-            "low": data[0][3],
-            "close": data[0][4],
-            "volume": data[0][5]
-        }
         return price_data
-    except requests.RequestException as exc:
+    except httpx.HTTPError as exc:
         raise HTTPException(status_code=500, detail=str(exc))
     
 
+router.include_router(jobs_router)
+
 app.include_router(router)
@@ -0,0 +1,325 @@
+"""Synthetic TEFAS and USDTTRY datasets in the upstream JSON shape.
+
+A ``Dataset`` is ``funds`` funds over the ``months`` months up to ``end``,
+entirely determined by ``seed``:
+
+- each fund has a FONTURACIKLAMA category (``mix`` gives the shares), a
+  founder, a price and a number of units
+- monthly log returns are a category factor plus a fund-specific part, with
+  the mean and volatility of the category; units follow their own random walk
+- ``none_rate`` of the rows of a fund list have ``GETIRIORANI`` None and
+  ``zero_units_rate`` have ``ILKPAYADEDI`` or ``SONPAYADEDI`` 0 (launched or
+  closed in the range)
+- USDTTRY is a daily random walk with the lira's drift
+
+Random numbers are drawn per calendar month, so a month looks the same for
+any ``months``, and the first funds are the same for any ``funds``.
+``benchmarks.standin --funds`` answers from a dataset; this module writes
+one to disk as fixtures:
+
+    python -m benchmarks.fixtures --funds 2000 --months 24 --out fixtures
+"""
+import argparse
+import calendar
+import hashlib
+import string
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+import orjson
+
+DAY_MS = 24 * 60 * 60 * 1000
+# TARIH of BindHistoryInfo rows is midnight Istanbul time (UTC+3)
+TEFAS_UTC_OFFSET_MS = 3 * 60 * 60 * 1000
+
+# FONTURACIKLAMA: share of the funds, FONTURKOD, monthly mean and volatility of the log return (%)
+CATEGORIES = {
+    "Serbest Fon": (0.30, 1, 3.0, 4.0),
+    "Hisse Senedi Fonu": (0.14, 2, 3.2, 8.0),
+    "Değişken Fon": (0.09, 3, 2.8, 5.0),
+    "Fon Sepeti Fonu": (0.09, 4, 2.7, 4.0),
+    "Borçlanma Araçları Fonu": (0.08, 5, 2.9, 1.5),
+    "Para Piyasası Fonu": (0.06, 6, 3.3, 0.3),
+    "Katılım Fonu": (0.07, 7, 2.6, 3.0),
+    "Karma Fon": (0.03, 8, 2.6, 4.5),
+    "Kıymetli Madenler Fonu": (0.05, 9, 3.0, 6.0),
+    "Kira Sertifikası Fonu": (0.02, 10, 3.1, 1.0),
+    "Hisse Senedi Yoğun Fon": (0.07, 11, 3.1, 7.5),
+}
+# for categories given in a mix but not above
+DEFAULT_CATEGORY = (0.0, 99, 2.8, 4.0)
+FOUNDERS = 60
+# USDTTRY: daily drift and volatility of the log price, close on the last day
+USDTTRY_DRIFT = 0.0008
+USDTTRY_VOLATILITY = 0.006
+USDTTRY_CLOSE = 34.0
+
+
+def month_index(dt: datetime) -> int:
+    return dt.year * 12 + dt.month - 1
+
+
+def tefas_date(value: str) -> datetime:
+    return datetime.strptime(value, "%d.%m.%Y")
+
+
+def parse_mix(value: str) -> dict[str, float]:
+    """``"Hisse Senedi Fonu=0.3,Serbest Fon=0.2"`` -> shares."""
+    mix = {}
+    for part in value.split(","):
+        if part.strip():
+            name, _, share = part.partition("=")
+            mix[name.strip()] = float(share)
+    return mix
+
+
+def fund_code(i: int) -> str:
+    # three characters starting with a letter, like TEFAS codes (26 * 36 * 36 codes)
+    alphabet = string.ascii_uppercase + string.digits
+    return string.ascii_uppercase[i // 1296 % 26] + alphabet[i // 36 % 36] + alphabet[i % 36]
+
+
+class Dataset:
+    def __init__(self, funds: int = 2000, months: int = 12, mix: dict[str, float] | None = None, none_rate: float = 0.02, zero_units_rate: float = 0.01, seed: int = 0, end: datetime | None = None):
+        self.funds = funds
+        self.months = months
+        self.none_rate = none_rate
+        self.zero_units_rate = zero_units_rate
+        self.seed = seed
+        self.end = (end or datetime.now()).replace(hour=0, minute=0, second=0, microsecond=0)
+
+        shares = {name: share for name, (share, *_) in CATEGORIES.items()}
+        shares.update(mix or {})
+        self.categories = [name for name, share in shares.items() if share > 0]
+        p = np.array([shares[name] for name in self.categories])
+        settings = [CATEGORIES.get(name, DEFAULT_CATEGORY) for name in self.categories]
+
+        # one stream per attribute, so fund i gets the same values whatever ``funds`` is
+        def stream(k):
+            return np.random.default_rng([seed, 0, k])
+
+        self.codes = [fund_code(i) for i in range(funds)]
+        self.category = stream(0).choice(len(self.categories), size=funds, p=p / p.sum())
+        self.founder = stream(1).integers(0, FOUNDERS, size=funds)
+        self.fonturkod = np.array([settings[c][1] for c in self.category])
+        self.mean = np.array([settings[c][2] for c in self.category]) / 100
+        self.volatility = np.array([settings[c][3] for c in self.category]) / 100
+        self.price = stream(2).lognormal(1.0, 1.2, size=funds)           # price at the start of the last month
+        self.units = stream(3).lognormal(16.0, 2.0, size=funds)          # units at the start of the last month
+        self.investors = stream(4).lognormal(7.0, 2.0, size=funds) + 1   # investors at the start of the last month
+
+        # log price and log units at the start of each month, one month past the end
+        self.first_month = month_index(self.end) - months
+        prices = [np.zeros(funds)]
+        units = [np.zeros(funds)]
+        for month in range(self.first_month, month_index(self.end) + 1):
+            rng = np.random.default_rng([seed, 1, month])
+            factor = rng.normal(size=len(self.categories))[self.category]
+            own = rng.normal(size=funds)
+            prices.append(prices[-1] + self.mean + self.volatility * (0.7 * factor + 0.7 * own))
+            units.append(units[-1] + 0.01 + 0.08 * np.random.default_rng([seed, 2, month]).normal(size=funds))
+        # relative to the start of the last month, so the levels do not depend on ``months``
+        self.log_prices = np.stack(prices, axis=1) - prices[months][:, None]
+        self.log_units = np.stack(units, axis=1) - units[months][:, None]
+
+        # USDTTRY close of every day of the window, counted back from the last day
+        first_day = datetime(self.first_month // 12, self.first_month % 12 + 1, 1)
+        days = (self.end - first_day).days + 1
+        noise = np.array([self.day_noise(first_day + timedelta(days=d)) for d in range(days)])
+        steps = USDTTRY_DRIFT + USDTTRY_VOLATILITY * noise
+        log_close = np.log(USDTTRY_CLOSE) - np.concatenate([np.cumsum(steps[:0:-1])[::-1], [0.0]])
+        self.first_day = first_day
+        self.usdttry = np.exp(log_close)
+
+    def day_noise(self, dt: datetime) -> float:
+        return np.random.default_rng([self.seed, 3, month_index(dt)]).normal(size=31)[dt.day - 1]
+
+    def position(self, dt: datetime) -> tuple[int, float]:
+        """Month column of ``dt`` in the window and how far into the month it is."""
+        column = min(max(month_index(dt) - self.first_month, 0), self.months)
+        days = calendar.monthrange(dt.year, dt.month)[1]
+        return column, (dt.day - 1) / days
+
+    def at(self, series: np.ndarray, dt: datetime) -> np.ndarray:
+        column, fraction = self.position(dt)
+        return series[:, column] + fraction * (series[:, column + 1] - series[:, column])
+
+    def rng(self, *key) -> np.random.Generator:
+        return np.random.default_rng([self.seed, 4, int(hashlib.sha1(repr(key).encode()).hexdigest()[:8], 16)])
+
+    def name(self, i: int) -> str:
+        return f"{self.founder_code(i)} PORTFÖY {self.codes[i]} {self.categories[self.category[i]].upper()}"
+
+    def founder_code(self, i: int) -> str:
+        return "K" + fund_code(self.founder[i])[1:]
+
+    def fund(self, i: int) -> dict:
+        return {
+            "FONKODU": self.codes[i],
+            "FONUNVAN": self.name(i),
+            "FONTURACIKLAMA": self.categories[self.category[i]],
+            "KURUCUKODU": self.founder_code(i),
+            "FONTIPI": "YAT",
+            "FONTURKOD": int(self.fonturkod[i]),
+        }
+
+    def returns(self, first: datetime, last: datetime) -> dict:
+        """``BindComparisonFundReturns``"""
+        getiri = (np.exp(self.at(self.log_prices, last) - self.at(self.log_prices, first)) - 1) * 100
+        missing = self.rng("returns", first, last).random(self.funds) < self.none_rate
+        data = []
+        for i, value in enumerate(np.round(getiri, 6).tolist()):
+            data.append({**self.fund(i), "GETIRIORANI": None if missing[i] else value})
+        return {"draw": 0, "recordsTotal": self.funds, "recordsFiltered": self.funds, "data": data}
+
+    def sizes(self, first: datetime, last: datetime) -> dict:
+        """``BindComparisonFundSizes``"""
+        price_first = self.price * np.exp(self.at(self.log_prices, first))
+        price_last = self.price * np.exp(self.at(self.log_prices, last))
+        units_first = self.units * np.exp(self.at(self.log_units, first))
+        units_last = self.units * np.exp(self.at(self.log_units, last))
+        draw = self.rng("sizes", first, last).random(self.funds)
+        zero = draw < self.zero_units_rate
+        launched = draw < self.zero_units_rate / 2
+        units_first[zero & launched] = 0
+        units_last[zero & ~launched] = 0
+        getiri = (price_last / price_first - 1) * 100
+        columns = zip(
+            np.round(units_first * price_first, 2).tolist(), np.round(units_last * price_last, 2).tolist(),
+            np.round(units_first).tolist(), np.round(units_last).tolist(), np.round(getiri, 6).tolist(),
+        )
+        data = []
+        for i, (portfoy_first, portfoy_last, payadedi_first, payadedi_last, net) in enumerate(columns):
+            data.append({
+                **self.fund(i),
+                "ILKPORTFOYDEGERI": portfoy_first,
+                "SONPORTFOYDEGERI": portfoy_last,
+                "PORTBUYUKLUKDEGISIM": round((portfoy_last / portfoy_first - 1) * 100, 6) if portfoy_first else 0,
+                "ILKPAYADEDI": payadedi_first,
+                "SONPAYADEDI": payadedi_last,
+                "PAYADETDEGISIM": round((payadedi_last / payadedi_first - 1) * 100, 6) if payadedi_first else 0,
+                "NETGETIRIORANI": net,
+            })
+        return {"draw": 0, "recordsTotal": self.funds, "recordsFiltered": self.funds, "data": data}
+
+    def management_fees(self) -> dict:
+        """``BindComparisonManagementFees``"""
+        rng = self.rng("fees")
+        fees = np.round(rng.uniform(0.5, 4.0, self.funds), 2)
+        data = []
+        for i, fee in enumerate(fees.tolist()):
+            data.append({**self.fund(i), "UYGULANANYU": fee, "FONICTUZUKYU": fee, "FONTOPGIDERKESORANI": round(fee + 0.5, 2)})
+        return {"draw": 0, "recordsTotal": self.funds, "recordsFiltered": self.funds, "data": data}
+
+    def history(self, fonkod: str, first: datetime, last: datetime) -> dict:
+        """``BindHistoryInfo`` of one fund, newest day first; unknown codes get no rows."""
+        try:
+            i = self.codes.index(fonkod)
+        except ValueError:
+            return {"draw": 0, "recordsTotal": 0, "recordsFiltered": 0, "data": []}
+        data = []
+        dt = last
+        while dt >= first:
+            if dt.weekday() < 5:
+                column, fraction = self.position(dt)
+                log_price = self.log_prices[i, column] + fraction * (self.log_prices[i, column + 1] - self.log_prices[i, column])
+                log_units = self.log_units[i, column] + fraction * (self.log_units[i, column + 1] - self.log_units[i, column])
+                price = self.price[i] * np.exp(log_price + self.volatility[i] * 0.2 * self.day_noise(dt))
+                units = self.units[i] * np.exp(log_units)
+                data.append({
+                    "TARIH": str(calendar.timegm(dt.timetuple()) * 1000 - TEFAS_UTC_OFFSET_MS),
+                    "FONKODU": fonkod,
+                    "FONUNVAN": self.name(i),
+                    "FIYAT": round(float(price), 6),
+                    "TEDPAYSAYISI": round(float(units)),
+                    "KISISAYISI": int(self.investors[i] * np.exp(log_units)),
+                    "PORTFOYBUYUKLUK": round(float(price * units), 2),
+                    "BORSABULTENFIYAT": "-",
+                })
+            dt -= timedelta(days=1)
+        return {"draw": 0, "recordsTotal": len(data), "recordsFiltered": len(data), "data": data}
+
+    def klines(self, start_time: int, end_time: int, limit: int = 500) -> list[list]:
+        """Binance ``klines`` rows of the daily USDTTRY candles between the times (ms)."""
+        first_ms = calendar.timegm(self.first_day.timetuple()) * 1000
+        start = max(-(-(start_time - first_ms) // DAY_MS), 1)
+        stop = min((end_time - first_ms) // DAY_MS, len(self.usdttry) - 1)
+        rows = []
+        for d in range(start, stop + 1):
+            if len(rows) == limit:
+                break
+            open_time = first_ms + d * DAY_MS
+            open_, close = self.usdttry[d - 1], self.usdttry[d]
+            spread = abs(self.day_noise(self.first_day + timedelta(days=d))) * USDTTRY_VOLATILITY * 0.5
+            volume = 1e6 * (1 + abs(self.day_noise(self.first_day + timedelta(days=d - 1))))
+            rows.append([
+                open_time, f"{open_:.8f}", f"{max(open_, close) * (1 + spread):.8f}", f"{min(open_, close) * (1 - spread):.8f}", f"{close:.8f}",
+                f"{volume:.8f}", open_time + DAY_MS - 1, f"{volume * close:.8f}", int(volume / 500), f"{volume / 2:.8f}", f"{volume * close / 2:.8f}", "0",
+            ])
+        return rows
+
+    def tefas(self, endpoint: str, payload: dict) -> dict | None:
+        """The response to a TEFAS request, None for endpoints the dataset does not cover."""
+        if endpoint == "BindComparisonManagementFees":
+            return self.management_fees()
+        if "bastarih" not in payload:
+            return None
+        first, last = tefas_date(payload["bastarih"]), tefas_date(payload["bittarih"])
+        if endpoint == "BindComparisonFundReturns":
+            return self.returns(first, last)
+        if endpoint == "BindComparisonFundSizes":
+            return self.sizes(first, last)
+        if endpoint == "BindHistoryInfo":
+            return self.history(payload.get("fonkod", ""), first, last)
+        return None
+
+    def binance(self, endpoint: str, params: dict) -> dict | list | None:
+        """The response to a Binance request for USDTTRY, None for anything else."""
+        if params.get("symbol") != "USDTTRY":
+            return None
+        if endpoint == "ticker/price":
+            return {"symbol": "USDTTRY", "price": f"{self.usdttry[-1]:.8f}"}
+        if endpoint == "klines" and params.get("interval") == "1d":
+            now = calendar.timegm(self.end.timetuple()) * 1000 + DAY_MS - 1
+            end_time = int(params.get("endTime", now))
+            limit = int(params.get("limit", 500))
+            return self.klines(int(params.get("startTime", end_time - limit * DAY_MS)), end_time, limit)
+        return None
+
+
+def write(dataset: Dataset, directory: Path, history: int):
+    """Every month of the dataset as upstream responses under ``directory``."""
+    def dump(name: str, data):
+        path = directory / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(orjson.dumps(data))
+
+    last_day = dataset.end
+    for column in range(dataset.months):
+        month = dataset.first_month + 1 + column
+        first = datetime(month // 12, month % 12 + 1, 1)
+        last = min(first.replace(day=calendar.monthrange(first.year, first.month)[1]), last_day)
+        dates = f"{first:%Y%m%d}-{last:%Y%m%d}"
+        dump(f"BindComparisonFundReturns/{dates}.json", dataset.returns(first, last))
+        dump(f"BindComparisonFundSizes/{dates}.json", dataset.sizes(first, last))
+    dump("BindComparisonManagementFees.json", dataset.management_fees())
+    first = datetime(dataset.first_day.year, dataset.first_day.month, 1)
+    for fonkod in dataset.codes[:history]:
+        dump(f"BindHistoryInfo/{fonkod}.json", dataset.history(fonkod, first, last_day))
+    dump("klines/USDTTRY_1d.json", dataset.klines(calendar.timegm(first.timetuple()) * 1000, calendar.timegm(last_day.timetuple()) * 1000, len(dataset.usdttry)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--funds", type=int, default=2000)
+    parser.add_argument("--months", type=int, default=12)
+    parser.add_argument("--mix", type=parse_mix, help='category shares, e.g. "Hisse Senedi Fonu=0.3,Serbest Fon=0.2"')
+    parser.add_argument("--none-rate", type=float, default=0.02, help="share of fund list rows with GETIRIORANI None")
+    parser.add_argument("--zero-units-rate", type=float, default=0.01, help="share of BindComparisonFundSizes rows with a PAYADEDI of 0")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--end", type=tefas_date, help="last day, DD.MM.YYYY (default today)")
+    parser.add_argument("--history", type=int, default=10, help="funds whose BindHistoryInfo is written")
+    parser.add_argument("--out", type=Path, required=True)
+    args = parser.parse_args()
+    write(Dataset(args.funds, args.months, args.mix, args.none_rate, args.zero_units_rate, args.seed, args.end), args.out, args.history)
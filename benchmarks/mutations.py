@@ -0,0 +1,111 @@
+"""Per-request Mongo latency of the account/transaction write paths.
+
+Compares the old pattern (write, then ``find_one`` to read the document back)
+with the current one (response built from the write itself) against the
+database in ``config.dev.json``, using scratch ``bench_*`` collections that
+are dropped afterwards.
+
+    python -m benchmarks.mutations --requests 500
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from datetime import datetime
+
+from pymongo import ReturnDocument
+
+from app.database import mongodb
+
+
+class Bench:
+    def __init__(self):
+        self.accounts = mongodb.db["bench_accounts"]
+        self.transactions = mongodb.db["bench_transactions"]
+        self.account_id = None  # account the update cases write to
+
+
+def account():
+    now = datetime.utcnow()
+    return {"name": "bench", "currency": "USD", "balance": 0.0, "type": 1, "create_date": now, "last_update_date": now}
+
+
+def transaction(serial_number: int):
+    now = datetime.utcnow()
+    return {"serialNumber": serial_number, "account_id_High": "a", "amount_High": 1.0, "rate": 1.0, "amount_Low": 1.0, "account_id_Low": "b", "description": None, "create_date": now, "last_update_date": now}
+
+
+async def create_account_before(bench, i):
+    result = await bench.accounts.insert_one(account())
+    return await bench.accounts.find_one({"_id": result.inserted_id})
+
+
+async def create_account_after(bench, i):
+    document = account()
+    await bench.accounts.insert_one(document)
+    return document
+
+
+async def update_account_before(bench, i):
+    await bench.accounts.update_one({"_id": bench.account_id}, {"$set": account()})
+    return await bench.accounts.find_one({"_id": bench.account_id})
+
+
+async def update_account_after(bench, i):
+    return await bench.accounts.find_one_and_update({"_id": bench.account_id}, {"$set": account()}, return_document=ReturnDocument.AFTER)
+
+
+async def create_transaction_before(bench, i):
+    result = await bench.transactions.insert_one(transaction(i))
+    return await bench.transactions.find_one({"_id": result.inserted_id})
+
+
+async def create_transaction_after(bench, i):
+    document = transaction(i)
+    await bench.transactions.insert_one(document)
+    return document
+
+
+CASES = [
+    ("create_account", create_account_before, create_account_after),
+    ("update_account", update_account_before, update_account_after),
+    ("create_transaction", create_transaction_before, create_transaction_after),
+]
+
+
+async def measure(func, bench: Bench, requests: int, offset: int) -> list[float]:
+    timings = []
+    for i in range(requests):
+        started = time.perf_counter()
+        await func(bench, offset + i)
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def summary(timings: list[float]) -> str:
+    timings = sorted(timings)
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    return f"median {statistics.median(timings):7.2f} ms  p95 {p95:7.2f} ms"
+
+
+async def main(requests: int):
+    bench = Bench()
+    try:
+        bench.account_id = (await bench.accounts.insert_one(account())).inserted_id
+        for name, before, after in CASES:
+            # warm up the connection pool
+            await measure(after, bench, 10, 10 * requests)
+            timings_before = await measure(before, bench, requests, 0)
+            timings_after = await measure(after, bench, requests, requests)
+            print(f"{name:20} before: {summary(timings_before)}")
+            print(f"{'':20} after:  {summary(timings_after)}")
+    finally:
+        await bench.accounts.drop()
+        await bench.transactions.drop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests))
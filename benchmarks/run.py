@@ -0,0 +1,238 @@
+"""End-to-end latency and throughput of the API against the stand-in upstreams.
+
+Starts ``benchmarks.standin`` (recorded TEFAS/Binance responses with
+``--latency`` ± ``--jitter``, or with ``--funds`` a synthetic dataset of that
+many funds covering ``--months``), runs ``app.main:app`` and ``app_v1.main:app``
+with uvicorn on a copy of ``config.dev.json`` whose upstream URLs point at the
+stand-in and whose database is a scratch ``<name>Bench`` database (dropped
+afterwards), then sends ``--requests`` requests per scenario with
+``--concurrency`` in flight.
+
+The first request of a scenario runs on an empty database and cache and is
+reported as ``cold``; the percentiles and throughput are of the others.
+Results are compared with ``benchmarks/baseline.json``: a scenario regresses
+when its p50 or p95 is more than ``--tolerance`` slower, or its throughput
+that much lower, and the run exits with status 1.
+
+    python -m benchmarks.standin --record        # once, online
+    python -m benchmarks.run --save-baseline     # on the reference commit
+    python -m benchmarks.run                     # on the change
+    python -m benchmarks.run --funds 20000 --months 120
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+from pymongo import MongoClient
+
+from benchmarks.fixtures import Dataset, fund_code
+from benchmarks.standin import RECORDINGS, Recordings, StandIn, create_app
+
+ROOT = Path(__file__).parent.parent
+BASELINE = Path(__file__).parent / "baseline.json"
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class Server:
+    """One app under uvicorn in a subprocess, started in ``directory`` (where its config is)."""
+
+    def __init__(self, module: str, directory: Path):
+        self.module = module
+        self.directory = directory
+        self.port = free_port()
+        self.log = directory / f"{module.split('.')[0]}.log"
+        self.process: subprocess.Popen | None = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def __enter__(self):
+        env = {**os.environ, "PYTHONPATH": str(ROOT)}
+        env.pop("SERVER_ENV", None)
+        with open(self.log, "wb") as log:
+            self.process = subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", self.module, "--port", str(self.port), "--log-level", "warning"],
+                cwd=self.directory, env=env, stdout=log, stderr=subprocess.STDOUT,
+            )
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"{self.module} exited:\n{self.log.read_text()[-2000:]}")
+            try:
+                if httpx.get(f"{self.url}/metrics").status_code == 200:
+                    return self
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.2)
+        raise RuntimeError(f"{self.module} did not start:\n{self.log.read_text()[-2000:]}")
+
+    def __exit__(self, *exc):
+        self.process.terminate()
+        self.process.wait()
+
+
+class Scenario:
+    def __init__(self, name: str, app: str, method: str, path: str, params: dict | None = None, body=None):
+        self.name = name
+        self.app = app  # "v1" or "v2"
+        self.method = method
+        self.path = path
+        self.params = params
+        self.body = body  # callable(i, accounts) -> JSON body
+
+
+def scenarios(months: int, fonkod: str) -> list[Scenario]:
+    def account(i, accounts):
+        return {"name": f"bench {i}", "currency": "TRY", "balance": 0.0, "type": 1}
+
+    def transaction(i, accounts):
+        return {"account_id_High": accounts["high"], "amount_High": 1.0, "rate": 1.0, "amount_Low": 1.0, "account_id_Low": accounts["low"]}
+
+    return [
+        Scenario("fonlarin_getirisi_dolar", "v2", "GET", "/v2/tefas/fonlarin_getirisi_dolar", {"ay_sayisi": months, "paydisi": -100}),
+        Scenario("her_3ay", "v2", "GET", "/v2/tefas/fonlarin_getirisi_dolar_her_3ay", {"ay_sayisi": months, "duratioon": 3, "paydisi": -100}),
+        Scenario("NetLotArtan", "v1", "GET", "/v1/tefas/NetLotArtan"),
+        Scenario("FonAdetDegisimi", "v1", "GET", f"/v1/tefas/FonAdetDegisimi/{fonkod}", {"gun": 30}),
+        Scenario("create_account", "v1", "POST", "/v1/accounts/", body=account),
+        Scenario("get_accounts", "v1", "GET", "/v1/accounts/", {"limit": 100}),
+        Scenario("create_transaction", "v1", "POST", "/v1/transactions/", body=transaction),
+        Scenario("get_transactions", "v1", "GET", "/v1/transactions/", {"limit": 100}),
+    ]
+
+
+async def measure(client: httpx.AsyncClient, scenario: Scenario, requests: int, concurrency: int, accounts: dict) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send(i) -> float:
+        body = scenario.body(i, accounts) if scenario.body else None
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.request(scenario.method, scenario.path, params=scenario.params, json=body)
+            elapsed = (time.perf_counter() - started) * 1000
+        response.raise_for_status()
+        return elapsed
+
+    cold = await send(0)
+    started = time.perf_counter()
+    timings = sorted(await asyncio.gather(*(send(i) for i in range(1, requests))))
+    wall = time.perf_counter() - started
+    return {
+        "cold_ms": round(cold, 2),
+        "p50_ms": round(statistics.median(timings), 2),
+        "p95_ms": round(timings[max(int(len(timings) * 0.95) - 1, 0)], 2),
+        "rps": round(len(timings) / wall, 2),
+    }
+
+
+def regressions(result: dict, baseline: dict, tolerance: float) -> list[str]:
+    found = []
+    for metric in ("p50_ms", "p95_ms"):
+        if result[metric] > baseline[metric] * (1 + tolerance):
+            found.append(f"{metric} {baseline[metric]} -> {result[metric]}")
+    if result["rps"] < baseline["rps"] * (1 - tolerance):
+        found.append(f"rps {baseline['rps']} -> {result['rps']}")
+    return found
+
+
+async def bench(urls: dict, api_key: str, selected: list[Scenario], requests: int, concurrency: int) -> dict:
+    clients = {app: httpx.AsyncClient(base_url=url, headers={"access_token": api_key}, timeout=600) for app, url in urls.items()}
+    try:
+        # the two accounts the transactions move money between
+        accounts = {}
+        for side in ("high", "low"):
+            response = await clients["v1"].post("/v1/accounts/", json={"name": f"bench {side}", "currency": "TRY", "balance": 0.0, "type": 1})
+            response.raise_for_status()
+            accounts[side] = response.json()["id"]
+
+        results = {}
+        for scenario in selected:
+            results[scenario.name] = await measure(clients[scenario.app], scenario, requests, concurrency, accounts)
+            print(f"{scenario.name:26} " + "  ".join(f"{k} {v:9.2f}" for k, v in results[scenario.name].items()))
+        return results
+    finally:
+        for client in clients.values():
+            await client.aclose()
+
+
+def main(args) -> int:
+    with open(ROOT / "config.dev.json") as f:
+        config = json.load(f)
+    # one month more than the routes ask for, month_range goes back from the current month
+    dataset = Dataset(args.funds, args.months + 1, seed=args.seed) if args.funds else None
+    fonkod = args.fonkod or (fund_code(0) if dataset else "TTE")
+    selected = [s for s in scenarios(args.months, fonkod) if not args.scenarios or s.name in args.scenarios]
+
+    standin = StandIn(create_app(Recordings(args.recordings), args.latency, args.jitter, dataset=dataset), free_port())
+    with tempfile.TemporaryDirectory() as directory, standin:
+        directory = Path(directory)
+        config["database"]["name"] += "Bench"
+        config.setdefault("upstream", {}).update(tefas_url=f"{standin.url}/tefas", binance_url=f"{standin.url}/binance")
+        config.setdefault("logging", {})["level"] = "WARNING"
+        with open(directory / "config.dev.json", "w") as f:
+            json.dump(config, f)
+
+        database = config["database"]
+        mongo = MongoClient(f"mongodb://{database['user']}:{database['password']}@{database['host']}:{database['port']}/?authMechanism=DEFAULT")
+        database_name = config["app"]["name"] + "_" + database["name"]
+        mongo.drop_database(database_name)
+        try:
+            with Server("app.main:app", directory) as v2, Server("app_v1.main:app", directory) as v1:
+                results = asyncio.run(bench({"v1": v1.url, "v2": v2.url}, config["app"]["api_key"], selected, args.requests, args.concurrency))
+        finally:
+            mongo.drop_database(database_name)
+            mongo.close()
+
+    if args.save_baseline:
+        baseline = json.loads(args.baseline.read_text()) if args.baseline.exists() else {}
+        baseline.update(results)
+        args.baseline.write_text(json.dumps(baseline, indent=4) + "\n")
+        print(f"baseline saved to {args.baseline}")
+        return 0
+
+    if not args.baseline.exists():
+        print(f"no baseline at {args.baseline}, run with --save-baseline first")
+        return 0
+
+    baseline = json.loads(args.baseline.read_text())
+    failed = False
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        found = regressions(result, baseline[name], args.tolerance)
+        if found:
+            failed = True
+            print(f"REGRESSION {name}: " + ", ".join(found))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--months", type=int, default=12, help="ay_sayisi of the analytics routes")
+    parser.add_argument("--fonkod", help="fund of FonAdetDegisimi (default TTE, or the first synthetic fund)")
+    parser.add_argument("--funds", type=int, help="serve a synthetic dataset of this many funds instead of the recordings")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic dataset")
+    parser.add_argument("--latency", type=float, default=0.1, help="seconds the stand-in adds to every response")
+    parser.add_argument("--jitter", type=float, default=0.05)
+    parser.add_argument("--recordings", type=Path, default=RECORDINGS)
+    parser.add_argument("--scenarios", nargs="*", help="only these scenarios")
+    parser.add_argument("--baseline", type=Path, default=BASELINE)
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown, 0.25 = 25%%")
+    parser.add_argument("--save-baseline", action="store_true")
+    sys.exit(main(parser.parse_args()))
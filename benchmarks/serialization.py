@@ -0,0 +1,60 @@
+"""Serialization cost of a TEFAS fund list response.
+
+Encodes a ``BindComparisonFundReturns`` payload of ``--funds`` funds from
+``benchmarks.fixtures`` the ways a route can produce its body:
+
+- ``jsonable_encoder + json``: FastAPI's default for a returned dict
+- ``jsonable_encoder + orjson``: the app default response class for a returned dict
+- ``orjson``: a handler returning ``ORJSONResponse(data)``
+- ``pre-serialized``: a passthrough handler returning the cached upstream bytes
+
+    python -m benchmarks.serialization --funds 2000
+"""
+import argparse
+import json
+import statistics
+import time
+from datetime import datetime, timedelta
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+
+from benchmarks.fixtures import Dataset
+
+def payload(funds: int) -> dict:
+    # a fixed month, so every run encodes the same body
+    end = datetime(2024, 12, 31)
+    return Dataset(funds=funds, months=1, end=end).returns(end - timedelta(days=30), end)
+
+
+def measure(func, rounds: int) -> list[float]:
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def main(funds: int, rounds: int):
+    data = payload(funds)
+    content = orjson.dumps(data)
+    cases = [
+        # same options as starlette's JSONResponse.render
+        ("jsonable_encoder + json", lambda: json.dumps(jsonable_encoder(data), ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")),
+        ("jsonable_encoder + orjson", lambda: orjson.dumps(jsonable_encoder(data))),
+        ("orjson", lambda: orjson.dumps(data)),
+        ("pre-serialized", lambda: content),
+    ]
+    print(f"{funds} funds, {len(content) / 1024:.0f} KB")
+    for name, func in cases:
+        timings = measure(func, rounds)
+        print(f"{name:28} median {statistics.median(timings):8.3f} ms  min {min(timings):8.3f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--funds", type=int, default=2000)
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+    main(args.funds, args.rounds)
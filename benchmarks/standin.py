@@ -0,0 +1,275 @@
+"""Local stand-in for the TEFAS and Binance APIs.
+
+Replays recorded upstream responses with a configurable latency so the app
+can be benchmarked offline. Recordings live under ``--recordings`` as
+``tefas/<endpoint>/<key>.json`` and ``binance/<endpoint>/<key>.json`` where
+``key`` is the hash of the request payload / query. A request without an exact
+recording is answered from another recording of the same endpoint, so replays
+keep working on later days when the app asks for different date ranges:
+
+- fund lists (``BindComparisonFund*``): a recording picked by the request hash
+- ``BindHistoryInfo``: a recording of the fund (or any fund) with its rows
+  moved onto the requested weekdays
+- ``klines``: recorded candles moved onto the requested days
+
+With ``--funds`` the TEFAS fund lists, fund histories and USDTTRY candles
+come from a synthetic ``benchmarks.fixtures.Dataset`` instead, for runs at a
+given scale; recordings still answer everything else.
+
+With ``--record`` every request is forwarded to the real APIs and the
+response is saved, which is how the recordings are made:
+
+    python -m benchmarks.standin --record
+    python -m benchmarks.standin --port 8900 --latency 0.2 --jitter 0.05
+    python -m benchmarks.standin --funds 20000 --months 120
+
+Point the app at it with ``upstream.tefas_url`` = ``http://127.0.0.1:8900/tefas``
+and ``upstream.binance_url`` = ``http://127.0.0.1:8900/binance``
+(``benchmarks.run`` does that itself).
+"""
+import argparse
+import asyncio
+import calendar
+import hashlib
+import random
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from pathlib import Path
+from urllib.parse import parse_qsl
+
+import httpx
+import orjson
+import uvicorn
+from fastapi import FastAPI, Request, Response
+
+from benchmarks.fixtures import Dataset
+
+TEFAS_URL = "https://www.tefas.gov.tr/api/DB"
+BINANCE_URL = "https://api.binance.com/api/v3"
+RECORDINGS = Path(__file__).parent / "recordings"
+# rendered synthetic responses kept, a 20,000 fund list takes ~100 ms to build
+SYNTHETIC_CACHE_SIZE = 256
+DAY_MS = 24 * 60 * 60 * 1000
+# TARIH of BindHistoryInfo rows is midnight Istanbul time (UTC+3)
+TEFAS_UTC_OFFSET_MS = 3 * 60 * 60 * 1000
+
+
+def key(params: dict) -> str:
+    return hashlib.sha1(orjson.dumps(params, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+
+def tefas_date(value: str) -> datetime:
+    return datetime.strptime(value, "%d.%m.%Y")
+
+
+def weekdays(first: datetime, last: datetime) -> list[datetime]:
+    days = []
+    while first <= last:
+        if first.weekday() < 5:
+            days.append(first)
+        first += timedelta(days=1)
+    return days
+
+
+class Recordings:
+    """Recorded responses on disk, one JSON file per request."""
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        self.listings: dict[tuple[str, str], list[Path]] = {}
+
+    def path(self, upstream: str, endpoint: str, params: dict) -> Path:
+        return self.directory / upstream / endpoint / f"{key(params)}.json"
+
+    def get(self, upstream: str, endpoint: str, params: dict) -> bytes | None:
+        path = self.path(upstream, endpoint, params)
+        return path.read_bytes() if path.exists() else None
+
+    def save(self, upstream: str, endpoint: str, params: dict, content: bytes):
+        path = self.path(upstream, endpoint, params)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(content)
+        self.listings.pop((upstream, endpoint), None)
+
+    def listing(self, upstream: str, endpoint: str) -> list[Path]:
+        if (upstream, endpoint) not in self.listings:
+            self.listings[(upstream, endpoint)] = sorted((self.directory / upstream / endpoint).glob("*.json"))
+        return self.listings[(upstream, endpoint)]
+
+    def pick(self, upstream: str, endpoint: str, params: dict) -> dict | None:
+        """Any recording of the endpoint, the same one for the same request."""
+        paths = self.listing(upstream, endpoint)
+        if not paths:
+            return None
+        return orjson.loads(paths[int(key(params), 16) % len(paths)].read_bytes())
+
+    def history(self, fonkod: str) -> list[dict]:
+        """Recorded ``BindHistoryInfo`` rows of ``fonkod``, or of the first recorded fund."""
+        fallback = None
+        for path in self.listing("tefas", "BindHistoryInfo"):
+            rows = orjson.loads(path.read_bytes())["data"]
+            if not rows:
+                continue
+            if rows[0].get("FONKODU") == fonkod:
+                return rows
+            fallback = fallback or rows
+        return fallback or []
+
+
+def replay_tefas(recordings: Recordings, endpoint: str, payload: dict) -> bytes | None:
+    content = recordings.get("tefas", endpoint, payload)
+    if content is not None:
+        return content
+
+    if endpoint == "BindHistoryInfo":
+        recorded = recordings.history(payload.get("fonkod", ""))
+        if not recorded:
+            return None
+        days = weekdays(tefas_date(payload["bastarih"]), tefas_date(payload["bittarih"]))
+        rows = []
+        for i, dt in enumerate(days):
+            row = dict(recorded[i % len(recorded)])
+            row["TARIH"] = str(calendar.timegm(dt.timetuple()) * 1000 - TEFAS_UTC_OFFSET_MS)
+            row["FONKODU"] = payload.get("fonkod") or row.get("FONKODU")
+            rows.append(row)
+        return orjson.dumps({"draw": 0, "recordsTotal": len(rows), "recordsFiltered": len(rows), "data": rows})
+
+    data = recordings.pick("tefas", endpoint, payload)
+    return orjson.dumps(data) if data is not None else None
+
+
+def replay_binance(recordings: Recordings, endpoint: str, params: dict) -> bytes | None:
+    content = recordings.get("binance", endpoint, params)
+    if content is not None:
+        return content
+
+    recorded = recordings.pick("binance", endpoint, params)
+    if recorded is None:
+        return None
+    if endpoint != "klines":
+        return orjson.dumps(recorded)
+
+    # daily candles from startTime to endTime, none in the future
+    limit = int(params.get("limit", 500))
+    last = min(int(params.get("endTime", time.time() * 1000)), int(time.time() * 1000))
+    first = int(params.get("startTime", last - DAY_MS * (limit - 1)))
+    first = -(-first // DAY_MS) * DAY_MS
+    rows = []
+    for i, open_time in enumerate(range(first, last + 1, DAY_MS)):
+        if i == limit or not recorded:
+            break
+        row = list(recorded[i % len(recorded)])
+        row[0] = open_time
+        row[6] = open_time + DAY_MS - 1
+        rows.append(row)
+    return orjson.dumps(rows)
+
+
+class Synthetic:
+    """Rendered responses of a ``Dataset``, the most recent ones kept."""
+
+    def __init__(self, dataset: Dataset, size: int = SYNTHETIC_CACHE_SIZE):
+        self.dataset = dataset
+        self.size = size
+        self.bodies: OrderedDict[str, bytes | None] = OrderedDict()
+
+    def get(self, upstream: str, endpoint: str, params: dict) -> bytes | None:
+        body_key = key({"upstream": upstream, "endpoint": endpoint, **params})
+        if body_key in self.bodies:
+            self.bodies.move_to_end(body_key)
+            return self.bodies[body_key]
+        data = self.dataset.tefas(endpoint, params) if upstream == "tefas" else self.dataset.binance(endpoint, params)
+        body = orjson.dumps(data) if data is not None else None
+        self.bodies[body_key] = body
+        while len(self.bodies) > self.size:
+            self.bodies.popitem(last=False)
+        return body
+
+
+def create_app(recordings: Recordings, latency: float = 0.0, jitter: float = 0.0, record: bool = False, dataset: Dataset | None = None) -> FastAPI:
+    """The stand-in app; responses are delayed by ``latency`` ± ``jitter`` seconds.
+
+    With a ``dataset`` the requests it covers are answered from it, the
+    others from the recordings.
+    """
+    app = FastAPI()
+    client = httpx.AsyncClient(timeout=60) if record else None
+    synthetic = Synthetic(dataset) if dataset is not None else None
+
+    async def delay():
+        if latency or jitter:
+            await asyncio.sleep(max(0.0, random.uniform(latency - jitter, latency + jitter)))
+
+    async def forward(upstream: str, endpoint: str, params: dict, method: str, url: str, **kwargs) -> Response:
+        response = await client.request(method, url, **kwargs)
+        if response.status_code == 200:
+            recordings.save(upstream, endpoint, params, response.content)
+        return Response(response.content, status_code=response.status_code, media_type="application/json")
+
+    @app.post("/tefas/{endpoint}")
+    async def tefas(endpoint: str, request: Request):
+        payload = dict(parse_qsl((await request.body()).decode(), keep_blank_values=True))
+        if record:
+            return await forward("tefas", endpoint, payload, "POST", f"{TEFAS_URL}/{endpoint}", data=payload)
+        await delay()
+        content = synthetic.get("tefas", endpoint, payload) if synthetic else None
+        if content is None:
+            content = replay_tefas(recordings, endpoint, payload)
+        if content is None:
+            return Response(orjson.dumps({"detail": f"no recording for {endpoint}"}), status_code=404, media_type="application/json")
+        return Response(content, media_type="application/json")
+
+    @app.get("/binance/{endpoint:path}")
+    async def binance(endpoint: str, request: Request):
+        params = dict(request.query_params)
+        if record:
+            return await forward("binance", endpoint, params, "GET", f"{BINANCE_URL}/{endpoint}", params=params)
+        await delay()
+        content = synthetic.get("binance", endpoint, params) if synthetic else None
+        if content is None:
+            content = replay_binance(recordings, endpoint, params)
+        if content is None:
+            return Response(orjson.dumps({"detail": f"no recording for {endpoint}"}), status_code=404, media_type="application/json")
+        return Response(content, media_type="application/json")
+
+    return app
+
+
+class StandIn:
+    """Runs the stand-in in a background thread (for ``benchmarks.run``)."""
+
+    def __init__(self, app: FastAPI, port: int):
+        self.port = port
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def __enter__(self):
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.05)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--recordings", type=Path, default=RECORDINGS)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="seconds, latency varies by up to this much")
+    parser.add_argument("--record", action="store_true", help="forward to the real APIs and save the responses")
+    parser.add_argument("--funds", type=int, help="answer from a synthetic dataset of this many funds")
+    parser.add_argument("--months", type=int, default=12, help="months of the synthetic dataset")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic dataset")
+    args = parser.parse_args()
+    dataset = Dataset(args.funds, args.months, seed=args.seed) if args.funds else None
+    uvicorn.run(create_app(Recordings(args.recordings), args.latency, args.jitter, args.record, dataset), host="127.0.0.1", port=args.port)
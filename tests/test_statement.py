@@ -0,0 +1,165 @@
+"""/v1/accounts/{account_id}/statement against a MongoDB server, checked with a
+Python fold of the same transactions.
+
+Uses the server in ``config.dev.json`` and a scratch ``<name>_test`` database
+that is dropped afterwards; skipped when no server is reachable or it is older
+than 5.0 ($dateTrunc, $setWindowFields).
+
+    python -m pytest tests
+"""
+import asyncio
+import random
+import zoneinfo
+from datetime import datetime, timedelta, timezone as tz
+
+import pytest
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import PyMongoError
+
+from app_v1.database import database_name, mongodb, mongodb_uri
+from app_v1.main import entry_cursor, statement_entries, statement_pipeline
+
+ACCOUNT = "6650c0ffee0000000000000a"
+OTHER = "6650c0ffee0000000000000b"
+BALANCE = 1000.0  # current balance of ACCOUNT
+
+
+def transactions(count: int = 300) -> list[dict]:
+    rng = random.Random(7)
+    start = datetime(2024, 1, 1)
+    result = []
+    for serial_number in range(1, count + 1):
+        high, low = (ACCOUNT, OTHER) if rng.random() < 0.5 else (OTHER, ACCOUNT)
+        amount = round(rng.uniform(1, 100), 2)
+        result.append({
+            "serialNumber": serial_number,
+            "account_id_High": high,
+            "amount_High": amount,
+            "rate": 1.0,
+            "amount_Low": amount,
+            "account_id_Low": low,
+            "description": None,
+            # several per hour, so some land on the same create_date
+            "create_date": start + timedelta(hours=rng.randrange(24 * 200)),
+            "applied": True,
+        })
+    # not in the balance yet, and deleted but not yet reversed
+    result[0].update(applied=False, create_date=datetime(2024, 3, 10, 12))
+    result[1].update(applied=False, reverting=True, create_date=datetime(2024, 3, 10, 12))
+    return result
+
+
+def amount(transaction: dict) -> float:
+    return (transaction["amount_Low"] if transaction["account_id_Low"] == ACCOUNT else 0) - (transaction["amount_High"] if transaction["account_id_High"] == ACCOUNT else 0)
+
+
+def period_start(date: datetime, period: str, timezone: str) -> datetime:
+    local = date.replace(tzinfo=tz.utc).astimezone(zoneinfo.ZoneInfo(timezone))
+    local = local.replace(hour=0, minute=0, second=0, microsecond=0)
+    if period == "week":
+        local -= timedelta(days=local.weekday())
+    elif period == "month":
+        local = local.replace(day=1)
+    # the start of the local day, as a naive UTC datetime like Mongo returns it
+    return local.replace(tzinfo=None) - local.utcoffset()
+
+
+def fold(documents: list[dict], start: datetime, end: datetime, period: str, timezone: str) -> dict:
+    """The statement computed in Python."""
+    counted = sorted(
+        (document for document in documents if document.get("applied") or document.get("reverting")),
+        key=lambda document: (document["create_date"], document["serialNumber"])
+    )
+    opening = BALANCE - sum(amount(document) for document in counted if document["create_date"] >= start)
+    balance = opening
+    entries = []
+    periods = {}
+    for document in counted:
+        if not start <= document["create_date"] <= end:
+            continue
+        balance += amount(document)
+        entries.append({"serialNumber": document["serialNumber"], "create_date": document["create_date"], "description": None, "amount": amount(document), "balance": balance})
+        totals = periods.setdefault(period_start(document["create_date"], period, timezone), {"credit": 0.0, "debit": 0.0, "net": 0.0, "count": 0})
+        totals["credit"] += max(amount(document), 0)
+        totals["debit"] += max(-amount(document), 0)
+        totals["net"] += amount(document)
+        totals["count"] += 1
+    running = opening
+    result = []
+    for first in sorted(periods):
+        running += periods[first]["net"]
+        result.append({"start": first, **periods[first], "balance": running})
+    return {"opening_balance": opening, "closing_balance": balance, "periods": result, "entries": entries}
+
+
+@pytest.fixture(scope="module")
+def database():
+    async def connect():
+        client = AsyncIOMotorClient(mongodb_uri, serverSelectionTimeoutMS=2000)
+        try:
+            info = await client.server_info()
+        except PyMongoError as e:
+            pytest.skip(f"No MongoDB server: {e}")
+        if int(info["version"].split(".")[0]) < 5:
+            pytest.skip(f"MongoDB {info['version']} has no $dateTrunc/$setWindowFields")
+        return client
+
+    loop = asyncio.new_event_loop()
+    client = loop.run_until_complete(connect())
+    mongodb.client = client
+    mongodb.db = client[f"{database_name}_test"]
+    documents = transactions()
+    loop.run_until_complete(mongodb.db["transactions"].insert_many([dict(document) for document in documents]))
+    yield loop, documents
+    loop.run_until_complete(client.drop_database(f"{database_name}_test"))
+    client.close()
+    loop.close()
+
+
+async def statement(start: datetime, end: datetime, period: str, timezone: str, after: tuple[datetime, int] | None = None, limit: int | None = None) -> dict:
+    pipeline = statement_pipeline(ACCOUNT, BALANCE, start, end, period, timezone, after)
+    result = (await mongodb.db["transactions"].aggregate(pipeline).to_list(length=1))[0]
+    result["entries"] = [entry async for entry in statement_entries(ACCOUNT, start, end, result.pop("carried"), after, limit)]
+    return result
+
+
+def assert_close(actual, expected):
+    if isinstance(expected, dict):
+        assert actual.keys() == expected.keys()
+        for key in expected:
+            assert_close(actual[key], expected[key])
+    elif isinstance(expected, list):
+        assert len(actual) == len(expected)
+        for a, e in zip(actual, expected):
+            assert_close(a, e)
+    elif isinstance(expected, float):
+        assert actual == pytest.approx(expected)
+    else:
+        assert actual == expected
+
+
+@pytest.mark.parametrize("period", ["day", "week", "month"])
+@pytest.mark.parametrize("timezone", ["UTC", "Europe/Istanbul", "America/New_York"])
+def test_statement_matches_fold(database, period, timezone):
+    loop, documents = database
+    start, end = datetime(2024, 2, 1), datetime(2024, 6, 1)
+    assert_close(loop.run_until_complete(statement(start, end, period, timezone)), fold(documents, start, end, period, timezone))
+
+
+def test_statement_pages_match_fold(database):
+    loop, documents = database
+    start, end = datetime(2024, 1, 15), datetime(2024, 7, 1)
+    expected = fold(documents, start, end, "month", "UTC")
+    entries = []
+    after = None
+    while True:
+        page = loop.run_until_complete(statement(start, end, "month", "UTC", after, limit=37))
+        # the totals do not depend on the page
+        assert page["opening_balance"] == pytest.approx(expected["opening_balance"])
+        assert page["closing_balance"] == pytest.approx(expected["closing_balance"])
+        entries += page["entries"]
+        if len(page["entries"]) < 37:
+            break
+        last = page["entries"][-1]
+        after = entry_cursor(f"{last['create_date'].isoformat()},{last['serialNumber']}")
+    assert_close(entries, expected["entries"])